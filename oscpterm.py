@@ -1,81 +1,116 @@
 #!/usr/bin/env python3
+import time
+STARTUP_BEGIN = time.perf_counter()  # --startup-profile measures from here
+import argparse
+import atexit
+import functools
+import glob
 import subprocess
 import sqlite3
 import re
-import time
+import shlex
 import json
 import base64
+import array
+import bisect
+import contextlib
 import hashlib
+import heapq
+import html
+import importlib
+import importlib.util
+import mmap
 from datetime import datetime
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import InMemoryHistory
-from prompt_toolkit.completion import WordCompleter, Completer, Completion
-from prompt_toolkit.shortcuts import confirm
-from prompt_toolkit.formatted_text import HTML
 import os
+import queue
 import shutil
+import signal
+import struct
+import tempfile
 from pathlib import Path
+from urllib.parse import urlsplit
 import pty
 import select
 import termios
 import tty
 import sys
 import threading
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import warnings
-warnings.filterwarnings("ignore", category=DeprecationWarning)
-
-try:
-    from rich.console import Console
-    from rich.theme import Theme
-    from rich.syntax import Syntax
-    from rich.panel import Panel
-    from rich.table import Table
-    from rich.progress import track
-    from rich.markdown import Markdown
-    RICH_AVAILABLE = True
-except ImportError:
-    RICH_AVAILABLE = False
-    print("⚠️ Rich not available - install with: pip install rich")
+import xml.etree.ElementTree as ET
+IMPORTS_END = time.perf_counter()
 
-try:
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Preformatted, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.lib.colors import HexColor
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-    print("⚠️ ReportLab not available - install with: pip install reportlab")
+# ─────────────── OPTIONAL DEPENDENCIES ───────────────
+# Heavy optional modules are imported on first use, not at startup.
+# capability -> (label, [(module, names bound as globals)], install hint);
+# an empty names tuple binds the module itself.
+OPTIONAL_DEPENDENCIES = {
+    'prompt': ("prompt_toolkit", [('prompt_toolkit', ('PromptSession',)), ('prompt_toolkit.history', ('History', 'ThreadedHistory')),
+                                  ('prompt_toolkit.completion', ('Completer', 'Completion')),
+                                  ('prompt_toolkit.shortcuts', ('confirm',)),
+                                  ('prompt_toolkit.patch_stdout', ('patch_stdout',))],
+               "pip install prompt_toolkit"),
+    'rich': ("Rich", [('rich.console', ('Console',)), ('rich.theme', ('Theme',)),
+                      ('rich.panel', ('Panel',)), ('rich.table', ('Table',))],
+             "pip install rich"),
+    'pdf': ("ReportLab", [('reportlab.lib.pagesizes', ('letter', 'A4')),
+                          ('reportlab.platypus', ('SimpleDocTemplate', 'Paragraph', 'Spacer', 'Preformatted', 'PageBreak')),
+                          ('reportlab.lib.styles', ('getSampleStyleSheet', 'ParagraphStyle')),
+                          ('reportlab.lib.units', ('inch',)), ('reportlab.lib.colors', ('HexColor',))],
+            "pip install reportlab"),
+    'pdf_merge': ("pypdf", [('pypdf', ('PdfWriter',))], "pip install pypdf"),
+    'pil': ("Pillow", [('PIL', ('Image', 'ImageColor', 'ImageDraw', 'ImageFont'))], "pip install pillow"),
+    'screen': ("Screen capture", [('pyautogui', ())], "pip install pyautogui"),
+    'asciinema': ("Asciinema", [('asciinema', ())], "pip install asciinema"),
+    'gif': ("GIF export", [('imageio', ())], "pip install imageio[ffmpeg]"),
+}
+CAPABILITIES = {}        # capability -> True/False once a load was attempted
+CAPABILITY_TIMINGS = {}  # capability -> seconds spent importing it
 
-try:
-    import pyautogui
-    from PIL import Image, ImageDraw, ImageFont
-    SCREENSHOT_AVAILABLE = True
-except ImportError:
-    SCREENSHOT_AVAILABLE = False
-    print("⚠️ Screenshot tools not available - install with: pip install pyautogui pillow")
+# Names require() binds, declared so they exist (as None) until their capability loads
+PromptSession = History = ThreadedHistory = Completer = Completion = confirm = patch_stdout = None
+Console = Theme = Panel = Table = None
+letter = A4 = SimpleDocTemplate = Paragraph = Spacer = Preformatted = PageBreak = None
+getSampleStyleSheet = ParagraphStyle = inch = HexColor = PdfWriter = None
+Image = ImageColor = ImageDraw = ImageFont = pyautogui = asciinema = imageio = None
 
-try:
-    import asciinema.asciicast as asciicast
-    from asciinema.asciicast.v2 import Writer
-    ASCIINEMA_AVAILABLE = True
-except ImportError:
-    ASCIINEMA_AVAILABLE = False
-    print("⚠️ Asciinema not available - install with: pip install asciinema")
+def probe_capability(name):
+    """Cheap availability check: are the packages installed (nothing is imported)"""
+    if name in CAPABILITIES:
+        return CAPABILITIES[name]
+    return all(importlib.util.find_spec(module.split('.')[0]) is not None
+               for module, _ in OPTIONAL_DEPENDENCIES[name][1])
 
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    import imageio
-    GIF_AVAILABLE = True
-except ImportError:
-    GIF_AVAILABLE = False
-    print("⚠️ GIF export not available - install with: pip install imageio[ffmpeg]")
+def require(name, quiet=False):
+    """Import an optional capability on first use and bind its names globally.
+    
+    Returns whether it is usable; the install hint is printed once when not.
+    """
+    if name not in CAPABILITIES:
+        label, imports, hint = OPTIONAL_DEPENDENCIES[name]
+        start = time.perf_counter()
+        try:
+            for module_name, names in imports:
+                module = importlib.import_module(module_name)
+                if not names:
+                    globals()[module_name.rsplit('.', 1)[-1]] = module
+                for attr in names:
+                    # Same lookup as "from module import attr", submodules included
+                    globals()[attr] = getattr(module, attr) if hasattr(module, attr) else \
+                        importlib.import_module(f"{module_name}.{attr}")
+            CAPABILITIES[name] = True
+        except Exception:  # ImportError, or pyautogui's KeyError without $DISPLAY
+            CAPABILITIES[name] = False
+            if not quiet and not QUIET:
+                print(f"⚠️ {label} not available - install with: {hint}")
+        CAPABILITY_TIMINGS[name] = time.perf_counter() - start
+        if name == 'rich' and CAPABILITIES[name]:
+            set_console_theme()
+    return CAPABILITIES[name]
 
 DB_PATH = "redterm_logs.db"
 ENGAGEMENT = "default"
-history = InMemoryHistory()
 
 # Terminal recording variables
 RECORDING = False
@@ -83,11 +118,76 @@ RECORDING_START_TIME = None
 RECORDING_DATA = []
 RECORDINGS_DIR = "recordings"
 
+# Structured nmap results: nmap-* aliases also write XML, loaded while the scan runs
+NMAP_XML_DIR = "nmap_xml"
+NMAP_INGEST_BATCH = 50  # hosts per transaction
+
+# Offline hash lookup: wordlists pre-hashed into sorted, memory-mapped index files
+HASH_INDEX_DIR = "hash_index"
+HASH_DEFAULT_WORDLIST = "/usr/share/wordlists/rockyou.txt"
+HASH_INDEX_BLOCK_SIZE = 4 * 1024 * 1024  # Wordlist bytes hashed and sorted per worker task
+HASH_RECORD_SIZE = 16         # 8-byte digest prefix + 8-byte wordlist offset
+
+# :import / --import of tool output files written outside the terminal
+IMPORT_WORKERS = None         # Worker processes (None: one per CPU)
+IMPORT_BATCH_SIZE = 50        # Files per database transaction
+IMPORT_CHUNK_SIZE = 1024 * 1024
+IMPORT_SNIFF_SIZE = 8192      # Leading bytes used to recognise the tool
+
+# Run-to-run diffs (:diff and the automatic report when a parsed tool re-runs)
+DIFF_SHOW_LIMIT = 50  # Lines shown per added/removed/changed list
+DIFF_IGNORE_RE = re.compile(r'\d{4}[-/]\d{2}[-/]\d{2}[ T]\d{2}:\d{2}|\b(?:latency|elapsed|seconds?)\b|^Nmap done|'
+                            r'^Starting |Progress:', re.IGNORECASE)
+
+# Non-interactive operation (--batch and the library API)
+BATCH_MODE = False        # Never prompt; confirmations get BATCH_ASSUME_YES
+BATCH_ASSUME_YES = False
+QUIET = False             # Suppress status messages and live command output
+
+# Persistent shell: run commands in one long-lived bash instead of sh -c per command
+PERSISTENT_SHELL = False
+PERSISTENT_SHELL_PATH = "/bin/bash"
+
+# Result cache: replay output of slow, deterministic commands instead of re-running them
+RESULT_CACHE = False  # Opt-in (:cache on / --cache)
+
+# Output normalization: stored output is the text left on screen, not the raw stream
+OUTPUT_KEEP_SGR = False   # Keep colour codes in stored output (evidence images render them)
+KEEP_RAW_OUTPUT = False   # Also store the unprocessed stream in command_logs.raw_output
+
+# Startup timing (--startup-profile)
+STARTUP_BUDGET_MS = 200
+STARTUP_TIMINGS = []  # (component, seconds) for each init step in main()
+
 # Working directory tracking
 CURRENT_WORKING_DIR = os.getcwd()
 
-# Extracted highlights storage
-HIGHLIGHTS = defaultdict(set)
+# Extracted highlights storage (HIGHLIGHTS itself is created after its class, below)
+IPSET_MERGE_THRESHOLD = 65536  # Pending IPs merged into the sorted array at this size
+HIGHLIGHT_CACHE_SIZE = 10000   # Recently stored values remembered to skip re-inserts
+HIGHLIGHT_PAGE_SIZE = 25       # Values per category per :highlights page
+
+# Rows fetched per round-trip when streaming exports
+EXPORT_BATCH_SIZE = 500
+EXPORT_COPY_BUFFER = 1024 * 1024
+EXPORT_EXTENSIONS = {'markdown': 'md', 'json': 'json', 'ndjson': 'ndjson'}
+EXPORT_ALL_FORMATS = ('markdown', 'json', 'pdf', 'html')
+
+# Report build cache: rendered sections plus a manifest per artifact
+REPORT_CACHE_DIR = ".report_cache"
+REPORT_CHUNK_SIZE = 1000        # Command ids per cached export chunk
+REPORT_MANIFEST_VERSION = 1
+DASHBOARD_PAGE_SIZE = 5000      # Highlight values per dashboard data page
+
+# PDF report pipeline settings
+PDF_REPORT_CONFIG = {
+    'group_by': 'day',          # Timeline sections: 'day' or 'host'
+    'output_limit': 1000,       # Characters of output kept per command
+    'truncation': 'head',       # 'head', 'head_tail' or 'none'
+    'sampling': 'all',          # 'all', 'head_tail', 'stride' or 'flagged'
+    'sample_size': 200,         # Commands kept per section when sampling
+    'workers': 0                # >0 renders sections in a process pool
+}
 
 # Command timeouts (in seconds)
 COMMAND_TIMEOUTS = {
@@ -103,6 +203,15 @@ COMMAND_TIMEOUTS = {
     'masscan': 3600
 }
 
+# Result cache lifetimes (in seconds), looked up by alias, then program.
+# Commands not listed here are never cached.
+CACHE_TTLS = {
+    'searchsploit': 86400,  # exploit-db mirror changes daily at most
+    'whatweb': 3600,
+    'nmap-ping': 600,       # host discovery on the same range
+    '--help': 604800        # usage text of any tool (trailing --help / -h)
+}
+
 # Auto-extraction patterns
 EXTRACTION_PATTERNS = {
     'ip_addresses': {
@@ -206,12 +315,33 @@ THEMES = {
 CURRENT_THEME = 'default'
 AUTO_SCREENSHOT = False
 SCREENSHOT_DIR = "screenshots"
+SCREENSHOT_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+SCREENSHOT_DB_BATCH = 20  # screenshots rows written per transaction
+SCREENSHOT_HASH_SIZE = 16       # dHash grid; terminal text needs more than the usual 8x8
+SCREENSHOT_DEDUP_THRESHOLD = 3  # Max dHash bit distance treated as "same screen" (0 = off)
+SCREENSHOT_FORMAT = 'png'        # 'png' or 'webp'
+SCREENSHOT_WEBP_QUALITY = 80
+SCREENSHOT_THUMBNAILS = False
+SCREENSHOT_THUMBNAIL_SIZE = (320, 180)
+SCREENSHOT_MODE = 'auto'  # 'screen' (pyautogui grab), 'text' (rendered from output) or 'auto'
+
+# Text-rendered evidence images (headless screenshots)
+EVIDENCE_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"
+EVIDENCE_BOLD_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf"
+EVIDENCE_FONT_SIZE = 14
+EVIDENCE_COLUMNS = 120     # Wrap width in cells
+EVIDENCE_MAX_LINES = 200   # Output lines rendered before truncating
+EVIDENCE_BACKGROUND = '#1e1e1e'
+EVIDENCE_FOREGROUND = '#d0d0d0'
+EVIDENCE_WORKERS = None    # Batch render processes (None = CPU count)
+
+# Rich console, created when rich is first loaded
+console = None
 
-# Rich console setup
-if RICH_AVAILABLE:
+def set_console_theme():
+    """(Re)build the rich console for the current theme"""
+    global console
     console = Console(theme=Theme(THEMES[CURRENT_THEME]))
-else:
-    console = None
 
 # ─────────────── CONFIGURATION ───────────────
 ALIASES = {
@@ -275,57 +405,249 @@ SENSITIVE_PATTERNS = [
 ]
 
 # ─────────────── CUSTOM COMPLETER ───────────────
-class RedTermCompleter(Completer):
+COMPLETION_LIMIT = 50  # Candidates offered per keystroke
+HISTORY_PAGE_SIZE = 500      # Rows per round-trip when reading history from command_logs
+HISTORY_SEARCH_LIMIT = 20    # Distinct matches shown by :history
+
+class CompletionIndex:
+    """Sorted in-memory indexes behind tab completion.
+    
+    Engagements, aliases and the engagement's previous commands are each
+    kept as a sorted list and matched by bisecting to the prefix. Lists are
+    built on first use and kept current by the write paths (log_command,
+    engagement switches) rather than re-queried. Highlight values are
+    unbounded, so they are looked up with a prefix range scan on the
+    (engagement, value) index instead.
+    """
+    
+    def __init__(self):
+        self.aliases = None
+        self.engagements = None
+        self.history = None
+        self.history_engagement = None
+    
+    @staticmethod
+    def prefix_matches(index, prefix, limit=None):
+        """Entries of a sorted list starting with prefix, in order"""
+        limit = limit or COMPLETION_LIMIT
+        matches = []
+        for i in range(bisect.bisect_left(index, prefix), len(index)):
+            if not index[i].startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(index[i])
+        return matches
+    
+    @staticmethod
+    def _insert(index, value):
+        i = bisect.bisect_left(index, value)
+        if i == len(index) or index[i] != value:
+            index.insert(i, value)
+    
+    def _query(self, sql, params=()):
+        try:
+            conn = sqlite3.connect(DB_PATH)
+            rows = [row[0] for row in conn.execute(sql, params) if row[0]]
+            conn.close()
+            return rows
+        except sqlite3.Error:
+            return []
+    
+    def get_aliases(self):
+        if self.aliases is None:
+            self.aliases = sorted(ALIASES)
+        return self.aliases
+    
+    def get_engagements(self):
+        if self.engagements is None:
+            self.engagements = sorted(set(self._query("SELECT DISTINCT engagement FROM command_logs")) | {ENGAGEMENT})
+        return self.engagements
+    
+    def get_history(self):
+        if self.history is None or self.history_engagement != ENGAGEMENT:
+            self.history = sorted(set(self._query("SELECT DISTINCT command FROM command_logs WHERE engagement=?",
+                                                  (ENGAGEMENT,))))
+            self.history_engagement = ENGAGEMENT
+        return self.history
+    
+    def value_matches(self, prefix):
+        """Highlight values starting with prefix, in order"""
+        return self._query("""SELECT DISTINCT value FROM highlights WHERE engagement=? AND value >= ? AND value < ?
+                              ORDER BY value LIMIT ?""", (ENGAGEMENT, prefix, prefix + '\U0010ffff', COMPLETION_LIMIT))
+    
+    def note_command(self, engagement, command):
+        """Keep the indexes current after a command is logged"""
+        if self.engagements is not None:
+            self._insert(self.engagements, engagement)
+        if self.history is not None and self.history_engagement == engagement:
+            self._insert(self.history, command)
+    
+    def invalidate(self):
+        """Drop the engagement-scoped indexes (e.g. after :clear)"""
+        self.engagements = self.history = None
+
+COMPLETION_INDEX = CompletionIndex()
+
+class RedTermCompleter:
+    """Completion rules; combined with prompt_toolkit's Completer in create_prompt_session()"""
+    
+    commands = sorted([':engage', ':log', ':clear', ':status', ':exit', ':help', ':alias',
+                       ':search', ':tag', ':export', ':screenshot', ':theme', ':dashboard',
+                       ':record', ':highlights', ':extract', ':history', ':shell',
+                       ':cache', ':nocache', ':host', ':hashes', ':diff', ':import'])
+    subcommands = {
+        ':record': sorted(['start', 'stop', 'list', 'play', 'export']),
+        ':export': sorted(['markdown', 'json', 'ndjson', 'pdf', 'all', '--since']),
+        ':screenshot': sorted(['auto', 'toggle', 'text']),
+        ':search': sorted(['command', 'output', 'tags', 'all']),
+        ':log': sorted(['full', 'raw']),
+        ':history': ['prefix'],
+        ':shell': sorted(['persistent', 'fresh', 'restart']),
+        ':cache': sorted(['on', 'off', 'clear']),
+        ':hashes': sorted(['index', 'crack']),
+        ':theme': sorted(THEMES),
+    }
+    
     def get_completions(self, document, complete_event):
         text = document.text_before_cursor
+        if not text.strip():
+            return
+        words = text.split()
+        word = '' if text[-1].isspace() else words[-1]
+        index = COMPLETION_INDEX
         
-        # Command completion
+        # Internal commands and their arguments
         if text.startswith(':'):
-            commands = [':engage', ':log', ':clear', ':status', ':exit', ':help', ':alias', 
-                       ':search', ':tag', ':export', ':screenshot', ':theme', ':dashboard', 
-                       ':record', ':highlights', ':extract']
-            for cmd in commands:
-                if cmd.startswith(text):
-                    yield Completion(cmd[len(text):])
-        
-        # Record subcommands
-        elif text.startswith(':record '):
-            subcommands = ['start', 'stop', 'list', 'play', 'export']
-            for sub in subcommands:
-                if sub.startswith(text.split()[-1]):
-                    yield Completion(sub[len(text.split()[-1]):])
-        
-        # Alias completion
-        elif any(text.startswith(alias) for alias in ALIASES.keys()):
-            for alias in ALIASES.keys():
-                if alias.startswith(text.split()[0]):
-                    yield Completion(alias)
-        
-        # Engagement completion
-        elif text.startswith(':engage '):
-            engagements = self.get_engagements()
-            for eng in engagements:
-                if eng.startswith(text.split()[-1]):
-                    yield Completion(eng[len(text.split()[-1]):])
+            if len(words) == 1 and word:
+                candidates = index.prefix_matches(self.commands, word)
+            elif words[0] == ':engage':
+                candidates = index.prefix_matches(index.get_engagements(), word)
+            else:
+                candidates = index.prefix_matches(self.subcommands.get(words[0], []), word)
+            for candidate in candidates:
+                yield Completion(candidate, start_position=-len(word))
+            return
+        
+        # Whole previous command lines, then aliases or highlight values for the current word
+        for previous in index.prefix_matches(index.get_history(), text):
+            if previous != text:
+                yield Completion(previous, start_position=-len(text), display_meta="history")
+        if not word:
+            return
+        if len(words) == 1:
+            for alias in index.prefix_matches(index.get_aliases(), word):
+                yield Completion(alias, start_position=-len(word), display_meta="alias")
+        else:
+            for value in index.value_matches(word):
+                yield Completion(value, start_position=-len(word), display_meta="highlight")
+
+class CommandLogHistory:
+    """Prompt history read from command_logs for one engagement.
     
-    def get_engagements(self):
-        try:
+    Newest first and deduplicated, paged from the database as prompt_toolkit
+    consumes it (in a background thread), so startup never waits for it.
+    Combined with prompt_toolkit's History in create_prompt_session().
+    """
+    
+    def __init__(self, engagement):
+        super().__init__()
+        self.engagement = engagement
+    
+    def load_history_strings(self):
+        seen = set()
+        last_id = None
+        while True:
+            # One short query per page so no read lock is held between pages
             conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT DISTINCT engagement FROM command_logs")
-            engagements = [row[0] for row in c.fetchall()]
+            rows = conn.execute(
+                "SELECT id, command FROM command_logs WHERE engagement=? AND id < ? ORDER BY id DESC LIMIT ?",
+                (self.engagement, last_id if last_id is not None else sys.maxsize, HISTORY_PAGE_SIZE)
+            ).fetchall()
             conn.close()
-            return engagements
-        except:
-            return []
+            for last_id, command in rows:
+                if command and command not in seen:
+                    seen.add(command)
+                    yield command
+            if len(rows) < HISTORY_PAGE_SIZE:
+                return
+    
+    def store_string(self, string):
+        pass  # Shell commands reach command_logs through log_command
+
+def search_history(query, prefix=False, limit=None, engagement=None):
+    """Most recent distinct commands of the engagement containing (or starting with) query.
+    
+    Prefix searches are a range scan on idx_command_logs_command; substring
+    searches use the command_search trigram index, newest match first, and
+    stop as soon as enough distinct commands are found.
+    """
+    limit = limit or HISTORY_SEARCH_LIMIT
+    engagement = engagement or ENGAGEMENT
+    like = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if prefix:
+        sql = """SELECT command FROM command_logs WHERE engagement=? AND command >= ? AND command < ?
+                 ORDER BY id DESC"""
+        params = (engagement, query, query + '\U0010ffff')
+    elif len(query) >= 3:
+        sql = """SELECT c.command FROM command_search s JOIN command_logs c ON c.id = s.rowid
+                 WHERE command_search MATCH ? AND c.engagement=? ORDER BY s.rowid DESC"""
+        params = ('"' + query.replace('"', '""') + '"', engagement)
+    else:
+        sql = "SELECT command FROM command_logs WHERE engagement=? AND command LIKE ? ESCAPE '\\' ORDER BY id DESC"
+        params = (engagement, like)
+    
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        try:
+            cursor = conn.execute(sql, params)
+        except sqlite3.OperationalError:  # No FTS5 trigram support in this SQLite
+            cursor = conn.execute("SELECT command FROM command_logs WHERE engagement=? AND command LIKE ? ESCAPE '\\' "
+                                  "ORDER BY id DESC", (engagement, like))
+        matches = []
+        for (command,) in iter_rows(cursor, HISTORY_PAGE_SIZE):
+            if command not in matches:
+                matches.append(command)
+                if len(matches) >= limit:
+                    break
+        return matches
+    finally:
+        conn.close()
+
+def show_history(query="", prefix=False):
+    """Print history search results, most recent first"""
+    matches = search_history(query, prefix=prefix)
+    if not matches:
+        print_info(f"No history matching '{query}'" if query else "No history yet")
+        return
+    print(f"\n🕒 History{f' matching {query!r}' if query else ''} ({ENGAGEMENT}):")
+    for number, command in enumerate(matches, 1):
+        print(f"  {number:>3}  {command}")
+
+def create_prompt_session():
+    """Build the interactive PromptSession (the only place prompt_toolkit is needed)"""
+    if not require('prompt'):
+        sys.exit(1)
+    
+    class PromptCompleter(RedTermCompleter, Completer):
+        pass
+    
+    class PromptHistory(CommandLogHistory, History):
+        pass
+    
+    return PromptSession(history=ThreadedHistory(PromptHistory(ENGAGEMENT)), completer=PromptCompleter())
 
-session = PromptSession(history=history, completer=RedTermCompleter())
 last_output = ""
+last_raw_output = None
+last_records = []
+last_sources = {}
+last_command = ""
+last_status = None
 
 # ─────────────── STYLING & OUTPUT FUNCTIONS ───────────────
 def print_styled(text, style='primary', panel=False):
     """Print styled text using Rich if available"""
-    if RICH_AVAILABLE and console:
+    if QUIET:
+        return
+    if require('rich'):
         if panel:
             console.print(Panel(text, style=style))
         else:
@@ -346,9 +668,17 @@ def print_info(text):
 def print_warning(text):
     print_styled(f"⚠️ {text}", 'warning')
 
+def ask_confirm(question):
+    """Yes/no confirmation; in batch mode answered by BATCH_ASSUME_YES without prompting"""
+    if BATCH_MODE:
+        print_info(f"{question} → {'yes' if BATCH_ASSUME_YES else 'no'} (batch mode)")
+        return BATCH_ASSUME_YES
+    require('prompt')
+    return confirm(question)
+
 def create_status_table():
     """Create a styled status table"""
-    if not RICH_AVAILABLE:
+    if not require('rich'):
         return None
     
     table = Table(title="RedTeam Terminal Status")
@@ -358,9 +688,276 @@ def create_status_table():
     return table
 
 # ─────────────── AUTO-EXTRACTION FUNCTIONS ───────────────
-def extract_highlights(text):
-    """Extract interesting data from command output"""
-    for name, config in EXTRACTION_PATTERNS.items():
+def ip_to_int(address):
+    """Dotted-quad IPv4 address to an int (ValueError for anything else)"""
+    a, b, c, d = map(int, address.split('.'))  # ValueError unless four integers
+    if (a | b | c | d) >> 8:
+        raise ValueError(address)  # An octet above 255 (or negative)
+    return a << 24 | b << 16 | c << 8 | d
+
+def int_to_ip(value):
+    return f"{value >> 24}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+
+def parse_ip_range(spec):
+    """'10.10.0.0/16' or a single address -> inclusive (low, high) ints"""
+    address, _, bits = spec.partition('/')
+    bits = int(bits) if bits else 32
+    if not 0 <= bits <= 32:
+        raise ValueError(spec)
+    mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+    low = ip_to_int(address) & mask
+    return low, low | (~mask & 0xFFFFFFFF)
+
+class IPSet:
+    """Set of IPv4 addresses kept as a sorted array of 32-bit ints.
+    
+    New addresses wait in a small pending set and are merged (and
+    deduplicated) into the array before counts and range queries, so
+    membership, range counts and CIDR listings are binary searches at 4 bytes
+    per address. Values that are not dotted quads
+    (IPv6 from a parser, say) are kept as strings in `other`.
+    """
+    
+    def __init__(self, values=()):
+        self.sorted = array.array('I')
+        self.pending = set()
+        self.other = set()
+        for value in values:
+            self.add(value)
+    
+    @classmethod
+    def from_sorted(cls, ints):
+        """Build from ascending, distinct ints (e.g. an ORDER BY ip query)"""
+        ipset = cls()
+        ipset.sorted = array.array('I', ints)
+        return ipset
+    
+    def _has(self, value):
+        index = bisect.bisect_left(self.sorted, value)
+        return index < len(self.sorted) and self.sorted[index] == value
+    
+    def add(self, address):
+        try:
+            value = ip_to_int(address)
+        except ValueError:
+            self.other.add(address)
+            return
+        self.pending.add(value)
+        if len(self.pending) >= IPSET_MERGE_THRESHOLD:
+            self._merge()
+    
+    def _merge(self):
+        if not self.pending:
+            return
+        merged = array.array('I')
+        start = 0
+        for value in sorted(self.pending):
+            index = bisect.bisect_left(self.sorted, value, start)
+            merged.extend(self.sorted[start:index])
+            start = index
+            if index < len(self.sorted) and self.sorted[index] == value:
+                continue  # Already known
+            merged.append(value)
+        merged.extend(self.sorted[start:])
+        self.sorted = merged
+        self.pending.clear()
+    
+    def __contains__(self, address):
+        try:
+            value = ip_to_int(address)
+        except ValueError:
+            return address in self.other
+        return value in self.pending or self._has(value)
+    
+    def __len__(self):
+        self._merge()
+        return len(self.sorted) + len(self.other)
+    
+    def __iter__(self):
+        self._merge()
+        for value in self.sorted:
+            yield int_to_ip(value)
+        yield from self.other
+    
+    def _bounds(self, low, high):
+        self._merge()
+        return bisect.bisect_left(self.sorted, low), bisect.bisect_right(self.sorted, high)
+    
+    def count_range(self, low, high):
+        """Number of addresses in [low, high]"""
+        start, end = self._bounds(low, high)
+        return end - start
+    
+    def in_range(self, low, high, offset=0, limit=None):
+        """Addresses in [low, high] in numeric order, optionally one page of them"""
+        start, end = self._bounds(low, high)
+        start += offset
+        if limit is not None:
+            end = min(end, start + limit)
+        return [int_to_ip(value) for value in self.sorted[start:end]]
+
+class Highlights:
+    """HIGHLIGHTS: a bounded write-back cache over the highlights table.
+    
+    Per-category counts are loaded eagerly (one GROUP BY on the unique
+    index); values stay in the database and are paged from it on demand.
+    New values wait in `pending` until flush(), and the last
+    HIGHLIGHT_CACHE_SIZE stored values are remembered so re-extracting them
+    skips the database. The packed IPSet is only built on the first range
+    query.
+    """
+    
+    def __init__(self, engagement=None, db_path=None):
+        self.engagement = engagement
+        self.db_path = db_path
+        self.counts = {}
+        self.pending = defaultdict(set)
+        self.recent = OrderedDict()
+        self.ips = None
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path or DB_PATH), self.engagement or ENGAGEMENT
+    
+    def load(self, engagement, db_path):
+        """Point the cache at an engagement and load its per-category counts"""
+        self.flush()  # Pending values belong to the previous engagement
+        self.__init__(engagement, db_path)
+        conn, engagement = self._connect()
+        try:
+            self.counts = dict(conn.execute("SELECT category, COUNT(*) FROM highlights WHERE engagement=? GROUP BY category",
+                                            (engagement,)))
+        except sqlite3.OperationalError:
+            pass  # No highlights table yet
+        conn.close()
+    
+    def clear(self):
+        self.__init__(self.engagement, self.db_path)
+    
+    def add(self, category, value):
+        key = (category, value)
+        if key in self.recent:
+            self.recent.move_to_end(key)
+        else:
+            self.pending[category].add(value)
+    
+    def flush(self):
+        """Write pending values; counts grow by what was actually new"""
+        if not any(self.pending.values()):
+            return
+        conn, engagement = self._connect()
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS highlights (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                engagement TEXT,
+                category TEXT,
+                value TEXT,
+                timestamp TEXT,
+                ip INTEGER,
+                UNIQUE(engagement, category, value)
+            )
+        ''')
+        timestamp = datetime.utcnow().isoformat()
+        for category, items in self.pending.items():
+            c.executemany("INSERT OR IGNORE INTO highlights (engagement, category, value, timestamp, ip) VALUES (?, ?, ?, ?, ?)",
+                          [highlight_row(engagement, category, item, timestamp) for item in items])
+            if c.rowcount > 0:
+                self.counts[category] = self.counts.get(category, 0) + c.rowcount
+            if category == 'IPs' and self.ips is not None:
+                for item in items:
+                    self.ips.add(item)
+            for item in items:
+                self.recent[category, item] = None
+        conn.commit()
+        conn.close()
+        self.pending.clear()
+        while len(self.recent) > HIGHLIGHT_CACHE_SIZE:
+            self.recent.popitem(last=False)
+    
+    def categories(self):
+        """[(category, count)] for every non-empty category, by name"""
+        self.flush()
+        return sorted((category, count) for category, count in self.counts.items() if count)
+    
+    def total(self):
+        self.flush()
+        return sum(self.counts.values())
+    
+    def __bool__(self):
+        return any(self.counts.values()) or any(self.pending.values())
+    
+    def _filter(self, engagement, category, pattern):
+        where, params = "h.engagement=? AND h.category=?", [engagement, category]
+        if pattern:
+            where += " AND h.value LIKE ? ESCAPE '\\'"
+            params.append('%' + pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        return where, params
+    
+    def count(self, category, pattern=None):
+        """Values in a category, optionally only those containing pattern"""
+        self.flush()
+        if not pattern:
+            return self.counts.get(category, 0)
+        conn, engagement = self._connect()
+        where, params = self._filter(engagement, category, pattern)
+        total = conn.execute(f"SELECT COUNT(*) FROM highlights h WHERE {where}", params).fetchone()[0]
+        conn.close()
+        return total
+    
+    def values(self, category, pattern=None, offset=0, limit=None):
+        """Stream (value, first source command id) in value order from the indexed table"""
+        self.flush()
+        conn, engagement = self._connect()
+        where, params = self._filter(engagement, category, pattern)
+        try:
+            cursor = conn.execute(f"""SELECT h.value, (SELECT MIN(s.command_id) FROM highlight_sources s WHERE s.highlight_id = h.id)
+                                      FROM highlights h WHERE {where} ORDER BY h.value LIMIT ? OFFSET ?""",
+                                  params + [-1 if limit is None else limit, offset])
+            yield from iter_rows(cursor)
+        finally:
+            conn.close()
+    
+    def page(self, category, pattern=None, page=1, size=HIGHLIGHT_PAGE_SIZE):
+        return list(self.values(category, pattern, (page - 1) * size, size))
+    
+    def ip_set(self):
+        """The engagement's IPs as an IPSet (built from the ip index on first use)"""
+        self.flush()
+        if self.ips is None:
+            conn, engagement = self._connect()
+            # Packed IPs come back already sorted from the (engagement, ip) index
+            cursor = conn.execute("SELECT ip FROM highlights WHERE engagement=? AND ip IS NOT NULL ORDER BY ip", (engagement,))
+            self.ips = IPSet.from_sorted(ip for ip, in cursor)
+            conn.close()
+        return self.ips
+    
+    def __getitem__(self, category):
+        """Every value of a category as a set (loads the whole category; prefer page())"""
+        return {value for value, _ in self.values(category)}
+
+HIGHLIGHTS = Highlights()
+
+def packed_ip(category, value):
+    """Integer form of an IPs highlight (None for other categories and non-IPv4 values)"""
+    if category == 'IPs':
+        try:
+            return ip_to_int(value)
+        except ValueError:
+            pass
+    return None
+
+def highlight_row(engagement, category, value, timestamp):
+    """highlights table row, with the packed address for IPs"""
+    return (engagement, category, value, timestamp, packed_ip(category, value))
+
+def extract_highlights(text, patterns=None, sources=None, offset=0):
+    """Extract interesting data from command output (optionally only the named patterns).
+    
+    With a `sources` dict, the offset of each value's first match (plus
+    `offset`) is recorded under (category, value) for the provenance index.
+    """
+    selected = EXTRACTION_PATTERNS if patterns is None else {name: EXTRACTION_PATTERNS[name] for name in patterns}
+    for name, config in selected.items():
         pattern = config['pattern']
         category = config['category']
         
@@ -370,180 +967,878 @@ def extract_highlights(text):
             if any(fp in text.lower() for fp in ['password:', 'enter password', 'new password']):
                 continue
         
-        matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-        
-        if matches:
-            if isinstance(matches[0], tuple):
+        for match in re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE):
+            groups = match.groups()
+            if len(groups) > 1:
                 # For patterns with groups
-                for match in matches:
-                    if name == 'services':
-                        # Special handling for services (port, service_name)
-                        port, service = match
-                        HIGHLIGHTS[category].add(f"{port}:{service}")
-                    else:
-                        HIGHLIGHTS[category].add(match[0])
+                if name == 'services':
+                    # Special handling for services (port, service_name)
+                    value = f"{groups[0]}:{groups[1]}"
+                else:
+                    value = groups[0]
             else:
                 # For simple patterns
-                for match in matches:
-                    # Filter out common false positives
-                    if category == 'IPs' and match in ['127.0.0.1', '0.0.0.0']:
-                        continue
-                    if category == 'Domains' and len(match) < 4:
-                        continue
-                    HIGHLIGHTS[category].add(match)
+                value = groups[0] if groups else match.group()
+                # Filter out common false positives
+                if category == 'IPs' and value in ['127.0.0.1', '0.0.0.0']:
+                    continue
+                if category == 'Domains' and len(value) < 4:
+                    continue
+            HIGHLIGHTS.add(category, value)
+            if sources is not None:
+                sources.setdefault((category, value), offset + match.start())
 
-def show_highlights():
-    """Display extracted highlights"""
-    if not HIGHLIGHTS:
-        print_info("No highlights extracted yet")
+def store_provenance(command_id, sources, conn=None):
+    """Index where each highlight first appeared in a command's output (in conn's transaction if given)"""
+    if not sources or command_id is None:
         return
-    
-    if RICH_AVAILABLE:
-        for category, items in sorted(HIGHLIGHTS.items()):
-            if items:
-                table = Table(title=f"🎯 {category}")
-                table.add_column("Value", style="cyan")
-                for item in sorted(items):
-                    table.add_row(item)
-                console.print(table)
-    else:
-        print("\n🎯 Extracted Highlights:")
-        for category, items in sorted(HIGHLIGHTS.items()):
-            if items:
-                print(f"\n{category}:")
-                for item in sorted(items):
-                    print(f"  • {item}")
+    own = conn is None
+    conn = conn or sqlite3.connect(DB_PATH)
+    timestamp = datetime.utcnow().isoformat()
+    conn.executemany("INSERT OR IGNORE INTO highlights (engagement, category, value, timestamp, ip) VALUES (?, ?, ?, ?, ?)",
+                     [highlight_row(ENGAGEMENT, category, value, timestamp) for category, value in sources])
+    conn.executemany("""INSERT OR IGNORE INTO highlight_sources (highlight_id, command_id, offset)
+                        SELECT id, ?, ? FROM highlights WHERE engagement=? AND category=? AND value=?""",
+                     [(command_id, offset, ENGAGEMENT, category, value) for (category, value), offset in sources.items()])
+    if own:
+        conn.commit()
+        conn.close()
 
-def save_highlights():
-    """Save highlights to database"""
-    if not HIGHLIGHTS:
+def show_ip_range(spec, limit=100):
+    """:highlights IPs <cidr> - extracted addresses inside a range (binary search, no scan)"""
+    try:
+        low, high = parse_ip_range(spec)
+    except ValueError:
+        print_error(f"Not an IPv4 address or CIDR range: {spec}")
         return
-    
+    ips = HIGHLIGHTS.ip_set()
+    total = ips.count_range(low, high)
+    print(f"\n🎯 IPs in {spec}: {total}")
+    for address in ips.in_range(low, high, limit=limit):
+        print(f"  • {address}")
+    if total > limit:
+        print_info(f"... and {total - limit} more")
+
+def show_highlight_source(value):
+    """:highlights from <value> - the commands that produced a value, with an output excerpt"""
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Create highlights table if it doesn't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS highlights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            engagement TEXT,
-            category TEXT,
-            value TEXT,
-            timestamp TEXT,
-            UNIQUE(engagement, category, value)
-        )
-    ''')
+    rows = conn.execute("""SELECT h.category, s.command_id, s.offset, c.timestamp, c.command,
+                                  substr(c.output, max(s.offset - 120, 0) + 1, 320), max(s.offset - 120, 0)
+                           FROM highlights h
+                           JOIN highlight_sources s ON s.highlight_id = h.id
+                           JOIN command_logs c ON c.id = s.command_id
+                           WHERE h.engagement=? AND h.value=? ORDER BY s.command_id""",
+                        (ENGAGEMENT, value)).fetchall()
+    conn.close()
+    if not rows:
+        print_info(f"No recorded source for '{value}'")
+        return
+    for category, command_id, offset, timestamp, command, excerpt, start in rows:
+        print_styled(f"\n🔎 {category} '{value}' ← command #{command_id} ({timestamp[:19]}, offset {offset})", 'info')
+        print(f"$ {command}")
+        excerpt = excerpt or ''
+        position = offset - start
+        print(("..." if start else "") + excerpt[:position] + f">>>{excerpt[position:position + len(value)]}<<<"
+              + excerpt[position + len(value):].rstrip() + ("..." if len(excerpt) == 320 else ""))
+
+def show_highlights(category=None, pattern=None, page=1):
+    """Display extracted highlights a page at a time, optionally one category filtered by substring"""
+    categories = HIGHLIGHTS.categories()
+    if category:
+        categories = [(name, count) for name, count in categories if name == category]
+    if not categories:
+        print_info("No highlights extracted yet" if not category else f"No {category} highlights")
+        return
     
-    # Insert highlights
-    timestamp = datetime.utcnow().isoformat()
-    for category, items in HIGHLIGHTS.items():
-        for item in items:
-            try:
-                c.execute(
-                    "INSERT OR IGNORE INTO highlights (engagement, category, value, timestamp) VALUES (?, ?, ?, ?)",
-                    (ENGAGEMENT, category, item, timestamp)
-                )
-            except:
-                pass
+    pages = [(name, HIGHLIGHTS.count(name, pattern) if pattern else count, HIGHLIGHTS.page(name, pattern, page))
+             for name, count in categories]
+    pages = [(name, total, rows) for name, total, rows in pages if rows]
+    if not pages:
+        print_info(f"No highlights matching '{pattern}'" if pattern else f"Nothing on page {page}")
+        return
     
-    conn.commit()
-    conn.close()
+    more = []
+    if not require('rich'):
+        print("\n🎯 Extracted Highlights:")
+    for name, total, rows in pages:
+        first = (page - 1) * HIGHLIGHT_PAGE_SIZE + 1
+        shown = f"{first}-{first + len(rows) - 1} of {total}"
+        if first + len(rows) - 1 < total:
+            more.append(name)
+        if require('rich'):
+            table = Table(title=f"🎯 {name} ({total})", caption=shown if total > len(rows) else None)
+            table.add_column("Value", style="cyan")
+            table.add_column("Source", style="dim")
+            for item, source in rows:
+                table.add_row(item, f"#{source}" if source else "")
+            console.print(table)
+        else:
+            print(f"\n{name} ({shown}):")
+            for item, source in rows:
+                print(f"  • {item}" + (f"  (#{source})" if source else ""))
+    if more:
+        filter_args = f" {pattern}" if pattern else ""
+        print_info(f"More: :highlights {more[0]}{filter_args} page {page + 1}" if category or len(more) == 1
+                   else f"More in {', '.join(more)}: :highlights <category>{filter_args} page {page + 1}")
+    print_info("Use :highlights from <value> to see the command and output it came from")
+
+def highlights_command(args):
+    """:highlights [<category>] [<filter>] [page <n>]"""
+    words = args.split()
+    page = 1
+    if len(words) >= 2 and words[-2] == 'page' and words[-1].isdigit():
+        page = max(int(words[-1]), 1)
+        words = words[:-2]
+    category = None
+    if words:
+        names = {config['category'].lower(): config['category'] for config in EXTRACTION_PATTERNS.values()}
+        names.update((name.lower(), name) for name in HIGHLIGHTS.counts)
+        category = names.get(words[0].lower())
+        if category:
+            words = words[1:]
+    pattern = ' '.join(words) or None
+    if category == 'IPs' and pattern and page == 1:
+        try:
+            parse_ip_range(pattern)
+        except ValueError:
+            pass
+        else:
+            show_ip_range(pattern)
+            return
+    show_highlights(category, pattern, page)
+
+def save_highlights():
+    """Save highlights extracted since the last save to the database"""
+    HIGHLIGHTS.flush()
 
 def load_highlights():
-    """Load highlights from database"""
-    global HIGHLIGHTS
-    HIGHLIGHTS.clear()
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    """Point HIGHLIGHTS at the current engagement (counts only; values are paged on demand)"""
+    HIGHLIGHTS.load(ENGAGEMENT, DB_PATH)
+
+# ─────────────── COMMAND CLASSIFICATION ───────────────
+CommandInfo = namedtuple('CommandInfo', 'programs interactive danger timeout')
+
+CONTROL_OPERATORS = frozenset({'|', '||', '&&', ';', '&', '|&', ';;', '(', ')'})
+# Prefix programs that run another command -> their options that take a value
+COMMAND_WRAPPERS = {
+    'sudo': ('-u', '-g', '-C', '-h'), 'env': ('-u',), 'nice': ('-n',), 'timeout': ('-s', '-k'),
+    'nohup': (), 'time': (), 'stdbuf': (), 'exec': (), 'command': (),
+    'proxychains': ('-f',), 'proxychains4': ('-f',),
+}
+SHELL_PROGRAMS = frozenset({'sh', 'bash', 'zsh', 'dash'})
+# Interpreters only need a TTY when they are not given code to run
+SCRIPT_FLAGS = {'python': ('-c',), 'python3': ('-c',), 'ruby': ('-e',), 'perl': ('-e',),
+                'bash': ('-c',), 'sh': ('-c',)}
+SHORT_FLAGS_RE = re.compile(r'-[A-Za-z]+')
+ENV_ASSIGNMENT_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+
+@functools.lru_cache(maxsize=None)
+def _classifier_tables():
+    """Compile the INTERACTIVE_COMMANDS/DANGEROUS_COMMANDS entries into per-program rules.
     
+    An entry is a program followed by arguments that must all be present:
+    'nc -' / 'dd if=' match argument prefixes, '-rf' matches short flags in
+    any order or grouping, and '> /dev/sd' matches a redirection target.
+    """
+    interactive, dangerous = defaultdict(list), defaultdict(list)
+    for table, entries in ((interactive, INTERACTIVE_COMMANDS), (dangerous, DANGEROUS_COMMANDS)):
+        for entry in entries:
+            words = entry.lower().split()
+            table[words[0]].append((entry, tuple(words[1:])))
+    return interactive, dangerous
+
+def _split_pipeline(command):
+    """Token lists of the simple commands in a command line (pipes, ;, && and || split)"""
     try:
-        c.execute(
-            "SELECT category, value FROM highlights WHERE engagement=?",
-            (ENGAGEMENT,)
-        )
-        for category, value in c.fetchall():
-            HIGHLIGHTS[category].add(value)
-    except:
-        pass
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:  # Unbalanced quotes - fall back to plain words
+        tokens = command.split()
     
-    conn.close()
-
-# ─────────────── PTY COMMAND EXECUTION ───────────────
-def is_interactive_command(cmd):
-    """Check if command requires interactive TTY"""
-    cmd_lower = cmd.lower()
-    return any(ic in cmd_lower for ic in INTERACTIVE_COMMANDS)
+    segments, segment = [], []
+    for token in tokens:
+        if token in CONTROL_OPERATORS:
+            if segment:
+                segments.append(segment)
+            segment = []
+        else:
+            segment.append(token)
+    if segment:
+        segments.append(segment)
+    return segments
 
-def run_command_pty(command):
-    """Run command with PTY support for real-time output"""
-    global last_output
+def _parse_segment(tokens):
+    """(program, args, redirect targets) of one simple command, wrappers removed"""
+    args, targets = [], []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token[0] in '<>' or token == '&>':
+            if token[0] == '>' or token == '&>':
+                targets.append(tokens[i + 1] if i + 1 < len(tokens) else '')
+            i += 2
+            continue
+        if token.isdigit() and i + 1 < len(tokens) and tokens[i + 1][0] in '<>':
+            i += 1  # File descriptor of a redirection (2>&1)
+            continue
+        args.append(token)
+        i += 1
     
-    output_buffer = []
-    start_time = time.time()
+    while args:
+        if ENV_ASSIGNMENT_RE.match(args[0]):
+            args.pop(0)
+            continue
+        wrapper = os.path.basename(args[0]).lower()
+        if wrapper not in COMMAND_WRAPPERS:
+            break
+        args.pop(0)
+        while args and (args[0].startswith('-') or (wrapper == 'env' and ENV_ASSIGNMENT_RE.match(args[0]))):
+            if args.pop(0) in COMMAND_WRAPPERS[wrapper] and args:
+                args.pop(0)
+        if wrapper == 'timeout' and args:
+            args.pop(0)  # Duration
+    if not args:
+        return None
+    return os.path.basename(args[0]).lower(), args[1:], targets
+
+def _rule_matches(required, args):
+    """Whether every required word of a table entry is satisfied by args"""
+    flags = None
+    for word in required:
+        if word.endswith(('-', '=')):
+            matched = any(arg.startswith(word) for arg in args)
+        elif SHORT_FLAGS_RE.fullmatch(word):
+            if flags is None:
+                flags = set(''.join(arg[1:] for arg in args if SHORT_FLAGS_RE.fullmatch(arg)))
+            matched = set(word[1:]) <= flags
+        else:
+            matched = word in args
+        if not matched:
+            return False
+    return True
+
+@functools.lru_cache(maxsize=2048)
+def classify_command(command):
+    """Classify an (alias-expanded) command line once.
     
-    # Save terminal settings
-    old_tty = termios.tcgetattr(sys.stdin)
+    Returns the programs it runs, whether it needs an interactive TTY, why it
+    is dangerous (None if it is not) and its timeout. Commands are tokenized
+    with shlex, so 'ssh' is not mistaken for 'sh' and quoted arguments never
+    match. Results are memoised; call classify_command.cache_clear() and
+    _classifier_tables.cache_clear() after editing the tables at runtime.
+    """
+    interactive_rules, danger_rules = _classifier_tables()
+    programs, interactive, danger, timeout = [], False, None, None
     
-    try:
-        # Create PTY
-        master_fd, slave_fd = pty.openpty()
+    for tokens in _split_pipeline(command):
+        parsed = _parse_segment(tokens)
+        if parsed is None:
+            continue
+        program, args, targets = parsed
+        names = (program, program.split('.', 1)[0])  # mkfs.ext4 -> mkfs
+        programs.append(program)
         
-        # Fork process
-        pid = os.fork()
+        if program in SHELL_PROGRAMS and '-c' in args[:-1]:
+            inner = classify_command(args[args.index('-c') + 1])
+            programs.extend(inner.programs)
+            interactive = interactive or inner.interactive
+            danger = danger or inner.danger
+            if inner.timeout != COMMAND_TIMEOUTS['default']:
+                timeout = max(timeout or 0, inner.timeout)
+            continue
         
-        if pid == 0:  # Child process
-            os.close(master_fd)
-            os.setsid()
-            os.dup2(slave_fd, 0)
-            os.dup2(slave_fd, 1)
-            os.dup2(slave_fd, 2)
-            os.close(slave_fd)
-            
-            # Set working directory
-            os.chdir(CURRENT_WORKING_DIR)
-            
-            # Execute command
-            os.execvp('/bin/sh', ['/bin/sh', '-c', command])
+        if not interactive and not any(flag in args for flag in SCRIPT_FLAGS.get(program, ())):
+            interactive = any(_rule_matches(required, args)
+                              for name in set(names) for _, required in interactive_rules.get(name, ()))
         
-        else:  # Parent process
-            os.close(slave_fd)
-            
-            # Set stdin to raw mode for interactive commands
-            if is_interactive_command(command):
-                tty.setraw(sys.stdin.fileno())
-            
-            # Monitor output
-            while True:
-                try:
-                    # Check if process is still running
-                    pid_status, status = os.waitpid(pid, os.WNOHANG)
-                    if pid_status != 0:
-                        break
-                    
-                    # Check for available data
-                    r, w, e = select.select([master_fd, sys.stdin], [], [], 0.1)
-                    
-                    if master_fd in r:
-                        # Read from command output
-                        data = os.read(master_fd, 1024)
-                        if not data:
-                            break
-                        
-                        # Decode and display
-                        decoded = data.decode('utf-8', errors='replace')
-                        sys.stdout.write(decoded)
-                        sys.stdout.flush()
-                        output_buffer.append(decoded)
-                        
-                        # Record if recording
-                        if RECORDING:
-                            record_event('output', decoded)
-                        
-                        # Extract highlights in real-time
-                        extract_highlights(decoded)
+        if danger is None:
+            for entry, required in (rule for name in set(names) for rule in danger_rules.get(name, ())):
+                if _rule_matches(required, args):
+                    danger = f"Potentially dangerous command detected: {entry}"
+                    break
+            for entry, required in danger_rules.get('>', ()):
+                if danger is None and any(target.startswith(required[0]) for target in targets):
+                    danger = f"Potentially dangerous command detected: {entry}"
+        if danger is None and program == 'rm' and _rule_matches(('-rf',), args):
+            danger = "Recursive delete detected - please be specific with paths"
+        if danger is None and any(re.match(r'/dev/sd[a-z]', target) for target in targets):
+            danger = "Direct disk write detected"
+        
+        for name in names:
+            if name in COMMAND_TIMEOUTS and name != 'default':
+                timeout = max(timeout or 0, COMMAND_TIMEOUTS[name])
+                break
+    
+    return CommandInfo(tuple(programs), interactive, danger, timeout or COMMAND_TIMEOUTS['default'])
+
+# ─────────────── TOOL OUTPUT PARSERS ───────────────
+# Typed records emitted by the tool parsers
+HostRecord = namedtuple('HostRecord', 'address hostname')
+ServiceRecord = namedtuple('ServiceRecord', 'host port protocol state service version')
+UrlRecord = namedtuple('UrlRecord', 'url status size')
+CredentialRecord = namedtuple('CredentialRecord', 'host port service username password')
+AccountRecord = namedtuple('AccountRecord', 'host kind name rid')  # kind: 'user' or 'group'
+ShareRecord = namedtuple('ShareRecord', 'host name type comment')
+FindingRecord = namedtuple('FindingRecord', 'host title detail')
+HashRecord = namedtuple('HashRecord', 'host value username kind plaintext', defaults=(None, None))
+
+OUTPUT_PARSERS = {}  # program name (as classify_command reports it) -> ToolParser subclass
+
+SHARE_LINE_RE = re.compile(r'^\s+(\S+)\s+(Disk|IPC|Printer)\s*(.*)$')
+
+def output_parser(cls):
+    """Class decorator registering a ToolParser for each of its tools"""
+    for tool in cls.tools:
+        OUTPUT_PARSERS[tool] = cls
+    return cls
+
+def parsers_for(command):
+    """Fresh parser instances for the tools a command runs (empty for unknown tools)"""
+    if not command:
+        return []
+    programs = dict.fromkeys(classify_command(command).programs)
+    return [OUTPUT_PARSERS[program](command) for program in programs if program in OUTPUT_PARSERS]
+
+def record_highlights(record):
+    """(category, value) pairs a parser record contributes to HIGHLIGHTS"""
+    if isinstance(record, HostRecord):
+        if record.address and record.address not in ('127.0.0.1', '0.0.0.0'):
+            yield 'IPs', record.address
+        if record.hostname:
+            yield 'Domains', record.hostname
+    elif isinstance(record, ServiceRecord):
+        if record.state and record.state.startswith('open'):
+            yield 'Ports', str(record.port)
+            if record.service:
+                yield 'Services', f"{record.port}:{record.service}"
+    elif isinstance(record, UrlRecord):
+        yield 'URLs', record.url
+    elif isinstance(record, CredentialRecord):
+        where = f"{record.service}://{record.host}" + (f":{record.port}" if record.port else "")
+        yield 'Credentials', f"{record.username}:{record.password} ({where})"
+        if record.username:
+            yield 'Usernames', record.username
+    elif isinstance(record, AccountRecord):
+        yield 'Usernames' if record.kind == 'user' else 'Groups', record.name
+    elif isinstance(record, ShareRecord):
+        yield 'Shares', f"//{record.host}/{record.name}"
+    elif isinstance(record, FindingRecord):
+        yield 'Vulnerabilities', f"{record.host}: {record.title}" if record.host else record.title
+    elif isinstance(record, HashRecord):
+        yield 'Hashes', record.value
+        if record.plaintext is not None:
+            yield 'Cracked', f"{record.value}:{record.plaintext} ({record.kind})"
+
+class ToolParser:
+    """Line parser for one tool's output; a fresh instance per command run.
+    
+    `tools` are the program names it handles and `generic` the
+    EXTRACTION_PATTERNS still worth running on that tool's output.
+    """
+    tools = ()
+    generic = ()
+    
+    def __init__(self, command):
+        try:
+            self.args = shlex.split(command, comments=True)
+        except ValueError:
+            self.args = command.split()
+        self.host = None
+    
+    def option(self, *flags):
+        """Value following the first of `flags` on the command line"""
+        for i, arg in enumerate(self.args[:-1]):
+            if arg in flags:
+                return self.args[i + 1]
+        return None
+    
+    def parse(self, line):
+        """Yield records found in one line of normalized output"""
+        return ()
+
+@output_parser
+class NmapParser(ToolParser):
+    tools = ('nmap',)
+    generic = ('mac_addresses', 'urls', 'emails')
+    REPORT_RE = re.compile(r'^Nmap scan report for (?:(\S+) \(([^)]+)\)|(\S+))$')
+    PORT_RE = re.compile(r'^(\d{1,5})/(tcp|udp|sctp)\s+(open\|filtered|open|filtered|closed|unfiltered)\s+(\S+)(?:\s+(.*))?$')
+    
+    def parse(self, line):
+        if line.startswith('Nmap scan report for '):
+            match = self.REPORT_RE.match(line)
+            if match:
+                hostname, address = (match.group(1), match.group(2)) if match.group(2) else (None, match.group(3))
+                self.host = address
+                yield HostRecord(address, hostname)
+        elif '/tcp' in line or '/udp' in line or '/sctp' in line:
+            match = self.PORT_RE.match(line)
+            if match:
+                port, protocol, state, service, version = match.groups()
+                yield ServiceRecord(self.host, int(port), protocol, state, service, version or None)
+
+@output_parser
+class MasscanParser(ToolParser):
+    tools = ('masscan',)
+    PORT_RE = re.compile(r'^Discovered open port (\d+)/(tcp|udp) on (\S+)')
+    
+    def parse(self, line):
+        match = self.PORT_RE.match(line)
+        if match:
+            port, protocol, address = match.groups()
+            yield HostRecord(address, None)
+            yield ServiceRecord(address, int(port), protocol, 'open', None, None)
+
+@output_parser
+class WebContentParser(ToolParser):
+    tools = ('gobuster', 'dirb')
+    GOBUSTER_RE = re.compile(r'^(\S+)\s+\(Status: (\d{3})\)(?:\s+\[Size: (\d+)\])?')
+    DIRB_RE = re.compile(r'^\+ (\S+) \(CODE:(\d+)\|SIZE:(\d+)\)')
+    DIRECTORY_RE = re.compile(r'^==> DIRECTORY: (\S+)')
+    FOUND_RE = re.compile(r'^Found: (\S+)')  # gobuster dns / vhost modes
+    
+    def __init__(self, command):
+        super().__init__(command)
+        dirb = [i for i, arg in enumerate(self.args[:-1]) if os.path.basename(arg) == 'dirb']
+        self.base = (self.args[dirb[0] + 1] if dirb else self.option('-u', '--url') or '').rstrip('/')
+    
+    def parse(self, line):
+        if '(Status: ' in line:
+            match = self.GOBUSTER_RE.match(line.strip())
+            if match:
+                path, status, size = match.groups()
+                url = path if path.startswith('http') else f"{self.base}/{path.lstrip('/')}"
+                yield UrlRecord(url, int(status), int(size) if size else None)
+        elif line.startswith('+ '):
+            match = self.DIRB_RE.match(line)
+            if match:
+                yield UrlRecord(match.group(1), int(match.group(2)), int(match.group(3)))
+        elif line.startswith('==> DIRECTORY: '):
+            yield UrlRecord(self.DIRECTORY_RE.match(line).group(1), None, None)
+        elif line.startswith('Found: '):
+            yield HostRecord(None, self.FOUND_RE.match(line).group(1))
+
+@output_parser
+class HydraParser(ToolParser):
+    tools = ('hydra',)
+    LOGIN_RE = re.compile(r'^\[(\d+)\]\[([\w-]+)\] host: (\S+)\s+login: (.*?)\s+password: (.*)$')
+    
+    def parse(self, line):
+        if ' login: ' in line:
+            match = self.LOGIN_RE.match(line)
+            if match:
+                port, service, host, username, password = match.groups()
+                yield CredentialRecord(host, int(port), service, username, password)
+
+@output_parser
+class Enum4linuxParser(ToolParser):
+    tools = ('enum4linux',)
+    ACCOUNT_RE = re.compile(r'(user|group):\[([^\]]+)\] rid:\[(0x[0-9a-fA-F]+)\]')
+    SID_RE = re.compile(r'S-1-5-21-[\d-]+-(\d+) \S+?\\(.+?) \((Local|Domain) (User|Group)\)')
+    
+    def __init__(self, command):
+        super().__init__(command)
+        self.host = self.args[-1] if len(self.args) > 1 else None
+    
+    def parse(self, line):
+        if 'rid:[' in line:
+            match = self.ACCOUNT_RE.search(line)
+            if match:
+                kind, name, rid = match.groups()
+                yield AccountRecord(self.host, kind, name, int(rid, 16))
+        elif 'S-1-5-21-' in line:
+            match = self.SID_RE.search(line)
+            if match:
+                rid, name, _, kind = match.groups()
+                yield AccountRecord(self.host, kind.lower(), name, int(rid))
+        elif "allows sessions using username ''" in line:
+            yield FindingRecord(self.host, "SMB null session allowed", line.strip())
+        else:
+            match = SHARE_LINE_RE.match(line)
+            if match:
+                yield ShareRecord(self.host, *match.groups())
+
+@output_parser
+class SmbclientParser(ToolParser):
+    tools = ('smbclient',)
+    
+    def __init__(self, command):
+        super().__init__(command)
+        target = self.option('-L') or next((arg for arg in self.args[1:] if arg.startswith('//')), '')
+        self.host = target.lstrip('/').split('/')[0] or None
+    
+    def parse(self, line):
+        if line.startswith('Anonymous login successful'):
+            yield FindingRecord(self.host, "SMB anonymous login allowed", None)
+            return
+        match = SHARE_LINE_RE.match(line)
+        if match:
+            yield ShareRecord(self.host, *match.groups())
+
+@output_parser
+class NiktoParser(ToolParser):
+    tools = ('nikto',)
+    generic = ('urls', 'emails')
+    INFO_PREFIXES = ('Target ', 'Start Time', 'End Time', 'Server:', 'SSL Info', 'Subject:', 'Ciphers:',
+                     'Issuer:', 'Platform:', 'Root page', 'No CGI', 'Scan terminated')
+    SUMMARY_RE = re.compile(r'^\d+ (?:requests|host\(s\) tested)')
+    
+    def __init__(self, command):
+        super().__init__(command)
+        self.host = self.option('-h', '-host')
+        self.port = None
+    
+    def parse(self, line):
+        if not line.startswith('+ '):
+            return
+        text = line[2:].strip()
+        if text.startswith('Target IP:'):
+            self.host = text.split(':', 1)[1].strip()
+            yield HostRecord(self.host, None)
+        elif text.startswith('Target Port:'):
+            self.port = int(text.split(':', 1)[1].strip() or 0) or None
+        elif text.startswith('Server:'):
+            yield ServiceRecord(self.host, self.port, 'tcp', 'open', 'http', text.split(':', 1)[1].strip())
+        elif not text.startswith(self.INFO_PREFIXES) and ':' in text and not self.SUMMARY_RE.match(text):
+            yield FindingRecord(self.host, text, None)
+
+@output_parser
+class SqlmapParser(ToolParser):
+    tools = ('sqlmap',)
+    generic = ('urls',)
+    CRACKED_RE = re.compile(r"cracked password '(.*)' for user '(.*)'")
+    
+    def __init__(self, command):
+        super().__init__(command)
+        self.host = self.option('-u', '--url')
+        self.parameter = self.technique = None
+    
+    def parse(self, line):
+        text = line.strip()
+        if text.startswith('Parameter: '):
+            self.parameter = text[len('Parameter: '):]
+        elif text.startswith('Type: ') and self.parameter:
+            self.technique = text[len('Type: '):]
+        elif text.startswith('Title: ') and self.parameter:
+            yield FindingRecord(self.host, f"SQL injection in {self.parameter}: {self.technique}", text[len('Title: '):])
+        elif text.startswith('back-end DBMS: '):
+            yield FindingRecord(self.host, f"Back-end DBMS: {text[len('back-end DBMS: '):]}", None)
+        elif 'cracked password' in text:
+            match = self.CRACKED_RE.search(text)
+            if match:
+                yield CredentialRecord(self.host, None, 'sqlmap', match.group(2), match.group(1))
+
+
+@output_parser
+class ResponderParser(ToolParser):
+    tools = ('responder', 'responder.py')
+    generic = ('ip_addresses', 'domains')
+    NTLM_RE = re.compile(r'\[(\w+)\] (NTLMv[12])(?:-SSP)? (Client|Username|Hash)\s*: (\S+)')
+    CLEARTEXT_RE = re.compile(r'\[(\w+)\] Cleartext (Client|Username|Password)\s*: (.+)$')
+    RAW_HASH_RE = re.compile(r'^([^:\s]+)::[^:\s]*:[0-9a-fA-F]{16,48}:[0-9a-fA-F]{32,48}:[0-9a-fA-F]+$')  # Responder/logs/*.txt
+    
+    def __init__(self, command):
+        super().__init__(command)
+        self.username = None
+    
+    def parse(self, line):
+        if 'NTLMv' in line:
+            match = self.NTLM_RE.search(line)
+            if match:
+                _, version, field, value = match.groups()
+                if field == 'Client':
+                    self.host = value
+                elif field == 'Hash':
+                    yield HashRecord(self.host, value, value.split('::')[0], f"Net{version}")
+        elif 'Cleartext' in line:
+            match = self.CLEARTEXT_RE.search(line)
+            if match:
+                protocol, field, value = match.groups()
+                if field == 'Client':
+                    self.host = value.strip()
+                elif field == 'Username':
+                    self.username = value.strip()
+                elif self.username:
+                    yield CredentialRecord(self.host, None, protocol.lower(), self.username, value.strip())
+        else:
+            match = self.RAW_HASH_RE.match(line.strip())
+            if match:
+                yield HashRecord(None, line.strip(), match.group(1), 'NetNTLMv2' if len(line.split(':')[4]) > 48 else 'NetNTLMv1')
+
+# ─────────────── OUTPUT NORMALIZATION ───────────────
+TERMINAL_TOKEN_RE = re.compile(r'\r|\n|\x08|\x1b(?:\[([0-9;?]*)[ -/]*([@-~])|\][^\x07\x1b]*(?:\x07|\x1b\\)|[()][A-Z0-9]|[=>78DEM])')
+TERMINAL_CONTROL_RE = re.compile(r'[\r\x08\x1b]')
+
+class OutputCapture:
+    """Streaming terminal emulation for one command's output.
+    
+    Carriage returns, backspaces, cursor moves and erase-line sequences are
+    applied to the current line, so progress redraws collapse to the text
+    left on screen; other escape sequences are dropped (SGR colours are kept
+    with OUTPUT_KEEP_SGR). The raw stream is kept only with KEEP_RAW_OUTPUT.
+    """
+    
+    def __init__(self, command=None):
+        self.parsers = parsers_for(command)
+        self.records = []   # typed records from the tool parsers
+        self.sources = {}   # (category, value) -> offset of first sighting in the text
+        self.size = 0       # characters of completed text so far
+        self.lines = []     # completed text, one string per feed()
+        self.cells = []     # current line, one visible character per cell
+        self.cursor = 0
+        self.sgr = ''       # colour codes waiting for the next printed character
+        self.pending = ''   # escape sequence split across chunks
+        self.raw = [] if KEEP_RAW_OUTPUT else None
+    
+    def _write(self, text):
+        if not text:  # A pending SGR waits for the next character or the end of the line
+            return
+        cells = list(text)
+        if self.sgr:
+            cells[0] = self.sgr + cells[0]
+            self.sgr = ''
+        if self.cursor > len(self.cells):
+            self.cells.extend(' ' * (self.cursor - len(self.cells)))
+        self.cells[self.cursor:self.cursor + len(cells)] = cells
+        self.cursor += len(cells)
+    
+    def _line(self):
+        line = ''.join(self.cells).rstrip() + self.sgr
+        self.cells, self.cursor, self.sgr = [], 0, ''
+        return line
+    
+    def _control(self, match):
+        token = match.group()
+        if token == '\r':
+            self.cursor = 0
+        elif token == '\x08':
+            self.cursor = max(self.cursor - 1, 0)
+        elif match.group(2) == 'm':
+            if OUTPUT_KEEP_SGR:
+                self.sgr += token
+        elif match.group(2) in ('K', 'C', 'D', 'G'):
+            params = match.group(1)
+            count = int(params) if params.isdigit() else None
+            final = match.group(2)
+            if final == 'K':
+                if not count:
+                    del self.cells[self.cursor:]
+                elif count == 1:
+                    self.cells[:self.cursor + 1] = ' ' * min(self.cursor + 1, len(self.cells))
+                else:
+                    self.cells = [' '] * min(self.cursor, len(self.cells))
+            elif final == 'C':
+                self.cursor += count or 1
+            elif final == 'D':
+                self.cursor = max(self.cursor - (count or 1), 0)
+            else:
+                self.cursor = max((count or 1) - 1, 0)
+    
+    def feed(self, data):
+        """Consume a chunk of terminal output; returns the lines it completed"""
+        if self.raw is not None:
+            self.raw.append(data)
+        data = self.pending + data
+        self.pending = ''
+        cut = data.rfind('\x1b')
+        if cut != -1 and len(data) - cut < 256 and not TERMINAL_TOKEN_RE.match(data, cut):
+            data, self.pending = data[:cut], data[cut:]
+        data = data.replace('\r\n', '\n')
+        
+        # Plain text appended at the end of the line: no per-character work
+        if self.cursor == len(self.cells) and not TERMINAL_CONTROL_RE.search(data):
+            parts = data.split('\n')
+            done = ''
+            if len(parts) > 1:
+                if self.cells or self.sgr:
+                    self._write(parts[0])
+                    parts[0] = self._line()
+                done = '\n'.join(parts[:-1]) + '\n'
+            if parts[-1]:
+                self._write(parts[-1])
+        else:
+            completed = []
+            position = 0
+            for match in TERMINAL_TOKEN_RE.finditer(data):
+                if match.start() > position:
+                    self._write(data[position:match.start()])
+                if match.group() == '\n':
+                    completed.append(self._line() + '\n')
+                else:
+                    self._control(match)
+                position = match.end()
+            if position < len(data):
+                self._write(data[position:])
+            done = ''.join(completed)
+        
+        if done:
+            self.lines.append(done)
+            self.size += len(done)
+        return done
+    
+    def finish(self):
+        """Flush the unterminated last line; returns it"""
+        self.pending = ''
+        tail = self._line() if self.cells or self.sgr else ''
+        if tail:
+            self.lines.append(tail)
+            self.size += len(tail)
+        return tail
+    
+    @property
+    def text(self):
+        return ''.join(self.lines)
+    
+    @property
+    def raw_text(self):
+        return ''.join(self.raw) if self.raw is not None else None
+
+# ─────────────── PTY COMMAND EXECUTION ───────────────
+def is_interactive_command(cmd):
+    """Check if command requires interactive TTY"""
+    return classify_command(cmd).interactive
+
+def strip_sgr(text):
+    """text without SGR codes, and a function mapping its offsets back into text (None if it had none)"""
+    starts, shifts = [], []  # stripped offset where each run of text resumes, characters removed before it
+    removed = 0
+    for match in ANSI_SGR_RE.finditer(text):
+        removed += match.end() - match.start()
+        starts.append(match.end() - removed)
+        shifts.append(removed)
+    if not starts:
+        return text, None
+    
+    def raw_offset(offset):
+        index = bisect.bisect_right(starts, offset)
+        return offset + (shifts[index - 1] if index else 0)
+    return ANSI_SGR_RE.sub('', text), raw_offset
+
+def scan_output(text, capture):
+    """Extract highlights from normalized output.
+    
+    Output of a tool with a registered parser goes through that parser (plus
+    the generic patterns it asks for); anything else gets every pattern.
+    Provenance offsets point into the stored text, colour codes included.
+    """
+    base = capture.size - len(text)  # where this batch starts in the stored output
+    raw_offset = None
+    if OUTPUT_KEEP_SGR:
+        text, raw_offset = strip_sgr(text)
+    # Offsets into stripped text are mapped back once extraction is done
+    sources, offset_base = ({}, 0) if raw_offset else (capture.sources, base)
+    records = []  # (record, offset of its line)
+    if capture.parsers:
+        position = 0
+        for line in text.split('\n'):
+            for parser in capture.parsers:
+                records.extend((record, position) for record in parser.parse(line))
+            position += len(line) + 1
+        generic = sorted({name for parser in capture.parsers for name in parser.generic})
+    else:
+        generic = list(EXTRACTION_PATTERNS)
+    if 'hashes' in generic:
+        # Hashes become records too, so the findings tables know which command found them
+        generic.remove('hashes')
+        records.extend(hash_records(text))
+    for record, offset in records:
+        for category, value in record_highlights(record):
+            HIGHLIGHTS.add(category, value)
+            sources.setdefault((category, value), offset_base + offset)
+        capture.records.append(record)
+    if generic:
+        extract_highlights(text, generic, sources, offset_base)
+    if raw_offset:
+        for key, offset in sources.items():
+            capture.sources.setdefault(key, base + raw_offset(offset))
+
+def emit_command_output(decoded, capture):
+    """Display, record and scan one chunk of command output"""
+    if not QUIET:
+        sys.stdout.write(decoded)
+        sys.stdout.flush()
+    
+    # Record if recording
+    if RECORDING:
+        record_event('output', decoded)
+    
+    # Extract highlights in real-time, one batch of completed lines at a time
+    completed = capture.feed(decoded)
+    if completed:
+        scan_output(completed, capture)
+
+def finish_command_output(capture):
+    """Flush a command's capture into last_output / last_raw_output / last_records / last_sources"""
+    global last_output, last_raw_output, last_records, last_sources
+    tail = capture.finish()
+    if tail:
+        scan_output(tail, capture)
+    last_output, last_raw_output, last_records = capture.text, capture.raw_text, capture.records
+    last_sources = capture.sources
+
+def run_command_pty(command):
+    """Run command with PTY support for real-time output"""
+    if PERSISTENT_SHELL:
+        return run_command_persistent(command)
+    
+    capture = OutputCapture(command)
+    start_time = time.time()
+    
+    # Save terminal settings (there are none when stdin is a pipe or file)
+    stdin_is_tty = sys.stdin is not None and sys.stdin.isatty()
+    old_tty = termios.tcgetattr(sys.stdin) if stdin_is_tty else None
+    forward_input = stdin_is_tty and is_interactive_command(command)
+    
+    def handle_output(data):
+        emit_command_output(data.decode('utf-8', errors='replace'), capture)
+    
+    try:
+        # Create PTY
+        master_fd, slave_fd = pty.openpty()
+        
+        # Fork process
+        pid = os.fork()
+        
+        if pid == 0:  # Child process
+            os.close(master_fd)
+            os.setsid()
+            os.dup2(slave_fd, 0)
+            os.dup2(slave_fd, 1)
+            os.dup2(slave_fd, 2)
+            os.close(slave_fd)
+            
+            # Set working directory
+            os.chdir(CURRENT_WORKING_DIR)
+            
+            # Execute command
+            os.execvp('/bin/sh', ['/bin/sh', '-c', command])
+        
+        else:  # Parent process
+            os.close(slave_fd)
+            
+            # Set stdin to raw mode for interactive commands
+            if forward_input:
+                tty.setraw(sys.stdin.fileno())
+            
+            # Monitor output
+            while True:
+                try:
+                    # Check if process is still running
+                    pid_status, status = os.waitpid(pid, os.WNOHANG)
+                    if pid_status != 0:
+                        break
+                    
+                    # Check for available data
+                    r, w, e = select.select([master_fd, sys.stdin] if forward_input else [master_fd], [], [], 0.1)
+                    
+                    if master_fd in r:
+                        # Read from command output
+                        data = os.read(master_fd, 1024)
+                        if not data:
+                            break
+                        handle_output(data)
                     
-                    if sys.stdin in r and is_interactive_command(command):
+                    if forward_input and sys.stdin in r:
                         # Forward user input to command
                         data = os.read(sys.stdin.fileno(), 1024)
                         os.write(master_fd, data)
@@ -563,11 +1858,21 @@ def run_command_pty(command):
             if pid_status == 0:
                 _, status = os.waitpid(pid, 0)
             
+            # Drain output the command wrote just before exiting
+            try:
+                while select.select([master_fd], [], [], 0)[0]:
+                    data = os.read(master_fd, 1024)
+                    if not data:
+                        break
+                    handle_output(data)
+            except OSError:
+                pass  # EIO once the slave side is closed
+            
             os.close(master_fd)
             
             # Check exit status
             execution_time = time.time() - start_time
-            last_output = ''.join(output_buffer)
+            finish_command_output(capture)
             
             if os.WIFEXITED(status):
                 exit_code = os.WEXITSTATUS(status)
@@ -577,7 +1882,194 @@ def run_command_pty(command):
     
     finally:
         # Restore terminal settings
-        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_tty)
+        if old_tty is not None:
+            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_tty)
+
+SHELL_PROMPT_COMMAND = (
+    '__redterm_status=$?; '
+    'if [ -n "$__redterm_echo" ]; then stty -echo 2>/dev/null; unset __redterm_echo; fi; '
+    'printf "\\033]777;redterm-done;%s;%s\\007" "$__redterm_status" "$PWD"'
+)
+SHELL_MARKER_RE = re.compile(r'\x1b\]777;redterm-done;(\d+);([^\x07]*)\x07')
+SHELL_CONTINUE_RE = re.compile(r'\x1b\]777;redterm-continue\x07')  # PS2: bash wants another line
+
+class PersistentShell:
+    """A long-lived bash in a PTY that commands are injected into.
+    
+    Variables, functions, sourced environments and ulimits survive between
+    commands. The pty runs without echo and bash's PROMPT_COMMAND prints an
+    OSC 777 marker carrying $? and $PWD after every command, which is how
+    completion, the exit code and the new working directory are detected.
+    Interactive commands get echo back for their duration. PS2 prints its own
+    marker, so a line bash cannot complete (an open quote, a trailing
+    backslash) is cancelled with ^C instead of waiting at the continuation
+    prompt for input that never comes.
+    """
+    
+    def __init__(self):
+        self.pid = None
+        self.master_fd = None
+        self.cwd = None
+    
+    def alive(self):
+        if self.pid is None:
+            return False
+        try:
+            pid, _ = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            pid = self.pid
+        if pid:
+            self.close()
+            return False
+        return True
+    
+    def start(self):
+        pid, master_fd = pty.fork()  # Also makes the pty the shell's controlling terminal
+        if pid == 0:  # Child process
+            attrs = termios.tcgetattr(0)
+            attrs[3] &= ~termios.ECHO
+            termios.tcsetattr(0, termios.TCSANOW, attrs)
+            os.chdir(CURRENT_WORKING_DIR)
+            os.execvp(PERSISTENT_SHELL_PATH, [PERSISTENT_SHELL_PATH, '--noprofile', '--norc', '--noediting', '-i'])
+        
+        self.pid, self.master_fd, self.cwd = pid, master_fd, CURRENT_WORKING_DIR
+        # Not exported, so nested shells do not print markers
+        self._call("unset HISTFILE; PS1=''; PS2=$'\\e]777;redterm-continue\\a'; PROMPT_COMMAND="
+                   + shlex.quote(SHELL_PROMPT_COMMAND))
+    
+    def close(self):
+        if self.master_fd is not None:
+            try:
+                os.write(self.master_fd, b"exit\n")
+            except OSError:
+                pass
+            os.close(self.master_fd)
+        if self.pid is not None:
+            try:
+                os.waitpid(self.pid, 0)
+            except ChildProcessError:
+                pass
+        self.pid = self.master_fd = None
+    
+    def kill(self):
+        """Tear down a shell stuck in a command: hang up its pty, then SIGKILL bash"""
+        if self.master_fd is not None:
+            os.close(self.master_fd)  # SIGHUP to the foreground job
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+                os.waitpid(self.pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.pid = self.master_fd = None
+    
+    def _call(self, line):
+        """Run a bookkeeping line and discard its output"""
+        self.run(line, None, echo=False, display=False, timeout=COMMAND_TIMEOUTS['default'])
+    
+    def run(self, command, capture, forward_input=False, echo=None, display=True, timeout=None):
+        """Inject one command line; returns its exit code (None if the shell died).
+        
+        Raises TimeoutError, after killing the shell, when no marker arrives
+        within timeout seconds.
+        """
+        if echo is None:
+            echo = forward_input
+        deadline = time.time() + timeout if timeout else None
+        incomplete = False
+        # Echo is switched back off by PROMPT_COMMAND, so the command's $? is untouched
+        line = f"__redterm_echo=1; stty echo 2>/dev/null; {command}" if echo else command
+        os.write(self.master_fd, line.encode() + b"\n")
+        
+        pending = ""
+        while True:
+            if deadline and time.time() > deadline:
+                if display and pending:
+                    emit_command_output(pending, capture)
+                self.kill()
+                raise TimeoutError(f"no prompt after {timeout}s")
+            try:
+                sources = [self.master_fd, sys.stdin] if forward_input else [self.master_fd]
+                r, _, _ = select.select(sources, [], [], 0.1)
+                if self.master_fd in r:
+                    data = os.read(self.master_fd, 4096)
+                    if not data:
+                        raise OSError("shell exited")
+                    pending += data.decode('utf-8', errors='replace')
+                    if SHELL_CONTINUE_RE.search(pending):
+                        pending = SHELL_CONTINUE_RE.sub('', pending)
+                        if not incomplete:
+                            os.write(self.master_fd, b'\x03')  # Drop the unfinished line
+                            incomplete = True
+                    match = SHELL_MARKER_RE.search(pending)
+                    if match:
+                        if incomplete:  # Only bash's newline after ^C precedes the marker
+                            emit_command_output("redterm: incomplete command line (bash expected more input)\n", capture)
+                        elif display and match.start():
+                            emit_command_output(pending[:match.start()], capture)
+                        self.cwd = match.group(2) or self.cwd
+                        return int(match.group(1))
+                    # Hold back a marker that may still be arriving
+                    cut = pending.rfind('\x1b')
+                    cut = len(pending) if cut == -1 or '\x07' in pending[cut:] else cut
+                    if display and cut and not incomplete:
+                        emit_command_output(pending[:cut], capture)
+                    pending = pending[cut:]
+                if forward_input and sys.stdin in r:
+                    data = os.read(sys.stdin.fileno(), 1024)
+                    os.write(self.master_fd, data)
+                    if RECORDING:
+                        record_event('input', data.decode('utf-8', errors='replace'))
+            except KeyboardInterrupt:
+                os.write(self.master_fd, b'\x03')  # SIGINT to the shell's foreground job
+            except OSError:
+                if display and pending:
+                    emit_command_output(pending, capture)
+                self.close()
+                return None
+
+SHELL_SESSION = PersistentShell()
+atexit.register(SHELL_SESSION.close)
+
+def run_command_persistent(command):
+    """Run a command in the persistent shell, keeping CURRENT_WORKING_DIR in sync"""
+    global CURRENT_WORKING_DIR
+    
+    capture = OutputCapture(command)
+    start_time = time.time()
+    stdin_is_tty = sys.stdin is not None and sys.stdin.isatty()
+    old_tty = termios.tcgetattr(sys.stdin) if stdin_is_tty else None
+    forward_input = stdin_is_tty and is_interactive_command(command)
+    # Interactive sessions end when the user says so
+    timeout = None if forward_input else get_command_timeout(command)
+    
+    timed_out = False
+    try:
+        if not SHELL_SESSION.alive():
+            SHELL_SESSION.start()
+        if SHELL_SESSION.cwd != CURRENT_WORKING_DIR:
+            SHELL_SESSION._call(f"cd -- {shlex.quote(CURRENT_WORKING_DIR)}")
+        
+        if forward_input:
+            tty.setraw(sys.stdin.fileno())
+        exit_code = SHELL_SESSION.run(command, capture, forward_input, timeout=timeout)
+    except TimeoutError:
+        exit_code, timed_out = None, True
+    finally:
+        if old_tty is not None:
+            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_tty)
+    
+    if SHELL_SESSION.cwd and SHELL_SESSION.cwd != CURRENT_WORKING_DIR and os.path.isdir(SHELL_SESSION.cwd):
+        CURRENT_WORKING_DIR = SHELL_SESSION.cwd
+        os.chdir(CURRENT_WORKING_DIR)
+    
+    finish_command_output(capture)
+    if timed_out:
+        print_warning(f"Timed out after {timeout}s - restarting the persistent shell")
+        SHELL_SESSION.start()
+    elif exit_code is None:
+        print_warning("Persistent shell exited - a new one starts with the next command")
+    return exit_code == 0, time.time() - start_time
 
 # ─────────────── SCREENSHOT FUNCTIONS ───────────────
 def ensure_screenshot_dir():
@@ -587,59 +2079,202 @@ def ensure_screenshot_dir():
     engagement_dir.mkdir(exist_ok=True)
     return engagement_dir
 
-def take_screenshot(command_id=None, description=""):
-    """Take a screenshot of the current terminal"""
-    if not SCREENSHOT_AVAILABLE:
-        print_warning("Screenshot functionality not available")
-        return None
-    
+@functools.lru_cache(maxsize=None)
+def load_font(path, size):
+    """Load a TrueType font once per (path, size), falling back to the default"""
     try:
-        screenshot_dir = ensure_screenshot_dir()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"screenshot_{timestamp}.png"
-        filepath = screenshot_dir / filename
-        
-        # Take screenshot
-        screenshot = pyautogui.screenshot()
-        screenshot.save(filepath)
-        
-        # Add metadata overlay
-        img = Image.open(filepath)
-        draw = ImageDraw.Draw(img)
-        
-        # Try to load a font, fallback to default
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 16)
-        except:
-            font = ImageFont.load_default()
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+def annotate_screenshot(img, metadata):
+    """Composite the metadata banner onto an in-memory frame in one pass"""
+    font = load_font(SCREENSHOT_FONT, 16)
+    draw = ImageDraw.Draw(img, 'RGBA')
+    
+    # Semi-transparent background for text
+    text_bbox = draw.textbbox((0, 0), metadata, font=font)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+    draw.rectangle((10, 10, 30 + text_width, 20 + text_height), fill=(0, 0, 0, 128))
+    
+    draw.text((20, 15), metadata, fill=(255, 255, 255, 255), font=font)
+    return img
+
+def perceptual_hash(img, size=None):
+    """Difference hash (dHash) of a frame as a size*size-bit integer"""
+    size = size or SCREENSHOT_HASH_SIZE
+    small = img.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+class ScreenshotWorker:
+    """Background thread that composites, encodes and logs screenshots.
+    
+    The calling thread only grabs the frame; the overlay, the single encode
+    and the screenshots rows (written in batches over one connection) all
+    happen here. Auto-captures that are perceptually identical to the last
+    stored screenshot of the engagement are not written again but logged as
+    a link to it.
+    """
+    
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.last_stored = {}  # engagement -> [phash, filepath, screenshot id]
+        self.stats = {'stored': 0, 'deduplicated': 0}
+    
+    def submit(self, job):
+        """Queue a (frame, filepath, metadata, command_id, engagement, dedup) job.
         
-        # Add metadata text
-        metadata = f"Engagement: {ENGAGEMENT} | {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        if description:
-            metadata += f" | {description}"
+        frame may be a callable producing the image (text-rendered evidence),
+        in which case it is rendered here and gets no metadata banner.
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="screenshot-worker", daemon=True)
+                self.thread.start()
+        self.queue.put(job)
+    
+    def flush(self):
+        """Block until every queued screenshot is written and logged"""
+        if self.thread and self.thread.is_alive():
+            self.queue.join()
+    
+    def _run(self):
+        conn = sqlite3.connect(DB_PATH)
+        self.pending_rows = []
+        while True:
+            job = self.queue.get()
+            try:
+                row = self._process(conn, job)
+                if row:
+                    self.pending_rows.append(row)
+                if len(self.pending_rows) >= SCREENSHOT_DB_BATCH or self.queue.empty():
+                    self._write_rows(conn)
+            except Exception as e:
+                print_error(f"Screenshot failed: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def _write_rows(self, conn):
+        if self.pending_rows:
+            conn.executemany(
+                """INSERT INTO screenshots (engagement, command_id, filepath, timestamp, phash, duplicate_of, thumbnail)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                self.pending_rows
+            )
+            conn.commit()
+            self.pending_rows = []
+    
+    def _original_id(self, conn, last):
+        """Row id of the screenshot a duplicate links to (None if it has no row)"""
+        if last[2] is None:
+            self._write_rows(conn)  # The original's row may still be batched
+            row = conn.execute("SELECT id FROM screenshots WHERE filepath=? AND duplicate_of IS NULL",
+                               (last[1],)).fetchone()
+            last[2] = row[0] if row else None
+        return last[2]
+    
+    def _process(self, conn, job):
+        frame, filepath, metadata, command_id, engagement, dedup = job
+        if callable(frame):
+            frame = frame()
+            if frame is None:
+                return None
+        timestamp = datetime.utcnow().isoformat()
+        phash = perceptual_hash(frame)
+        phash_hex = f"{phash:0{SCREENSHOT_HASH_SIZE ** 2 // 4}x}"
+        last = self.last_stored.get(engagement)
         
-        # Add semi-transparent background for text
-        text_bbox = draw.textbbox((0, 0), metadata, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
+        if dedup and last and SCREENSHOT_DEDUP_THRESHOLD and \
+                bin(phash ^ last[0]).count('1') <= SCREENSHOT_DEDUP_THRESHOLD:
+            self.stats['deduplicated'] += 1
+            if command_id:
+                return (engagement, command_id, last[1], timestamp, phash_hex,
+                        self._original_id(conn, last), None)
+            return None
         
-        overlay = Image.new('RGBA', (text_width + 20, text_height + 10), (0, 0, 0, 128))
-        img.paste(overlay, (10, 10), overlay)
+        if metadata:
+            annotate_screenshot(frame, metadata)
+        if SCREENSHOT_FORMAT == 'webp':
+            frame.save(filepath, 'WEBP', quality=SCREENSHOT_WEBP_QUALITY, method=4)
+        else:
+            frame.save(filepath)
         
-        # Draw text
-        draw.text((20, 15), metadata, fill=(255, 255, 255, 255), font=font)
-        img.save(filepath)
+        thumbnail = None
+        if SCREENSHOT_THUMBNAILS:
+            thumb_dir = filepath.parent / 'thumbs'
+            thumb_dir.mkdir(exist_ok=True)
+            thumbnail = thumb_dir / f"{filepath.stem}.{SCREENSHOT_FORMAT}"
+            frame.thumbnail(SCREENSHOT_THUMBNAIL_SIZE)
+            frame.save(thumbnail)
+            thumbnail = str(thumbnail)
         
-        # Log to database
+        self.stats['stored'] += 1
+        self.last_stored[engagement] = [phash, str(filepath), None]
         if command_id:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("INSERT INTO screenshots (engagement, command_id, filepath, timestamp) VALUES (?, ?, ?, ?)",
-                      (ENGAGEMENT, command_id, str(filepath), datetime.utcnow().isoformat()))
-            conn.commit()
-            conn.close()
+            return (engagement, command_id, str(filepath), timestamp, phash_hex, None, thumbnail)
+        return None
+
+SCREENSHOT_WORKER = ScreenshotWorker()
+atexit.register(SCREENSHOT_WORKER.flush)
+
+def take_screenshot(command_id=None, description="", wait=False, dedup=False):
+    """Capture evidence and hand it to the background screenshot worker.
+    
+    Grabs the screen with pyautogui, or - without a display, or with
+    SCREENSHOT_MODE = 'text' - renders the command and its output as a
+    terminal-style image instead. Returns the path the image will be written
+    to. With wait=True the call blocks until the file exists; with dedup=True
+    a near-identical frame is linked to the previous screenshot instead of
+    being stored.
+    """
+    mode = resolve_screenshot_mode()
+    if not require('pil') or (mode == 'screen' and not require('screen')):
+        print_warning("Screenshot functionality not available")
+        return None
+    
+    try:
+        screenshot_dir = ensure_screenshot_dir()
+        now = datetime.now()
+        prefix = "screenshot" if mode == 'screen' else "evidence"
+        filename = f"{prefix}_{now.strftime('%Y%m%d_%H%M%S_%f')[:-3]}.{SCREENSHOT_FORMAT}"
+        filepath = screenshot_dir / filename
         
-        print_success(f"Screenshot saved: {filepath}")
+        if mode == 'screen':
+            # Add metadata text
+            metadata = f"Engagement: {ENGAGEMENT} | {now.strftime('%Y-%m-%d %H:%M:%S')}"
+            if description:
+                metadata += f" | {description}"
+            
+            # Only the grab happens here - it has to reflect the screen right now
+            frame = pyautogui.screenshot()
+        else:
+            # Rendering is deferred to the worker; the header carries the metadata
+            metadata = None
+            theme_name = CURRENT_THEME
+            if command_id:
+                frame = functools.partial(render_logged_command, command_id, DB_PATH, theme_name)
+            else:
+                if not last_command:
+                    print_warning("No command output to render yet")
+                    return None
+                header = f"Engagement: {ENGAGEMENT} | {now.strftime('%Y-%m-%d %H:%M:%S')}"
+                if description:
+                    header += f" | {description}"
+                frame = functools.partial(render_evidence_image, last_command,
+                                          sanitize_output(last_output, last_command),
+                                          last_status, header, theme_name)
+        SCREENSHOT_WORKER.submit((frame, filepath, metadata, command_id, ENGAGEMENT, dedup))
+        if wait:
+            SCREENSHOT_WORKER.flush()
         return str(filepath)
         
     except Exception as e:
@@ -649,7 +2284,220 @@ def take_screenshot(command_id=None, description=""):
 def auto_screenshot_if_enabled(command_id):
     """Take automatic screenshot if enabled"""
     if AUTO_SCREENSHOT and command_id:
-        take_screenshot(command_id, "Auto-capture after command")
+        take_screenshot(command_id, "Auto-capture after command", dedup=True)
+
+# ─────────────── EVIDENCE RENDERING ───────────────
+ANSI_SGR_RE = re.compile(r'\x1b\[([0-9;]*)m')
+ANSI_CONTROL_RE = re.compile(r'\x1b(?:\[[0-9;?]*[@-ln-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[()][A-Z0-9]|[=>])')
+
+# Standard 16-colour xterm palette
+ANSI_PALETTE = [
+    '#000000', '#cd0000', '#00cd00', '#cdcd00', '#0000ee', '#cd00cd', '#00cdcd', '#e5e5e5',
+    '#7f7f7f', '#ff0000', '#00ff00', '#ffff00', '#5c5cff', '#ff00ff', '#00ffff', '#ffffff'
+]
+
+def ansi_256_color(index):
+    """Hex colour of an xterm 256-colour palette index"""
+    if index < 16:
+        return ANSI_PALETTE[index]
+    if index < 232:
+        index -= 16
+        levels = [0, 95, 135, 175, 215, 255]
+        return '#%02x%02x%02x' % (levels[index // 36], levels[index // 6 % 6], levels[index % 6])
+    gray = 8 + (index - 232) * 10
+    return '#%02x%02x%02x' % (gray, gray, gray)
+
+def apply_sgr(params, state, default_fg):
+    """Update an [fg, bg, bold] state list from one SGR parameter string"""
+    codes = [int(code) if code else 0 for code in params.split(';')] if params else [0]
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code == 0:
+            state[:] = [default_fg, None, False]
+        elif code == 1:
+            state[2] = True
+        elif code == 22:
+            state[2] = False
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            state[0] = ANSI_PALETTE[code - 30 if code < 90 else code - 82]
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            state[1] = ANSI_PALETTE[code - 40 if code < 100 else code - 92]
+        elif code == 39:
+            state[0] = default_fg
+        elif code == 49:
+            state[1] = None
+        elif code in (38, 48) and i + 1 < len(codes):
+            slot = 0 if code == 38 else 1
+            if codes[i + 1] == 5 and i + 2 < len(codes):
+                state[slot] = ansi_256_color(codes[i + 2] % 256)
+                i += 2
+            elif codes[i + 1] == 2 and i + 4 < len(codes):
+                state[slot] = '#%02x%02x%02x' % tuple(min(c, 255) for c in codes[i + 2:i + 5])
+                i += 4
+        i += 1
+
+def ansi_cells(text, default_fg, columns):
+    """Split ANSI-coloured text into wrapped lines of (char, fg, bg, bold) cells"""
+    state = [default_fg, None, False]
+    lines = []
+    for raw_line in text.split('\n'):
+        # A bare carriage return redraws the line; keep what was drawn last
+        segments = [segment for segment in raw_line.split('\r') if segment]
+        raw_line = ANSI_CONTROL_RE.sub('', segments[-1] if segments else '')
+        cells = []
+        position = 0
+        for match in ANSI_SGR_RE.finditer(raw_line):
+            cells.extend((char, state[0], state[1], state[2]) for char in raw_line[position:match.start()])
+            apply_sgr(match.group(1), state, default_fg)
+            position = match.end()
+        cells.extend((char, state[0], state[1], state[2]) for char in raw_line[position:])
+        cells = [cell if cell[0] != '\t' else (' ',) + cell[1:] for cell in cells if cell[0] >= ' ' or cell[0] == '\t']
+        lines.extend(cells[i:i + columns] for i in range(0, max(len(cells), 1), columns))
+    return lines
+
+class GlyphCache:
+    """Rasterised glyph masks for the evidence renderer, keyed by (char, bold)"""
+    
+    def __init__(self, size):
+        self.regular = load_font(EVIDENCE_FONT, size)
+        self.bold = load_font(EVIDENCE_BOLD_FONT, size)
+        left, top, right, bottom = self.regular.getbbox("M")
+        self.cell_width = max(int(round(self.regular.getlength("M"))), right - left, 1)
+        left, top, right, bottom = self.regular.getbbox("|gjM")
+        self.cell_height = bottom + max(size // 4, 2)
+        self.masks = {}
+    
+    def mask(self, char, bold=False):
+        key = (char, bold)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = Image.new('L', (self.cell_width, self.cell_height), 0)
+            ImageDraw.Draw(mask).text((0, 0), char, fill=255, font=self.bold if bold else self.regular)
+            self.masks[key] = mask
+        return mask
+
+@functools.lru_cache(maxsize=None)
+def rgb(color):
+    """Hex colour string to an RGB tuple, memoised for the per-cell paste loop"""
+    return ImageColor.getrgb(color)
+
+@functools.lru_cache(maxsize=None)
+def get_glyph_cache(size):
+    """One glyph cache per font size for the life of the process"""
+    return GlyphCache(size)
+
+def render_evidence_image(command, output, status=None, header=None, theme_name=None):
+    """Render a command and its output as a terminal-style evidence image.
+    
+    Needs only Pillow - no display - so it works on headless boxes and
+    over SSH. ANSI colours in the output are honoured and the prompt,
+    header and status lines use the colours of the given (or current) theme.
+    """
+    theme = THEMES[theme_name or CURRENT_THEME]
+    glyphs = get_glyph_cache(EVIDENCE_FONT_SIZE)
+    columns = EVIDENCE_COLUMNS
+    
+    lines = []
+    if header:
+        lines.extend(ansi_cells(header, theme['info'], columns))
+    lines.extend(ansi_cells(f"$ {command}", theme['primary'], columns))
+    output_lines = ansi_cells(output.rstrip('\n'), EVIDENCE_FOREGROUND, columns) if output.strip() else []
+    if len(output_lines) > EVIDENCE_MAX_LINES:
+        omitted = len(output_lines) - EVIDENCE_MAX_LINES
+        output_lines = output_lines[:EVIDENCE_MAX_LINES] + ansi_cells(f"... [{omitted} more lines]", theme['warning'], columns)
+    lines.extend(output_lines)
+    if status:
+        lines.extend(ansi_cells(f"[{status}]", theme['success'] if status == 'success' else theme['error'], columns))
+    
+    padding = 12
+    width = max((len(line) for line in lines), default=1) * glyphs.cell_width + 2 * padding
+    height = len(lines) * glyphs.cell_height + 2 * padding
+    img = Image.new('RGB', (width, height), EVIDENCE_BACKGROUND)
+    
+    for row, line in enumerate(lines):
+        y = padding + row * glyphs.cell_height
+        for col, (char, fg, bg, bold) in enumerate(line):
+            x = padding + col * glyphs.cell_width
+            if bg:
+                img.paste(rgb(bg), (x, y, x + glyphs.cell_width, y + glyphs.cell_height))
+            if char != ' ':
+                img.paste(rgb(fg), (x, y), glyphs.mask(char, bold))
+    return img
+
+def display_available():
+    """Whether a GUI screen grab can work in this session"""
+    return sys.platform in ('darwin', 'win32') or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def resolve_screenshot_mode():
+    """Pick 'screen' or 'text' capture for the configured SCREENSHOT_MODE"""
+    if SCREENSHOT_MODE == 'auto':
+        return 'screen' if display_available() and probe_capability('screen') and require('screen', quiet=True) else 'text'
+    return SCREENSHOT_MODE
+
+def render_logged_command(command_id, db_path=None, theme_name=None):
+    """Evidence image for a logged command (sanitized output), or None if unknown"""
+    conn = sqlite3.connect(db_path or DB_PATH)
+    row = conn.execute("SELECT engagement, command, sanitized_output, status, timestamp FROM command_logs WHERE id=?",
+                       (command_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    engagement, command, output, status, timestamp = row
+    header = f"Engagement: {engagement} | Command #{command_id} | {timestamp[:19]}"
+    return render_evidence_image(command, output or '', status, header, theme_name)
+
+def _render_evidence_worker(command_id, db_path, theme_name, filepath):
+    """Render one logged command to an evidence image (runs in a worker process)"""
+    require('pil')
+    img = render_logged_command(command_id, db_path, theme_name)
+    if img is None:
+        return command_id, None
+    img.save(filepath)
+    return command_id, filepath
+
+def render_evidence_batch(command_ids, workers=None):
+    """Render evidence images for logged commands in parallel.
+    
+    Each image is logged in the screenshots table; returns the written paths.
+    """
+    if not require('pil', quiet=True):
+        print_error("Evidence rendering needs Pillow. Install with: pip install pillow")
+        return []
+    
+    screenshot_dir = ensure_screenshot_dir()
+    jobs = [(cmd_id, DB_PATH, CURRENT_THEME, str(screenshot_dir / f"evidence_{cmd_id}.png")) for cmd_id in command_ids]
+    workers = EVIDENCE_WORKERS if workers is None else workers
+    if len(jobs) > 1 and workers != 0:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_render_evidence_worker, *zip(*jobs)))
+    else:
+        results = [_render_evidence_worker(*job) for job in jobs]
+    
+    written = [(cmd_id, path) for cmd_id, path in results if path]
+    for cmd_id, path in results:
+        if not path:
+            print_warning(f"Command {cmd_id} not found")
+    if written:
+        conn = sqlite3.connect(DB_PATH)
+        timestamp = datetime.utcnow().isoformat()
+        conn.executemany("INSERT INTO screenshots (engagement, command_id, filepath, timestamp) VALUES (?, ?, ?, ?)",
+                         [(ENGAGEMENT, cmd_id, path, timestamp) for cmd_id, path in written])
+        conn.commit()
+        conn.close()
+    return [path for _, path in written]
+
+def parse_id_list(spec):
+    """Parse '12 15-18,20' style command id selections"""
+    ids = []
+    for part in re.split(r'[\s,]+', spec.strip()):
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        if not low.isdigit() or (high and not high.isdigit()):
+            raise ValueError(part)
+        ids.extend(range(int(low), int(high or low) + 1))
+    return ids
 
 # ─────────────── TERMINAL RECORDING FUNCTIONS ───────────────
 def ensure_recordings_dir():
@@ -722,7 +2570,7 @@ def stop_recording():
     print_info(f"Duration: {duration:.1f} seconds")
     
     # Export to asciinema if available
-    if ASCIINEMA_AVAILABLE:
+    if require('asciinema', quiet=True):
         try:
             asciinema_file = recording_dir / f"recording_{timestamp}.cast"
             export_to_asciinema(recording_metadata, asciinema_file)
@@ -779,7 +2627,7 @@ def list_recordings():
         print_info("No recordings found for this engagement")
         return
     
-    if RICH_AVAILABLE:
+    if require('rich'):
         table = Table(title=f"Recordings for {ENGAGEMENT}")
         table.add_column("ID", style="cyan")
         table.add_column("Timestamp", style="yellow")
@@ -841,7 +2689,7 @@ def playback_recording(recording_id):
 
 def export_recording_to_gif(recording_id, output_file=None):
     """Export recording to animated GIF (requires additional setup)"""
-    if not GIF_AVAILABLE:
+    if not require('gif', quiet=True):
         print_error("GIF export not available. Install with: pip install imageio[ffmpeg]")
         return
     
@@ -849,41 +2697,434 @@ def export_recording_to_gif(recording_id, output_file=None):
     # terminal rendering to images and then combining into GIF
     print_info("GIF export feature coming soon...")
 
-# ─────────────── HTML DASHBOARD GENERATION ───────────────
-def create_html_dashboard():
-    """Generate an HTML dashboard with charts and statistics"""
+# ─────────────── INCREMENTAL REPORT CACHE ───────────────
+def report_cache_dir(*parts):
+    """Cache directory for the engagement's report artifacts"""
+    path = Path(REPORT_CACHE_DIR, ENGAGEMENT, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def highlight_version():
+    """Cheap version stamp for HIGHLIGHTS (the categories only ever grow)"""
+    return HIGHLIGHTS.total()
+
+def _section_digest(kind, payload):
+    """Stable content hash of a section payload (its render time excluded)"""
+    if isinstance(payload, dict) and 'generated' in payload:
+        payload = {key: value for key, value in payload.items() if key != 'generated'}
+    return hashlib.sha256(json.dumps([kind, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+def load_report_manifest(artifact, settings=None):
+    """Load the build manifest of a report artifact.
+    
+    A blank manifest is returned when none exists yet or when it was built
+    with different settings, which forces a full rebuild.
+    """
+    settings_digest = _section_digest(artifact, settings)
+    path = report_cache_dir() / f"{artifact}.manifest.json"
+    try:
+        manifest = json.loads(path.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('version') != REPORT_MANIFEST_VERSION or manifest.get('settings') != settings_digest:
+        manifest = {
+            'version': REPORT_MANIFEST_VERSION,
+            'settings': settings_digest,
+            'last_command_id': 0,
+            'last_invalidation_id': 0,
+            'highlight_version': None,
+            'sections': {}
+        }
+    return manifest
+
+def save_report_manifest(artifact, manifest):
+    """Persist a report manifest next to the cached sections"""
+    path = report_cache_dir() / f"{artifact}.manifest.json"
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, path)
+
+def report_changes(manifest):
+    """Find commands added, edited or deleted since the manifest's watermark.
+    
+    Returns (last_command_id, last_invalidation_id, changed) where changed is
+    a list of (id, timestamp, command) rows. Edits and deletes come from the
+    report_invalidations table maintained by triggers on command_logs.
+    """
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
+    last_id = c.fetchone()[0]
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM report_invalidations")
+    last_invalidation = c.fetchone()[0]
     
-    # Gather statistics
+    c.execute("SELECT id, timestamp, command FROM command_logs WHERE engagement=? AND id > ? ORDER BY id",
+              (ENGAGEMENT, manifest['last_command_id']))
+    changed = list(iter_rows(c))
+    c.execute("""SELECT command_id, timestamp, command FROM report_invalidations
+                 WHERE engagement=? AND id > ? AND command_id <= ?""",
+              (ENGAGEMENT, manifest['last_invalidation_id'], manifest['last_command_id']))
+    changed.extend(iter_rows(c))
+    conn.close()
+    return last_id, last_invalidation, changed
+
+def report_up_to_date(manifest, last_id, changed):
+    """True when nothing the artifact depends on moved since it was built"""
+    return (manifest['last_command_id'] == last_id and not changed
+            and manifest['highlight_version'] == highlight_version())
+
+def mark_report_built(manifest, last_id, last_invalidation):
+    """Advance the manifest watermarks after a successful build"""
+    manifest['last_command_id'] = last_id
+    manifest['last_invalidation_id'] = last_invalidation
+    manifest['highlight_version'] = highlight_version()
+
+def clear_report_cache():
+    """Forget every cached report section of the current engagement"""
+    shutil.rmtree(Path(REPORT_CACHE_DIR) / ENGAGEMENT, ignore_errors=True)
+
+# ─────────────── HTML DASHBOARD GENERATION ───────────────
+# Bundled with the dashboard so it works on networks without CDN access
+DASHBOARD_CHARTS_JS = r"""/* Minimal canvas charts bundled with the RedTeam Terminal dashboard */
+(function (global) {
+    function setup(canvas, height) {
+        var ratio = global.devicePixelRatio || 1;
+        var width = Math.max(canvas.parentNode.clientWidth - 40, 200);
+        canvas.width = width * ratio;
+        canvas.height = height * ratio;
+        canvas.style.width = width + 'px';
+        canvas.style.height = height + 'px';
+        var ctx = canvas.getContext('2d');
+        ctx.scale(ratio, ratio);
+        ctx.font = '12px monospace';
+        return {ctx: ctx, width: width, height: height};
+    }
+
+    function doughnut(canvas, labels, values, colors) {
+        var c = setup(canvas, 270), ctx = c.ctx;
+        var total = values.reduce(function (a, b) { return a + b; }, 0) || 1;
+        var cx = c.width / 2, cy = 115, radius = 100, start = -Math.PI / 2;
+        values.forEach(function (value, i) {
+            var end = start + (value / total) * Math.PI * 2;
+            ctx.beginPath();
+            ctx.moveTo(cx, cy);
+            ctx.arc(cx, cy, radius, start, end);
+            ctx.closePath();
+            ctx.fillStyle = colors[i % colors.length];
+            ctx.fill();
+            start = end;
+        });
+        ctx.beginPath();
+        ctx.arc(cx, cy, radius * 0.6, 0, Math.PI * 2);
+        ctx.fillStyle = '#1a1a1a';
+        ctx.fill();
+        labels.forEach(function (label, i) {
+            var x = 10 + i * 140;
+            ctx.fillStyle = colors[i % colors.length];
+            ctx.fillRect(x, 245, 12, 12);
+            ctx.fillStyle = '#00ff00';
+            ctx.fillText(label + ' (' + values[i] + ')', x + 18, 255);
+        });
+    }
+
+    function hbar(canvas, labels, values, color) {
+        var rowHeight = 24;
+        var c = setup(canvas, Math.max(labels.length, 1) * rowHeight + 10), ctx = c.ctx;
+        var max = Math.max.apply(null, values.concat([1]));
+        var labelWidth = Math.min(280, c.width / 2);
+        ctx.textBaseline = 'middle';
+        labels.forEach(function (label, i) {
+            var y = 5 + i * rowHeight;
+            var width = (c.width - labelWidth - 60) * values[i] / max;
+            ctx.fillStyle = '#00ff00';
+            ctx.textAlign = 'right';
+            ctx.fillText(label.length > 34 ? label.slice(0, 33) + '…' : label, labelWidth - 8, y + rowHeight / 2);
+            ctx.fillStyle = color;
+            ctx.fillRect(labelWidth, y + 4, width, rowHeight - 8);
+            ctx.fillStyle = '#888';
+            ctx.textAlign = 'left';
+            ctx.fillText(String(values[i]), labelWidth + width + 6, y + rowHeight / 2);
+        });
+    }
+
+    global.RedTermCharts = {doughnut: doughnut, hbar: hbar};
+})(window);
+"""
+
+DASHBOARD_APP_JS = r"""/* RedTeam Terminal dashboard: lazily loaded data pages + virtual scrolling */
+(function (global) {
+    var ROW_HEIGHT = 28, OVERSCAN = 10;
+    var RedTerm = global.RedTerm = global.RedTerm || {};
+    var pending = {};
+
+    // Data pages are JSONP files so the dashboard also works from file://
+    RedTerm.load = function (name, payload) {
+        var callback = pending[name];
+        delete pending[name];
+        if (callback) callback(payload);
+    };
+
+    function loadPage(name, callback) {
+        pending[name] = callback;
+        var script = document.createElement('script');
+        script.src = RedTerm.dataDir + '/' + name + '.js';
+        script.onload = function () { script.remove(); };
+        document.body.appendChild(script);
+    }
+
+    // Only the rows inside the viewport (plus some overscan) are in the DOM
+    function VirtualTable(container, renderRow) {
+        this.container = container;
+        this.renderRow = renderRow;
+        this.rows = [];
+        this.spacer = document.createElement('div');
+        this.spacer.className = 'vt-spacer';
+        container.appendChild(this.spacer);
+        container.addEventListener('scroll', this.draw.bind(this));
+    }
+
+    VirtualTable.prototype.setRows = function (rows) {
+        this.rows = rows;
+        this.spacer.style.height = rows.length * ROW_HEIGHT + 'px';
+        this.container.scrollTop = 0;
+        this.draw();
+    };
+
+    VirtualTable.prototype.draw = function () {
+        var first = Math.max(0, Math.floor(this.container.scrollTop / ROW_HEIGHT) - OVERSCAN);
+        var last = Math.min(this.rows.length, first + Math.ceil(this.container.clientHeight / ROW_HEIGHT) + OVERSCAN * 2);
+        var fragment = document.createDocumentFragment();
+        for (var i = first; i < last; i++) {
+            var row = this.renderRow(this.rows[i]);
+            row.classList.add('vt-row');
+            row.style.top = i * ROW_HEIGHT + 'px';
+            fragment.appendChild(row);
+        }
+        this.spacer.textContent = '';
+        this.spacer.appendChild(fragment);
+    };
+
+    function cell(row, text, className) {
+        var span = document.createElement('span');
+        span.className = className;
+        span.textContent = text;
+        row.appendChild(span);
+    }
+
+    function pager(element, pages, table) {
+        var index = 0;
+        var label = element.querySelector('.page-label');
+        function show() {
+            if (!pages.length) {
+                label.textContent = 'No data';
+                table.setRows([]);
+                return;
+            }
+            label.textContent = 'Page ' + (index + 1) + ' / ' + pages.length;
+            loadPage(pages[index], function (rows) { table.setRows(rows); });
+        }
+        element.querySelector('.prev').onclick = function () { if (index > 0) { index--; show(); } };
+        element.querySelector('.next').onclick = function () { if (index < pages.length - 1) { index++; show(); } };
+        show();
+        return function (newPages) { pages = newPages; index = 0; show(); };
+    }
+
+    RedTerm.init = function (summary) {
+        var charts = global.RedTermCharts;
+        charts.doughnut(document.getElementById('statusChart'), ['Success', 'Error'],
+                        [summary.success_count, summary.error_count], ['#00ff00', '#ff0000']);
+        charts.hbar(document.getElementById('topCommandsChart'),
+                    summary.top_commands.map(function (c) { return c[0]; }),
+                    summary.top_commands.map(function (c) { return c[1]; }), '#00ff00');
+        charts.hbar(document.getElementById('tagsChart'),
+                    summary.tags.map(function (t) { return t[0]; }),
+                    summary.tags.map(function (t) { return t[1]; }), 'rgba(0, 255, 0, 0.5)');
+
+        var commands = new VirtualTable(document.getElementById('commandTable'), function (c) {
+            var row = document.createElement('div');
+            row.className = 'command-item ' + c[3];
+            cell(row, c[0].slice(0, 19), 'timestamp');
+            cell(row, c[2].toFixed(1) + 's', 'duration');
+            cell(row, c[1], 'command');
+            return row;
+        });
+        pager(document.getElementById('commandPager'),
+              summary.command_pages.map(function (key) { return 'commands-' + key; }), commands);
+
+        var highlights = new VirtualTable(document.getElementById('highlightTable'), function (value) {
+            var row = document.createElement('div');
+            row.className = 'command-item';
+            cell(row, value, 'command');
+            return row;
+        });
+        var select = document.getElementById('highlightCategory');
+        summary.highlight_categories.forEach(function (category, i) {
+            var option = document.createElement('option');
+            option.value = i;
+            option.textContent = category[0] + ' (' + category[1] + ')';
+            select.appendChild(option);
+        });
+        function categoryPages(i) {
+            var category = summary.highlight_categories[i];
+            var pages = [];
+            for (var page = 0; category && page < category[2]; page++) pages.push('highlights-' + i + '-' + page);
+            return pages;
+        }
+        var setHighlightPages = pager(document.getElementById('highlightPager'), categoryPages(0), highlights);
+        select.onchange = function () { setHighlightPages(categoryPages(select.value)); };
+    };
+
+    RedTerm.boot = function (dataDir) {
+        RedTerm.dataDir = dataDir;
+        loadPage('summary', RedTerm.init);
+    };
+})(window);
+"""
+
+def write_dashboard_data(data_dir, name, payload):
+    """Write a dashboard data page as a JSON payload wrapped for file:// loading"""
+    with open(data_dir / f"{name}.js", 'w') as f:
+        f.write(f"RedTerm.load({json.dumps(name)}, ")
+        json.dump(payload, f, separators=(',', ':'))
+        f.write(");\n")
+
+def dashboard_aggregates(c):
+    """Compute the dashboard statistics with indexed SQL aggregates"""
     c.execute("SELECT COUNT(*), AVG(execution_time), SUM(CASE WHEN status='success' THEN 1 ELSE 0 END), SUM(CASE WHEN status='error' THEN 1 ELSE 0 END) FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
     total, avg_time, success_count, error_count = c.fetchone()
-    success_rate = (success_count / total * 100) if total > 0 else 0
-    
-    # Command timeline
-    c.execute("SELECT timestamp, command, execution_time, status FROM command_logs WHERE engagement=? ORDER BY id DESC LIMIT 20", (ENGAGEMENT,))
-    recent_commands = c.fetchall()
     
     # Top commands
     c.execute("SELECT command, COUNT(*) as count FROM command_logs WHERE engagement=? GROUP BY command ORDER BY count DESC LIMIT 10", (ENGAGEMENT,))
-    top_commands = c.fetchall()
+    top_commands = [(cmd[:30] + "..." if len(cmd) > 30 else cmd, count) for cmd, count in c.fetchall()]
     
-    # Tag statistics
-    c.execute("SELECT tags FROM command_logs WHERE engagement=? AND tags IS NOT NULL AND tags != ''", (ENGAGEMENT,))
-    all_tags = []
-    for (tags,) in c.fetchall():
-        all_tags.extend(tags.split(','))
-    tag_counts = {}
-    for tag in all_tags:
-        tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    # Tag statistics - the comma separated tag lists are split inside SQLite
+    c.execute("""
+        WITH RECURSIVE split(tag, rest) AS (
+            SELECT '', tags || ',' FROM command_logs
+            WHERE engagement=? AND tags IS NOT NULL AND tags != ''
+            UNION ALL
+            SELECT substr(rest, 1, instr(rest, ',') - 1), substr(rest, instr(rest, ',') + 1)
+            FROM split WHERE rest != ''
+        )
+        SELECT tag, COUNT(*) as count FROM split WHERE tag != '' GROUP BY tag ORDER BY count DESC LIMIT 20
+    """, (ENGAGEMENT,))
+    tags = c.fetchall()
     
     # Get highlights summary
-    highlights_summary = {}
-    try:
-        c.execute("SELECT category, COUNT(*) FROM highlights WHERE engagement=? GROUP BY category", (ENGAGEMENT,))
-        highlights_summary = dict(c.fetchall())
-    except:
-        pass
+    c.execute("SELECT category, COUNT(*) FROM highlights WHERE engagement=? GROUP BY category", (ENGAGEMENT,))
+    highlights_summary = c.fetchall()
+    
+    return {
+        'engagement': ENGAGEMENT,
+        'generated': datetime.utcnow().isoformat(),
+        'total': total,
+        'avg_time': avg_time or 0,
+        'success_rate': (success_count / total * 100) if total else 0,
+        'success_count': success_count or 0,
+        'error_count': error_count or 0,
+        'top_commands': top_commands,
+        'tags': tags,
+        'highlights': highlights_summary
+    }
+
+def write_highlight_pages(c, data_dir):
+    """Page every highlight category into DASHBOARD_PAGE_SIZE chunks.
+    
+    Returns [category, count, pages] entries for the summary payload.
+    """
+    for stale in data_dir.glob("highlights-*.js"):
+        stale.unlink()
+    
+    categories = []
+    c.execute("SELECT category, value FROM highlights WHERE engagement=? ORDER BY category, value", (ENGAGEMENT,))
+    page, current = [], None
+    for category, value in iter_rows(c):
+        if category != current or len(page) == DASHBOARD_PAGE_SIZE:
+            if page:
+                write_dashboard_data(data_dir, f"highlights-{len(categories) - 1}-{categories[-1][2]}", page)
+                categories[-1][1] += len(page)
+                categories[-1][2] += 1
+                page = []
+            if category != current:
+                categories.append([category, 0, 0])
+                current = category
+        page.append(value)
+    if page:
+        write_dashboard_data(data_dir, f"highlights-{len(categories) - 1}-{categories[-1][2]}", page)
+        categories[-1][1] += len(page)
+        categories[-1][2] += 1
+    return categories
+
+def create_html_dashboard():
+    """Generate an offline HTML dashboard with charts and statistics.
+    
+    The HTML shell only references bundled assets; the data is emitted as
+    separate payload pages that the browser loads on demand, so the page
+    opens instantly regardless of engagement size.
+    """
+    filename = f"{ENGAGEMENT}_dashboard.html"
+    files_dir = Path(f"{ENGAGEMENT}_dashboard_files")
+    data_dir = files_dir / 'data'
+    manifest = load_report_manifest('dashboard', {'chunk_size': REPORT_CHUNK_SIZE, 'page_size': DASHBOARD_PAGE_SIZE})
+    last_id, last_invalidation, changed = report_changes(manifest)
+    if report_up_to_date(manifest, last_id, changed) and os.path.exists(filename):
+        print_success(f"HTML Dashboard is up to date: {filename}")
+        return filename
+    
+    data_dir.mkdir(parents=True, exist_ok=True)
+    (files_dir / 'charts.js').write_text(DASHBOARD_CHARTS_JS)
+    (files_dir / 'dashboard.js').write_text(DASHBOARD_APP_JS)
+    
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    # Command pages follow the report id chunks; only touched ones are rewritten
+    pages = manifest['sections']
+    dirty = {str(row[0] // REPORT_CHUNK_SIZE) for row in changed}
+    dirty |= {key for key in pages if not (data_dir / f"commands-{key}.js").exists()}
+    for key in dirty:
+        low = int(key) * REPORT_CHUNK_SIZE
+        c.execute("SELECT timestamp, command, execution_time, status FROM command_logs WHERE engagement=? AND id BETWEEN ? AND ? ORDER BY id DESC",
+                  (ENGAGEMENT, low, low + REPORT_CHUNK_SIZE - 1))
+        rows = c.fetchall()
+        if rows:
+            write_dashboard_data(data_dir, f"commands-{key}", rows)
+            pages[key] = len(rows)
+        else:
+            (data_dir / f"commands-{key}.js").unlink(missing_ok=True)
+            pages.pop(key, None)
+    
+    if manifest['highlight_version'] != highlight_version() or 'highlight_categories' not in manifest:
+        manifest['highlight_categories'] = write_highlight_pages(c, data_dir)
+    
+    summary = dashboard_aggregates(c)
+    summary['command_pages'] = sorted(pages, key=int, reverse=True)
+    summary['highlight_categories'] = manifest['highlight_categories']
+    write_dashboard_data(data_dir, 'summary', summary)
+    conn.close()
+    
+    engagement = html.escape(ENGAGEMENT)
+    assets = html.escape(files_dir.name)
+    stats = f"""
+            <div class="stat-card">
+                <div class="stat-label">Total Commands</div>
+                <div class="stat-value">{summary['total']}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Success Rate</div>
+                <div class="stat-value">{summary['success_rate']:.1f}%</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Avg Execution Time</div>
+                <div class="stat-value">{summary['avg_time']:.1f}s</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Failed Commands</div>
+                <div class="stat-value" style="color: #ff0000;">{summary['error_count']}</div>
+            </div>"""
+    highlight_items = ' '.join(
+        f'<div class="highlight-item">{html.escape(cat)}: {count}</div>' for cat, count in summary['highlights']
+    )
     
     html_content = f"""
 <!DOCTYPE html>
@@ -891,8 +3132,9 @@ def create_html_dashboard():
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>RedTeam Terminal Dashboard - {ENGAGEMENT}</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <title>RedTeam Terminal Dashboard - {engagement}</title>
+    <script src="{assets}/charts.js"></script>
+    <script src="{assets}/dashboard.js"></script>
     <style>
         * {{
             margin: 0;
@@ -940,7 +3182,7 @@ def create_html_dashboard():
             font-size: 0.9em;
             text-transform: uppercase;
         }}
-        .chart-container {{
+        .chart-container, .command-list, .highlights-section {{
             background: #1a1a1a;
             border: 1px solid #00ff00;
             border-radius: 10px;
@@ -948,24 +3190,46 @@ def create_html_dashboard():
             margin-bottom: 30px;
             box-shadow: 0 0 20px rgba(0, 255, 0, 0.2);
         }}
-        .command-list {{
-            background: #1a1a1a;
+        .pager {{
+            margin: 10px 0;
+        }}
+        .pager button, .pager select {{
+            background: #0a0a0a;
+            color: #00ff00;
             border: 1px solid #00ff00;
-            border-radius: 10px;
-            padding: 20px;
-            margin-bottom: 30px;
+            padding: 3px 10px;
+            margin-right: 8px;
+        }}
+        .vt-viewport {{
+            height: 420px;
+            overflow-y: auto;
+            position: relative;
+        }}
+        .vt-spacer {{
+            position: relative;
+        }}
+        .vt-row {{
+            position: absolute;
+            left: 0;
+            right: 0;
+            height: 26px;
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
         }}
         .command-item {{
             background: #0a0a0a;
             border-left: 3px solid #00ff00;
-            padding: 10px 15px;
-            margin-bottom: 10px;
+            padding: 4px 15px;
             font-family: 'Courier New', monospace;
             font-size: 0.9em;
         }}
+        .command-item span {{
+            margin-right: 12px;
+        }}
         .success {{ border-left-color: #00ff00; }}
         .error {{ border-left-color: #ff0000; }}
-        .timestamp {{
+        .timestamp, .duration {{
             color: #888;
             font-size: 0.8em;
         }}
@@ -975,13 +3239,6 @@ def create_html_dashboard():
             gap: 30px;
             margin-bottom: 30px;
         }}
-        .highlights-section {{
-            background: #1a1a1a;
-            border: 1px solid #00ff00;
-            border-radius: 10px;
-            padding: 20px;
-            margin-bottom: 30px;
-        }}
         .highlight-item {{
             display: inline-block;
             background: #0a0a0a;
@@ -1000,30 +3257,19 @@ def create_html_dashboard():
 </head>
 <body>
     <div class="container">
-        <h1>🔴 RedTeam Terminal Dashboard - {ENGAGEMENT}</h1>
+        <h1>🔴 RedTeam Terminal Dashboard - {engagement}</h1>
         
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-label">Total Commands</div>
-                <div class="stat-value">{total}</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Success Rate</div>
-                <div class="stat-value">{success_rate:.1f}%</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Avg Execution Time</div>
-                <div class="stat-value">{avg_time:.1f}s</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-label">Failed Commands</div>
-                <div class="stat-value" style="color: #ff0000;">{error_count}</div>
-            </div>
+        <div class="stats-grid">{stats}
         </div>
         
         <div class="highlights-section">
             <h3>🎯 Extracted Highlights</h3>
-            {' '.join([f'<div class="highlight-item">{cat}: {count}</div>' for cat, count in highlights_summary.items()])}
+            {highlight_items}
+            <div class="pager" id="highlightPager">
+                <select id="highlightCategory"></select>
+                <button class="prev">&larr;</button><span class="page-label"></span><button class="next">&rarr;</button>
+            </div>
+            <div class="vt-viewport" id="highlightTable"></div>
         </div>
         
         <div class="charts-row">
@@ -1038,8 +3284,11 @@ def create_html_dashboard():
         </div>
         
         <div class="command-list">
-            <h3>Recent Commands</h3>
-            {"".join([f'<div class="command-item {row[3]}"><div class="timestamp">{row[0][:19]} ({row[2]:.1f}s)</div>{row[1]}</div>' for row in recent_commands])}
+            <h3>Commands</h3>
+            <div class="pager" id="commandPager">
+                <button class="prev">&larr;</button><span class="page-label"></span><button class="next">&rarr;</button>
+            </div>
+            <div class="vt-viewport" id="commandTable"></div>
         </div>
         
         <div class="chart-container">
@@ -1047,216 +3296,96 @@ def create_html_dashboard():
             <canvas id="tagsChart"></canvas>
         </div>
     </div>
-    
-    <script>
-        // Status Chart
-        const statusCtx = document.getElementById('statusChart').getContext('2d');
-        new Chart(statusCtx, {{
-            type: 'doughnut',
-            data: {{
-                labels: ['Success', 'Error'],
-                datasets: [{{
-                    data: [{success_count}, {error_count}],
-                    backgroundColor: ['#00ff00', '#ff0000'],
-                    borderColor: ['#00ff00', '#ff0000'],
-                    borderWidth: 2
-                }}]
-            }},
-            options: {{
-                responsive: true,
-                plugins: {{
-                    legend: {{
-                        labels: {{
-                            color: '#00ff00'
-                        }}
-                    }}
-                }}
-            }}
-        }});
-        
-        // Top Commands Chart
-        const topCommandsCtx = document.getElementById('topCommandsChart').getContext('2d');
-        new Chart(topCommandsCtx, {{
-            type: 'bar',
-            data: {{
-                labels: {[cmd[0][:30] + "..." if len(cmd[0]) > 30 else cmd[0] for cmd in top_commands[:5]]},
-                datasets: [{{
-                    label: 'Executions',
-                    data: {[cmd[1] for cmd in top_commands[:5]]},
-                    backgroundColor: '#00ff00',
-                    borderColor: '#00ff00',
-                    borderWidth: 1
-                }}]
-            }},
-            options: {{
-                responsive: true,
-                scales: {{
-                    y: {{
-                        beginAtZero: true,
-                        grid: {{
-                            color: '#333'
-                        }},
-                        ticks: {{
-                            color: '#00ff00'
-                        }}
-                    }},
-                    x: {{
-                        grid: {{
-                            color: '#333'
-                        }},
-                        ticks: {{
-                            color: '#00ff00'
-                        }}
-                    }}
-                }},
-                plugins: {{
-                    legend: {{
-                        display: false
-                    }}
-                }}
-            }}
-        }});
-        
-        // Tags Chart
-        const tagsCtx = document.getElementById('tagsChart').getContext('2d');
-        new Chart(tagsCtx, {{
-            type: 'radar',
-            data: {{
-                labels: {list(tag_counts.keys())},
-                datasets: [{{
-                    label: 'Tag Usage',
-                    data: {list(tag_counts.values())},
-                    backgroundColor: 'rgba(0, 255, 0, 0.2)',
-                    borderColor: '#00ff00',
-                    borderWidth: 2,
-                    pointBackgroundColor: '#00ff00'
-                }}]
-            }},
-            options: {{
-                responsive: true,
-                scales: {{
-                    r: {{
-                        beginAtZero: true,
-                        grid: {{
-                            color: '#333'
-                        }},
-                        pointLabels: {{
-                            color: '#00ff00'
-                        }},
-                        ticks: {{
-                            color: '#00ff00'
-                        }}
-                    }}
-                }},
-                plugins: {{
-                    legend: {{
-                        labels: {{
-                            color: '#00ff00'
-                        }}
-                    }}
-                }}
-            }}
-        }});
-    </script>
+    <script>RedTerm.boot("{assets}/data");</script>
 </body>
 </html>
 """
     
-    filename = f"{ENGAGEMENT}_dashboard.html"
     with open(filename, 'w') as f:
         f.write(html_content)
     
-    conn.close()
+    mark_report_built(manifest, last_id, last_invalidation)
+    save_report_manifest('dashboard', manifest)
     print_success(f"HTML Dashboard generated: {filename}")
     return filename
 
 # ─────────────── PDF EXPORT FUNCTIONS ───────────────
-def create_pdf_report():
-    """Generate a professional PDF report"""
-    if not PDF_AVAILABLE:
-        print_error("PDF generation not available. Install with: pip install reportlab")
-        return
+def _pdf_styles():
+    """Build the paragraph styles shared by every PDF section"""
+    styles = getSampleStyleSheet()
     
-    try:
-        filename = f"{ENGAGEMENT}_report.pdf"
-        doc = SimpleDocTemplate(filename, pagesize=A4)
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=HexColor('#2c3e50'),
-            alignment=1,  # Center
-            spaceAfter=30
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            textColor=HexColor('#34495e'),
-            leftIndent=0,
-            spaceAfter=12
-        )
-        
-        code_style = ParagraphStyle(
-            'Code',
-            parent=styles['Code'],
-            fontSize=10,
-            leftIndent=20,
-            backgroundColor=HexColor('#f8f9fa'),
-            borderColor=HexColor('#e9ecef'),
-            borderWidth=1,
-            borderPadding=5
-        )
-        
-        story = []
-        
-        # Title page
-        story.append(Paragraph(f"Red Team Assessment Report", title_style))
-        story.append(Paragraph(f"Engagement: {ENGAGEMENT}", styles['Heading2']))
-        story.append(Paragraph(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    # Custom styles
+    styles.add(ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=HexColor('#2c3e50'),
+        alignment=1,  # Center
+        spaceAfter=30
+    ))
+    
+    styles.add(ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        textColor=HexColor('#34495e'),
+        leftIndent=0,
+        spaceAfter=12
+    ))
+    
+    styles.add(ParagraphStyle(
+        'CodeBlock',
+        parent=styles['Code'],
+        fontSize=10,
+        leftIndent=20,
+        backgroundColor=HexColor('#f8f9fa'),
+        borderColor=HexColor('#e9ecef'),
+        borderWidth=1,
+        borderPadding=5
+    ))
+    return styles
+
+def _pdf_section_story(kind, payload, styles):
+    """Turn one report section payload into ReportLab flowables"""
+    story = []
+    
+    if kind == 'summary':
+        story.append(Paragraph("Red Team Assessment Report", styles['CustomTitle']))
+        story.append(Paragraph(f"Engagement: {payload['engagement']}", styles['Heading2']))
+        story.append(Paragraph(f"Generated: {payload['generated']}", styles['Normal']))
         story.append(Spacer(1, 20))
         
-        # Executive Summary
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        c.execute("SELECT COUNT(*), AVG(execution_time), SUM(CASE WHEN status='success' THEN 1 ELSE 0 END), SUM(CASE WHEN status='error' THEN 1 ELSE 0 END) FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
-        total, avg_time, success_count, error_count = c.fetchone()
-        success_rate = (success_count / total * 100) if total > 0 else 0
-        
-        story.append(Paragraph("Executive Summary", heading_style))
+        story.append(Paragraph("Executive Summary", styles['CustomHeading']))
         summary_text = f"""
         <para>
-        Total Commands Executed: {total}<br/>
-        Average Execution Time: {avg_time:.2f} seconds<br/>
-        Success Rate: {success_rate:.1f}% ({success_count}/{total})<br/>
-        Failed Commands: {error_count}<br/>
+        Total Commands Executed: {payload['total']}<br/>
+        Average Execution Time: {payload['avg_time']:.2f} seconds<br/>
+        Success Rate: {payload['success_rate']:.1f}% ({payload['success_count']}/{payload['total']})<br/>
+        Failed Commands: {payload['error_count']}<br/>
         </para>
         """
         story.append(Paragraph(summary_text, styles['Normal']))
         story.append(Spacer(1, 20))
+    
+    elif kind == 'highlights':
+        story.append(Paragraph("Extracted Highlights", styles['CustomHeading']))
+        for category, items, total in payload['categories']:
+            highlight_text = f"<b>{category}:</b> {', '.join(items)}"
+            if total > len(items):
+                highlight_text += f" ... and {total - len(items)} more"
+            story.append(Paragraph(highlight_text, styles['Normal']))
+        story.append(Spacer(1, 20))
+    
+    elif kind == 'timeline':
+        story.append(Paragraph(f"Command Timeline - {payload['title']}", styles['CustomHeading']))
+        if payload['skipped']:
+            story.append(Paragraph(
+                f"<i>{payload['skipped']} of {payload['skipped'] + len(payload['commands'])} commands "
+                f"omitted by the '{payload['sampling']}' sampling policy</i>",
+                styles['Normal']
+            ))
         
-        # Extracted Highlights
-        if HIGHLIGHTS:
-            story.append(Paragraph("Extracted Highlights", heading_style))
-            for category, items in sorted(HIGHLIGHTS.items()):
-                if items:
-                    highlight_text = f"<b>{category}:</b> {', '.join(sorted(items)[:10])}"
-                    if len(items) > 10:
-                        highlight_text += f" ... and {len(items) - 10} more"
-                    story.append(Paragraph(highlight_text, styles['Normal']))
-            story.append(Spacer(1, 20))
-        
-        # Command Timeline
-        story.append(Paragraph("Command Timeline", heading_style))
-        c.execute("SELECT timestamp, command, sanitized_output, execution_time, tags, status FROM command_logs WHERE engagement=? ORDER BY id", (ENGAGEMENT,))
-        
-        for row in c.fetchall():
-            timestamp, cmd, output, exec_time, tags, status = row
+        for timestamp, cmd, output, exec_time, tags, status in payload['commands']:
             status_icon = "✓" if status == 'success' else "✗"
             
             # Command header
@@ -1266,21 +3395,235 @@ def create_pdf_report():
             story.append(Paragraph(cmd_header, styles['Heading3']))
             
             # Command
-            story.append(Paragraph(f"Command:", styles['Normal']))
-            story.append(Preformatted(f"$ {cmd}", code_style))
+            story.append(Paragraph("Command:", styles['Normal']))
+            story.append(Preformatted(f"$ {cmd}", styles['CodeBlock']))
             
-            # Output (truncated for PDF)
+            # Output (already truncated by the report policy)
             if output.strip():
-                story.append(Paragraph(f"Output:", styles['Normal']))
-                truncated_output = output[:1000] + "..." if len(output) > 1000 else output
-                story.append(Preformatted(truncated_output, code_style))
+                story.append(Paragraph("Output:", styles['Normal']))
+                story.append(Preformatted(output, styles['CodeBlock']))
             
             story.append(Spacer(1, 12))
+        story.append(PageBreak())
+    
+    return story
+
+def render_pdf_section(filepath, kind, payload):
+    """Render a single report section to its own PDF file.
+    
+    Top-level so it can be shipped to a process pool worker.
+    """
+    require('pdf')
+    doc = SimpleDocTemplate(str(filepath), pagesize=A4)
+    doc.build(_pdf_section_story(kind, payload, _pdf_styles()))
+    return str(filepath)
+
+def truncate_output(head, tail, length, config=None):
+    """Apply the configured truncation policy to an output's head/tail slices"""
+    config = config or PDF_REPORT_CONFIG
+    limit = config['output_limit']
+    policy = config['truncation']
+    if policy == 'none' or length <= limit:
+        return head
+    if not limit:
+        return ""
+    if policy == 'head_tail':
+        half = limit // 2
+        return f"{head[:half]}\n... [{length - 2 * half} chars truncated] ...\n{tail[-half:] if half else ''}"
+    return head[:limit] + "..."
+
+def sample_commands(rows, config=None):
+    """Apply the configured sampling policy to a section's command rows"""
+    config = config or PDF_REPORT_CONFIG
+    policy = config['sampling']
+    size = config['sample_size']
+    
+    if policy == 'flagged':
+        # Failed or tagged commands are the ones reviewers care about
+        return [row for row in rows if row[5] != 'success' or row[4]]
+    if policy == 'all' or len(rows) <= size:
+        return rows
+    if policy == 'head_tail':
+        half = max(size // 2, 1)
+        return rows[:half] + rows[-half:]
+    if policy == 'stride':
+        step = -(-len(rows) // size)  # Ceiling division
+        return rows[::step]
+    return rows
+
+def _timeline_section_key(timestamp, cmd, group_by):
+    """Work out which timeline section a command belongs to"""
+    if group_by == 'host':
+        match = re.search(EXTRACTION_PATTERNS['ip_addresses']['pattern'], cmd)
+        return match.group(0) if match else 'other'
+    return timestamp[:10]
+
+def collect_pdf_sections(config=None, keys=None):
+    """Query the DB once and split the report into independent sections.
+    
+    Returns an ordered list of (key, kind, payload) tuples. When keys is
+    given only those timeline sections are collected. Output is truncated
+    in SQL so only the part that ends up in the PDF is loaded.
+    """
+    config = config or PDF_REPORT_CONFIG
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT COUNT(*), AVG(execution_time), SUM(CASE WHEN status='success' THEN 1 ELSE 0 END), SUM(CASE WHEN status='error' THEN 1 ELSE 0 END) FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
+    total, avg_time, success_count, error_count = c.fetchone()
+    success_rate = (success_count / total * 100) if total else 0
+    
+    sections = [('summary', 'summary', {
+        'engagement': ENGAGEMENT,
+        'generated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'total': total,
+        'avg_time': avg_time or 0,
+        'success_rate': success_rate,
+        'success_count': success_count or 0,
+        'error_count': error_count or 0,
+    })]
+    
+    if HIGHLIGHTS:
+        categories = [
+            (category, [f"{item} (#{source})" if source else item
+                        for item, source in HIGHLIGHTS.page(category, size=10)], count)
+            for category, count in HIGHLIGHTS.categories()
+        ]
+        sections.append(('highlights', 'highlights', {'categories': categories}))
+    
+    if keys is not None and not keys:
+        conn.close()
+        return sections
+    
+    # Narrow the scan to the requested sections where SQL can express it
+    key_sql, key_params = "", ()
+    if keys is not None and config['group_by'] == 'day':
+        key_sql = f" AND substr(timestamp, 1, 10) IN ({', '.join('?' * len(keys))})"
+        key_params = tuple(keys)
+    elif keys is not None and 'other' not in keys:
+        key_sql = f" AND ({' OR '.join(['command LIKE ?'] * len(keys))})"
+        key_params = tuple(f"%{key}%" for key in keys)
+    
+    # Fetch head and tail slices of each output instead of the full blob
+    limit = config['output_limit']
+    if config['truncation'] == 'none':
+        output_sql, output_params = "sanitized_output, ''", ()
+    else:
+        output_sql, output_params = "substr(sanitized_output, 1, ?), substr(sanitized_output, -?)", (limit + 1, max(limit // 2, 1))
+    c.execute(f"""SELECT id, timestamp, command, {output_sql}, length(sanitized_output),
+                         execution_time, tags, status
+                  FROM command_logs WHERE engagement=?{key_sql} ORDER BY id""",
+              output_params + (ENGAGEMENT,) + key_params)
+    timeline = {}
+    first_ids = {}
+    for cmd_id, timestamp, cmd, head, tail, length, exec_time, tags, status in iter_rows(c):
+        key = _timeline_section_key(timestamp, cmd, config['group_by'])
+        if keys is not None and key not in keys:
+            continue
+        output = truncate_output(head or '', tail or '', length or 0, config)
+        timeline.setdefault(key, []).append((timestamp, cmd, output, exec_time or 0, tags, status))
+        first_ids.setdefault(key, cmd_id)
+    conn.close()
+    
+    for key, rows in timeline.items():
+        sampled = sample_commands(rows, config)
+        sections.append((f"timeline-{key}", 'timeline', {
+            'title': key,
+            'first_id': first_ids[key],
+            'commands': sampled,
+            'skipped': len(rows) - len(sampled),
+            'sampling': config['sampling'],
+        }))
+    return sections
+
+def create_pdf_report(**overrides):
+    """Generate a professional PDF report.
+    
+    Each section (summary, highlights, one per day/host timeline) is rendered
+    to its own cached PDF and the pieces are merged. The build manifest's
+    watermark limits the DB work to sections with new or edited commands,
+    and a section whose content hash is unchanged is reused as-is.
+    """
+    if not require('pdf', quiet=True):
+        print_error("PDF generation not available. Install with: pip install reportlab")
+        return
+    
+    config = dict(PDF_REPORT_CONFIG, **overrides)
+    try:
+        filename = f"{ENGAGEMENT}_report.pdf"
+        start_time = time.time()
+        
+        if not require('pdf_merge', quiet=True):
+            # No merger available - fall back to a single document build
+            styles = _pdf_styles()
+            story = []
+            for _, kind, payload in collect_pdf_sections(config):
+                story.extend(_pdf_section_story(kind, payload, styles))
+            SimpleDocTemplate(filename, pagesize=A4).build(story)
+            print_success(f"PDF report generated: {filename}")
+            print_info("Install pypdf to enable cached, per-section rendering")
+            return filename
+        
+        settings = {key: value for key, value in config.items() if key != 'workers'}
+        manifest = load_report_manifest('pdf', settings)
+        last_id, last_invalidation, changed = report_changes(manifest)
+        if report_up_to_date(manifest, last_id, changed) and os.path.exists(filename):
+            print_success(f"PDF report is up to date: {filename}")
+            return filename
+        
+        # Only timeline sections touched since the watermark are re-collected
+        timeline = manifest['sections']
+        dirty_keys = {f"timeline-{_timeline_section_key(ts, cmd, config['group_by'])}" for _, ts, cmd in changed}
+        keys = {key[len('timeline-'):] for key in dirty_keys} if timeline else None
+        collected = collect_pdf_sections(config, keys)
+        
+        cache_dir = report_cache_dir('pdf')
+        head_sections = []
+        pending = []
+        for key, kind, payload in collected:
+            safe_key = re.sub(r'[^0-9A-Za-z._-]+', '_', key)
+            filepath = cache_dir / f"{safe_key}-{_section_digest(kind, payload)[:16]}.pdf"
+            if kind == 'timeline':
+                timeline[key] = {'file': filepath.name, 'first_id': payload['first_id']}
+            else:
+                head_sections.append(filepath)
+            if not filepath.exists():
+                pending.append((filepath, kind, payload))
+        
+        # Dirty sections that came back empty had all their commands deleted
+        collected_keys = {key for key, _, _ in collected}
+        for key in dirty_keys - collected_keys:
+            timeline.pop(key, None)
+        
+        if pending and config['workers'] and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=config['workers']) as pool:
+                list(pool.map(render_pdf_section, *zip(*pending)))
+        else:
+            for filepath, kind, payload in pending:
+                render_pdf_section(filepath, kind, payload)
+        
+        section_files = head_sections + [
+            cache_dir / entry['file']
+            for entry in sorted(timeline.values(), key=lambda entry: entry['first_id'])
+        ]
+        
+        # Stale renders and sections that no longer exist
+        for orphan in set(cache_dir.glob("*.pdf")) - set(section_files):
+            orphan.unlink()
+        
+        writer = PdfWriter()
+        for filepath in section_files:
+            writer.append(str(filepath))
+        with open(filename, 'wb') as f:
+            writer.write(f)
+        
+        mark_report_built(manifest, last_id, last_invalidation)
+        save_report_manifest('pdf', manifest)
         
-        # Build PDF
-        doc.build(story)
         print_success(f"PDF report generated: {filename}")
-        conn.close()
+        print_info(f"Rendered {len(pending)}/{len(section_files)} sections in {time.time() - start_time:.2f}s "
+                   f"({len(section_files) - len(pending)} cached)")
+        return filename
         
     except Exception as e:
         print_error(f"PDF generation failed: {e}")
@@ -1300,7 +3643,10 @@ def init_db():
             timestamp TEXT,
             tags TEXT,
             status TEXT DEFAULT 'success',
-            working_directory TEXT
+            working_directory TEXT,
+            cached INTEGER DEFAULT 0,
+            raw_output TEXT,
+            run_key TEXT
         )
     ''')
     c.execute('''
@@ -1338,15 +3684,256 @@ def init_db():
             category TEXT,
             value TEXT,
             timestamp TEXT,
+            ip INTEGER,
             UNIQUE(engagement, category, value)
         )
     ''')
     
+    
+    # Edits and deletes of logged commands invalidate cached report sections
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            command_id INTEGER,
+            timestamp TEXT,
+            command TEXT
+        )
+    ''')
+    for event in ('UPDATE', 'DELETE'):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS command_logs_report_{event.lower()}
+            AFTER {event} ON command_logs
+            BEGIN
+                INSERT INTO report_invalidations (engagement, command_id, timestamp, command)
+                VALUES (old.engagement, old.id, old.timestamp, old.command);
+            END
+        ''')
+    
+    # Trigram index over commands for substring history search (needs SQLite 3.34+)
+    try:
+        search_exists = c.execute("SELECT 1 FROM sqlite_master WHERE name='command_search'").fetchone()
+        c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS command_search
+                     USING fts5(command, content='command_logs', content_rowid='id', tokenize='trigram')""")
+        if not search_exists:
+            c.execute("INSERT INTO command_search (command_search) VALUES ('rebuild')")
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS command_search_insert AFTER INSERT ON command_logs BEGIN
+                INSERT INTO command_search (rowid, command) VALUES (new.id, new.command);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS command_search_delete AFTER DELETE ON command_logs BEGIN
+                INSERT INTO command_search (command_search, rowid, command) VALUES ('delete', old.id, old.command);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS command_search_update AFTER UPDATE OF command ON command_logs BEGIN
+                INSERT INTO command_search (command_search, rowid, command) VALUES ('delete', old.id, old.command);
+                INSERT INTO command_search (rowid, command) VALUES (new.id, new.command);
+            END
+        ''')
+    except sqlite3.OperationalError:
+        pass  # search_history falls back to LIKE scans
+    
     # Add working_directory column if it doesn't exist
     c.execute("PRAGMA table_info(command_logs)")
     columns = [col[1] for col in c.fetchall()]
     if 'working_directory' not in columns:
         c.execute("ALTER TABLE command_logs ADD COLUMN working_directory TEXT")
+    if 'cached' not in columns:
+        c.execute("ALTER TABLE command_logs ADD COLUMN cached INTEGER DEFAULT 0")
+    if 'raw_output' not in columns:
+        c.execute("ALTER TABLE command_logs ADD COLUMN raw_output TEXT")
+    if 'run_key' not in columns:
+        c.execute("ALTER TABLE command_logs ADD COLUMN run_key TEXT")
+    
+    # Packed IPv4 addresses for range queries on the IPs highlights
+    c.execute("PRAGMA table_info(highlights)")
+    if 'ip' not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE highlights ADD COLUMN ip INTEGER")
+        conn.create_function("ip_to_int", 1, lambda value: packed_ip('IPs', value), deterministic=True)
+        c.execute("UPDATE highlights SET ip = ip_to_int(value) WHERE category='IPs'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_highlights_ip ON highlights (engagement, ip) WHERE ip IS NOT NULL")
+    # Prefix completion and :highlights from look values up across categories
+    c.execute("CREATE INDEX IF NOT EXISTS idx_highlights_value ON highlights (engagement, value)")
+    
+    # Result cache, shared across engagements (keyed by command + cwd)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS command_cache (
+            key TEXT PRIMARY KEY,
+            command TEXT,
+            working_directory TEXT,
+            output TEXT,
+            status TEXT,
+            execution_time REAL,
+            created REAL,
+            source_id INTEGER
+        )
+    ''')
+    
+    # Structured nmap results (filled from -oX files by NmapXmlIngester)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS nmap_scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL,
+            command TEXT,
+            xml_path TEXT,
+            started TEXT,
+            finished TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS nmap_hosts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_id INTEGER REFERENCES nmap_scans(id) ON DELETE CASCADE,
+            engagement TEXT,
+            address TEXT,
+            mac TEXT,
+            hostname TEXT,
+            state TEXT,
+            os_name TEXT,
+            os_accuracy INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS nmap_ports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            host_id INTEGER REFERENCES nmap_hosts(id) ON DELETE CASCADE,
+            protocol TEXT,
+            port INTEGER,
+            state TEXT,
+            reason TEXT,
+            service TEXT,
+            product TEXT,
+            version TEXT,
+            extrainfo TEXT,
+            tunnel TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS nmap_scripts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            host_id INTEGER REFERENCES nmap_hosts(id) ON DELETE CASCADE,
+            port_id INTEGER REFERENCES nmap_ports(id) ON DELETE CASCADE,
+            script TEXT,
+            output TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_hosts_address ON nmap_hosts (engagement, address)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_hosts_scan ON nmap_hosts (scan_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_ports_host ON nmap_ports (host_id, port)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_ports_service ON nmap_ports (service, state)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_scripts_host ON nmap_scripts (host_id, port_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_scripts_port ON nmap_scripts (port_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_nmap_scans_command ON nmap_scans (command_id)")
+    
+    # Provenance: where each highlight first appeared in each command's output
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS highlight_sources (
+            highlight_id INTEGER REFERENCES highlights(id) ON DELETE CASCADE,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE CASCADE,
+            offset INTEGER,
+            PRIMARY KEY (highlight_id, command_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_highlight_sources_command ON highlight_sources (command_id)")
+    
+    # Findings model: parser records and nmap scans, linked back to command_logs.
+    # The foreign keys hold on connections from findings_db(), which enable them.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS hosts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            address TEXT,
+            hostname TEXT,
+            os TEXT,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL,
+            first_seen TEXT,
+            last_seen TEXT,
+            UNIQUE (engagement, address)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            host_id INTEGER NOT NULL REFERENCES hosts(id) ON DELETE CASCADE,
+            protocol TEXT,
+            port INTEGER,
+            state TEXT,
+            service TEXT,
+            version TEXT,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL,
+            UNIQUE (host_id, protocol, port)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            host_id INTEGER REFERENCES hosts(id) ON DELETE CASCADE,
+            url TEXT,
+            status INTEGER,
+            size INTEGER,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL,
+            UNIQUE (engagement, url)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS credentials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            host_id INTEGER REFERENCES hosts(id) ON DELETE CASCADE,
+            port INTEGER,
+            service TEXT,
+            username TEXT,
+            password TEXT,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            engagement TEXT,
+            host_id INTEGER REFERENCES hosts(id) ON DELETE CASCADE,
+            value TEXT,
+            username TEXT,
+            kind TEXT,
+            plaintext TEXT,
+            command_id INTEGER REFERENCES command_logs(id) ON DELETE SET NULL,
+            UNIQUE (engagement, value)
+        )
+    ''')
+    c.execute("PRAGMA table_info(hashes)")
+    hash_columns = [col[1] for col in c.fetchall()]
+    for column in ('kind', 'plaintext'):
+        if column not in hash_columns:
+            c.execute(f"ALTER TABLE hashes ADD COLUMN {column} TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_services_port ON services (port, state)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_urls_host ON urls (host_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_hashes_host ON hashes (host_id)")
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_credentials_unique
+                 ON credentials (engagement, IFNULL(host_id, 0), IFNULL(service, ''), username, IFNULL(password, ''))""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_credentials_host ON credentials (host_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_hosts_hostname ON hosts (engagement, hostname)")
+    # Child-key indexes, so cascades from command_logs do not scan each table per deleted row
+    for table in ('hosts', 'services', 'urls', 'credentials', 'hashes'):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_command ON {table} (command_id)")
+    
+    # Perceptual dedup bookkeeping for screenshots
+    c.execute("PRAGMA table_info(screenshots)")
+    screenshot_columns = [col[1] for col in c.fetchall()]
+    for column, column_type in (('phash', 'TEXT'), ('duplicate_of', 'INTEGER'), ('thumbnail', 'TEXT')):
+        if column not in screenshot_columns:
+            c.execute(f"ALTER TABLE screenshots ADD COLUMN {column} {column_type}")
+    
+    # Covering indexes so per-engagement aggregates never touch output blobs
+    c.execute("CREATE INDEX IF NOT EXISTS idx_command_logs_stats ON command_logs (engagement, status, execution_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_command_logs_command ON command_logs (engagement, command)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_command_logs_recent ON command_logs (engagement, id)")  # History paging
+    c.execute("CREATE INDEX IF NOT EXISTS idx_command_logs_tags ON command_logs (engagement, tags)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_command_logs_run_key ON command_logs (engagement, run_key, id)")  # Previous run
     
     conn.commit()
     conn.close()
@@ -1358,38 +3945,29 @@ def sanitize_output(output, command):
         sanitized = re.sub(pattern, '[REDACTED]', sanitized, flags=re.IGNORECASE | re.DOTALL)
     return sanitized
 
-def log_command(cmd, output, execution_time, status='success', tags=None):
+def log_command(cmd, output, execution_time, status='success', tags=None, cached=False, raw_output=None, run_key=None):
     sanitized = sanitize_output(output, cmd)
     tag_str = ','.join(tags) if tags else ''
     
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute("""INSERT INTO command_logs 
-                 (engagement, command, output, sanitized_output, execution_time, timestamp, tags, status, working_directory) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-              (ENGAGEMENT, cmd, output, sanitized, execution_time, datetime.utcnow().isoformat(), tag_str, status, CURRENT_WORKING_DIR))
+                 (engagement, command, output, sanitized_output, execution_time, timestamp, tags, status, working_directory, cached, raw_output, run_key) 
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+              (ENGAGEMENT, cmd, output, sanitized, execution_time, datetime.utcnow().isoformat(), tag_str, status,
+               CURRENT_WORKING_DIR, int(cached), raw_output, run_key))
     command_id = c.lastrowid
     conn.commit()
     conn.close()
+    COMPLETION_INDEX.note_command(ENGAGEMENT, cmd)
     return command_id
 
 # ─────────────── VALIDATION & SECURITY ───────────────
 def validate_command(cmd):
     """Validate command for safety"""
-    cmd_lower = cmd.lower()
-    
-    # Check for dangerous commands
-    for dangerous in DANGEROUS_COMMANDS:
-        if dangerous in cmd_lower:
-            return False, f"⚠️ Potentially dangerous command detected: {dangerous}"
-    
-    # Check for suspicious patterns
-    if re.search(r'rm\s+.*-rf', cmd_lower):
-        return False, "⚠️ Recursive delete detected - please be specific with paths"
-    
-    if re.search(r'>\s*/dev/sd[a-z]', cmd_lower):
-        return False, "⚠️ Direct disk write detected"
-    
+    danger = classify_command(cmd).danger
+    if danger:
+        return False, f"⚠️ {danger}"
     return True, ""
 
 def expand_alias(command):
@@ -1408,11 +3986,7 @@ def expand_alias(command):
 
 def get_command_timeout(command):
     """Get appropriate timeout for a command"""
-    cmd_lower = command.lower()
-    for cmd_type, timeout in COMMAND_TIMEOUTS.items():
-        if cmd_type in cmd_lower:
-            return timeout
-    return COMMAND_TIMEOUTS['default']
+    return classify_command(command).timeout
 
 # ─────────────── ENHANCED LOGGING FUNCTIONS ───────────────
 def show_logs(limit=5, show_sanitized=True):
@@ -1424,7 +3998,7 @@ def show_logs(limit=5, show_sanitized=True):
               (ENGAGEMENT, limit))
     rows = c.fetchall()
     
-    if RICH_AVAILABLE:
+    if require('rich'):
         table = Table(title=f"Last {limit} Commands for {ENGAGEMENT}")
         table.add_column("Time", style="cyan")
         table.add_column("Status", style="bold")
@@ -1465,133 +4039,1425 @@ def show_logs(limit=5, show_sanitized=True):
             print(f"{out.strip()[:500]}{'...' if len(out) > 500 else ''}")
     conn.close()
 
-def search_logs(query, search_type='all'):
+def search_logs(query, search_type='all'):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    if search_type == 'command':
+        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND command LIKE ? ORDER BY id DESC",
+                  (ENGAGEMENT, f"%{query}%"))
+    elif search_type == 'output':
+        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND sanitized_output LIKE ? ORDER BY id DESC",
+                  (ENGAGEMENT, f"%{query}%"))
+    elif search_type == 'tags':
+        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND tags LIKE ? ORDER BY id DESC",
+                  (ENGAGEMENT, f"%{query}%"))
+    else:
+        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND (command LIKE ? OR sanitized_output LIKE ? OR tags LIKE ?) ORDER BY id DESC",
+                  (ENGAGEMENT, f"%{query}%", f"%{query}%", f"%{query}%"))
+    
+    rows = c.fetchall()
+    print(f"\n🔍 Search Results for '{query}' in {search_type}:")
+    for t, cmd, out, tags in rows:
+        tag_display = f" 🏷️[{tags}]" if tags else ""
+        print(f"\n[🕒 {t}]{tag_display}")
+        print(f"➤ {cmd}")
+        print(f"{out.strip()[:300]}{'...' if len(out) > 300 else ''}")
+    conn.close()
+
+def tag_last_command(tags):
+    """Tag the most recent command"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT id FROM command_logs WHERE engagement=? ORDER BY id DESC LIMIT 1", (ENGAGEMENT,))
+    row = c.fetchone()
+    if row:
+        tag_str = ','.join(tags)
+        c.execute("UPDATE command_logs SET tags=? WHERE id=?", (tag_str, row[0]))
+        conn.commit()
+        print(f"🏷️ Tagged last command with: {tag_str}")
+    else:
+        print("❌ No commands to tag")
+    conn.close()
+
+def iter_rows(cursor, batch_size=None):
+    """Yield rows from an executed cursor in fetchmany() batches"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+def parse_since(since):
+    """Turn a --since value (command id or ISO timestamp) into a SQL filter"""
+    if not since:
+        return "", ()
+    if since.isdigit():
+        return " AND id > ?", (int(since),)
+    timestamp = since.replace(' ', 'T')
+    datetime.fromisoformat(timestamp)  # Raises ValueError on garbage input
+    return " AND timestamp > ?", (timestamp,)
+
+def _export_columns(format_type):
+    """Columns selected for each command row of an export format"""
+    if format_type == 'markdown':
+        return "timestamp, command, sanitized_output, execution_time, tags, status, working_directory"
+    return "*"
+
+def _render_export_row(format_type, columns, row):
+    """Render one command row; JSON rows carry a leading comma separator"""
+    if format_type == 'markdown':
+        timestamp, cmd, output, exec_time, tags, status, cwd = row
+        status_icon = "✅" if status == 'success' else "❌"
+        tag_display = f" 🏷️[{tags}]" if tags else ""
+        cwd_display = f" 📁[{cwd}]" if cwd else ""
+        return (f"### {status_icon} {timestamp} ({exec_time:.2f}s){cwd_display}{tag_display}\n"
+                f"```bash\n$ {cmd}\n{output}\n```\n\n")
+    if format_type == 'json':
+        return ",\n    " + json.dumps(dict(zip(columns, row)))
+    return json.dumps(dict(zip(columns, row))) + "\n"
+
+def _write_export_header(f, format_type, c, since_sql="", params=None, since=None):
+    """Write everything that precedes the highlights section"""
+    params = params or (ENGAGEMENT,)
+    if format_type == 'markdown':
+        f.write(f"# Red Team Report: `{ENGAGEMENT}`\n\n")
+        f.write(f"Generated: {datetime.utcnow().isoformat()}\n\n")
+        if since:
+            f.write(f"Incremental export: commands since `{since}`\n\n")
+        f.write("## 📊 Executive Summary\n\n")
+        
+        # Command statistics
+        c.execute(f"SELECT COUNT(*), AVG(execution_time) FROM command_logs WHERE engagement=?{since_sql}", params)
+        count, avg_time = c.fetchone()
+        f.write(f"- Total Commands: {count}\n")
+        f.write(f"- Average Execution Time: {avg_time or 0:.2f}s\n\n")
+        
+        # Tag summary
+        c.execute(f"SELECT tags FROM command_logs WHERE engagement=? AND tags IS NOT NULL AND tags != ''{since_sql}", params)
+        tag_counts = {}
+        for (tags,) in iter_rows(c):
+            for tag in tags.split(','):
+                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        
+        if tag_counts:
+            f.write("### 🏷️ Tag Summary\n")
+            for tag, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True):
+                f.write(f"- {tag}: {count}\n")
+            f.write("\n")
+    
+    elif format_type == 'json':
+        f.write("{\n")
+        f.write(f'  "engagement": {json.dumps(ENGAGEMENT)},\n')
+        f.write(f'  "generated": {json.dumps(datetime.utcnow().isoformat())},\n')
+        if since:
+            f.write(f'  "since": {json.dumps(since)},\n')
+
+def _write_export_highlights(f, format_type):
+    """Write the highlights section of an export"""
+    if format_type == 'markdown':
+        if HIGHLIGHTS:
+            f.write("## 🎯 Extracted Highlights\n\n")
+            for category, _ in HIGHLIGHTS.categories():
+                f.write(f"### {category}\n")
+                for item, source in HIGHLIGHTS.values(category):
+                    f.write(f"- `{item}`" + (f" (command #{source})" if source else "") + "\n")
+                f.write("\n")
+        f.write("## 🔧 Command Logs\n\n")
+    
+    elif format_type == 'json':
+        # One category at a time, so only the largest category is ever in memory
+        sources_data = {}
+        f.write('  "highlights": {')
+        for index, (category, _) in enumerate(HIGHLIGHTS.categories()):
+            values, sources_data[category] = [], {}
+            for item, source in HIGHLIGHTS.values(category):
+                values.append(item)
+                if source:
+                    sources_data[category][item] = source
+            f.write(("" if index == 0 else ", ") + f"{json.dumps(category)}: {json.dumps(values)}")
+        f.write('},\n')
+        f.write(f'  "highlight_sources": {json.dumps(sources_data)},\n')
+        f.write('  "commands": [')
+
+def _write_export_footer(f, format_type, has_rows):
+    """Close whatever the header opened"""
+    if format_type == 'json':
+        f.write("\n  ]\n}\n" if has_rows else "]\n}\n")
+
+def _export_since(format_type, filename, since, since_sql, since_params):
+    """Stream the commands matching a --since filter straight to the file"""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    params = (ENGAGEMENT,) + since_params
+    
+    # Rows are written as they are fetched instead of being materialised,
+    # so memory stays flat on huge engagements
+    with open(filename, "w") as f:
+        _write_export_header(f, format_type, c, since_sql, params, since)
+        _write_export_highlights(f, format_type)
+        c.execute(f"SELECT {_export_columns(format_type)} FROM command_logs WHERE engagement=?{since_sql} ORDER BY id", params)
+        columns = [description[0] for description in c.description]
+        has_rows = False
+        for row in iter_rows(c):
+            text = _render_export_row(format_type, columns, row)
+            f.write(text if has_rows or format_type != 'json' else text[1:])
+            has_rows = True
+        _write_export_footer(f, format_type, has_rows)
+    conn.close()
+
+def _export_incremental(format_type, filename):
+    """Rebuild a full export, re-rendering only command chunks that changed.
+    
+    Command rows are cached as rendered parts of REPORT_CHUNK_SIZE ids each.
+    The manifest watermark says which chunks gained, lost or edited rows
+    since the last export; everything else is copied from the cache.
+    """
+    manifest = load_report_manifest(format_type, {'chunk_size': REPORT_CHUNK_SIZE})
+    last_id, last_invalidation, changed = report_changes(manifest)
+    chunk_dir = report_cache_dir(format_type)
+    sections = manifest['sections']
+    
+    dirty = {str(row[0] // REPORT_CHUNK_SIZE) for row in changed}
+    dirty |= {key for key in sections if not (chunk_dir / f"{key}.part").exists()}
+    
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    for key in dirty:
+        low = int(key) * REPORT_CHUNK_SIZE
+        c.execute(f"SELECT {_export_columns(format_type)} FROM command_logs WHERE engagement=? AND id BETWEEN ? AND ? ORDER BY id",
+                  (ENGAGEMENT, low, low + REPORT_CHUNK_SIZE - 1))
+        columns = [description[0] for description in c.description]
+        part = chunk_dir / f"{key}.part"
+        digest = hashlib.sha256()
+        with open(part, "w") as f:
+            for row in iter_rows(c):
+                text = _render_export_row(format_type, columns, row)
+                f.write(text)
+                digest.update(text.encode())
+        if part.stat().st_size:
+            sections[key] = digest.hexdigest()
+        else:
+            part.unlink()
+            sections.pop(key, None)
+    
+    highlights_part = chunk_dir / "highlights.part"
+    if manifest['highlight_version'] != highlight_version() or not highlights_part.exists():
+        with open(highlights_part, "w") as f:
+            _write_export_highlights(f, format_type)
+    
+    # Splice the fresh summary and the cached parts into the artifact
+    chunk_keys = sorted(sections, key=int)
+    with open(filename, "w") as f:
+        _write_export_header(f, format_type, c)
+        with open(highlights_part) as part:
+            shutil.copyfileobj(part, f)
+        for index, key in enumerate(chunk_keys):
+            with open(chunk_dir / f"{key}.part") as part:
+                if index == 0 and format_type == 'json':
+                    part.read(1)  # Drop the first row's comma separator
+                shutil.copyfileobj(part, f, EXPORT_COPY_BUFFER)
+        _write_export_footer(f, format_type, bool(chunk_keys))
+    conn.close()
+    
+    mark_report_built(manifest, last_id, last_invalidation)
+    save_report_manifest(format_type, manifest)
+    return len(dirty)
+
+def export_logs(format_type='markdown', since=None):
+    """Export the engagement logs to a markdown, JSON or NDJSON report.
+    
+    Full exports reuse cached chunks from earlier exports; --since exports
+    stream the matching rows directly.
+    """
+    if format_type not in EXPORT_EXTENSIONS:
+        print_error(f"Unsupported export format: {format_type}")
+        return None
+    try:
+        since_sql, since_params = parse_since(since)
+    except ValueError:
+        print_error(f"Invalid --since value: {since} (use a command id or ISO timestamp)")
+        return None
+    
+    extension = EXPORT_EXTENSIONS[format_type]
+    if since:
+        filename = f"{ENGAGEMENT}_report_since_{re.sub(r'[^0-9A-Za-z]+', '-', since)}.{extension}"
+        _export_since(format_type, filename, since, since_sql, since_params)
+    else:
+        filename = f"{ENGAGEMENT}_report.{extension}"
+        rendered = _export_incremental(format_type, filename)
+        print_info(f"Re-rendered {rendered} changed chunk(s)")
+    
+    print(f"\n✅ Report exported to `{filename}`")
+    return filename
+
+# ─────────────── MULTI-FORMAT EXPORT ───────────────
+def snapshot_database():
+    """Copy the live DB into a temporary, consistent snapshot file"""
+    fd, snapshot_path = tempfile.mkstemp(prefix="redterm_snapshot_", suffix=".db")
+    os.close(fd)
+    source = sqlite3.connect(DB_PATH)
+    target = sqlite3.connect(snapshot_path)
+    source.backup(target)
+    target.close()
+    source.close()
+    return snapshot_path
+
+def _quiet_export_worker():
+    """Keep worker processes from scribbling over the interactive prompt"""
+    sys.stdout = open(os.devnull, 'w')
+
+def _export_worker(format_type, snapshot_path, engagement):
+    """Render one report format against a DB snapshot (runs in a worker process)"""
+    global DB_PATH, ENGAGEMENT
+    DB_PATH = snapshot_path
+    ENGAGEMENT = engagement
+    load_highlights()
+    
+    start_time = time.time()
+    if format_type == 'pdf':
+        filename = create_pdf_report()
+    elif format_type == 'html':
+        filename = create_html_dashboard()
+    else:
+        filename = export_logs(format_type)
+    return format_type, filename, time.time() - start_time
+
+EXPORT_THREAD = None  # Background :export all, joined by wait_for_export()
+
+def export_all(formats=EXPORT_ALL_FORMATS, background=False):
+    """Render several report formats concurrently from one DB snapshot.
+    
+    With background=True the work runs on a helper thread so the prompt
+    stays usable; per-format timings are printed as each format finishes.
+    Batch runs and the API (BATCH_MODE) always export in the foreground,
+    since nothing would wait for the thread before the process exits.
+    """
+    global EXPORT_THREAD
+    save_highlights()
+    snapshot_path = snapshot_database()
+    engagement = ENGAGEMENT
+    
+    def run():
+        start_time = time.time()
+        try:
+            with ProcessPoolExecutor(max_workers=len(formats), initializer=_quiet_export_worker) as pool:
+                futures = {pool.submit(_export_worker, fmt, snapshot_path, engagement): fmt for fmt in formats}
+                for future in as_completed(futures):
+                    try:
+                        format_type, filename, elapsed = future.result()
+                    except Exception as e:
+                        print_error(f"{futures[future]} export failed: {e}")
+                        continue
+                    if filename:
+                        print_success(f"{format_type:<8} {elapsed:6.2f}s  {filename}")
+                    else:
+                        print_error(f"{format_type:<8} {elapsed:6.2f}s  export failed")
+        finally:
+            os.unlink(snapshot_path)
+        print_info(f"Exported {len(formats)} formats for `{engagement}` in {time.time() - start_time:.2f}s")
+    
+    if background and not BATCH_MODE:
+        wait_for_export()
+        EXPORT_THREAD = threading.Thread(target=run, name="export-all", daemon=True)
+        EXPORT_THREAD.start()
+        print_info(f"Exporting {', '.join(formats)} in the background...")
+    else:
+        run()
+
+def wait_for_export():
+    """Block until a background :export all has written its files and removed its snapshot"""
+    global EXPORT_THREAD
+    if EXPORT_THREAD is not None and EXPORT_THREAD.is_alive():
+        print_info("Waiting for the background export to finish...")
+        EXPORT_THREAD.join()
+    EXPORT_THREAD = None
+
+# ─────────────── RESULT CACHE ───────────────
+def cache_ttl(command, expanded_cmd):
+    """Seconds a command's result may be replayed for (0 = never cache)"""
+    parts = command.split()
+    if parts and parts[0] in CACHE_TTLS:
+        return CACHE_TTLS[parts[0]]
+    # Output that depends on shell state or user input is not deterministic
+    if any(ch in expanded_cmd for ch in '$`'):
+        return 0
+    if expanded_cmd.split()[-1] in ('--help', '-h'):
+        return CACHE_TTLS.get('--help', 0)
+    info = classify_command(expanded_cmd)
+    if info.interactive:
+        return 0
+    for program in info.programs:
+        if program in CACHE_TTLS:
+            return CACHE_TTLS[program]
+    return 0
+
+def cache_key(expanded_cmd, cwd):
+    return hashlib.sha256(f"{expanded_cmd}\0{cwd}".encode()).hexdigest()
+
+def cache_lookup(expanded_cmd, ttl):
+    """Return (output, status, execution_time, created, source_id) of a fresh entry, or None"""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute("""SELECT output, status, execution_time, created, source_id FROM command_cache
+                          WHERE key=? AND created>=?""",
+                       (cache_key(expanded_cmd, CURRENT_WORKING_DIR), time.time() - ttl)).fetchone()
+    conn.close()
+    return row
+
+def cache_store(expanded_cmd, output, status, execution_time, source_id):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""INSERT OR REPLACE INTO command_cache
+                    (key, command, working_directory, output, status, execution_time, created, source_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                 (cache_key(expanded_cmd, CURRENT_WORKING_DIR), expanded_cmd, CURRENT_WORKING_DIR,
+                  output, status, execution_time, time.time(), source_id))
+    conn.commit()
+    conn.close()
+
+def format_age(seconds):
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+def replay_cached(expanded_cmd, entry):
+    """Replay a cached result as if the command had just run; returns the new log id"""
+    global last_command, last_status
+    output, status, execution_time, created, source_id = entry
+    info_msg = f"Cached: {expanded_cmd} (ran {format_age(time.time() - created)} ago as #{source_id})"
+    print_info(info_msg)
+    if RECORDING:
+        record_event('output', f"ℹ️ {info_msg}\n")
+    
+    capture = OutputCapture(expanded_cmd)
+    emit_command_output(output, capture)
+    finish_command_output(capture)
+    save_highlights()
+    last_command, last_status = expanded_cmd, status
+    command_id = log_command(expanded_cmd, output, 0.0, status, cached=True)
+    store_records(command_id, last_records)
+    store_provenance(command_id, last_sources)
+    
+    done_msg = f"Replayed from cache (originally {execution_time:.2f}s) - :nocache {expanded_cmd} to re-run"
+    print_success(done_msg)
+    if RECORDING:
+        record_event('output', f"✅ {done_msg}\n")
+    auto_screenshot_if_enabled(command_id)
+    return command_id
+
+def manage_cache(arg):
+    """:cache on|off|clear, or show cache status"""
+    global RESULT_CACHE
+    if arg == 'on':
+        RESULT_CACHE = True
+        print_success("Result cache enabled for: " + ', '.join(CACHE_TTLS))
+    elif arg == 'off':
+        RESULT_CACHE = False
+        print_success("Result cache disabled")
+    elif arg == 'clear':
+        conn = sqlite3.connect(DB_PATH)
+        removed = conn.execute("DELETE FROM command_cache").rowcount
+        conn.commit()
+        conn.close()
+        print_success(f"Cleared {removed} cached results")
+    elif not arg:
+        conn = sqlite3.connect(DB_PATH)
+        entries = conn.execute("SELECT COUNT(*) FROM command_cache").fetchone()[0]
+        hits = conn.execute("SELECT COUNT(*) FROM command_logs WHERE engagement=? AND cached=1",
+                            (ENGAGEMENT,)).fetchone()[0]
+        conn.close()
+        print_info(f"Result cache: {'on' if RESULT_CACHE else 'off'} ({entries} entries, {hits} hits this engagement)")
+        for name, ttl in CACHE_TTLS.items():
+            print(f"  {name:<20} → {format_age(ttl)}")
+    else:
+        print_error("Usage: :cache | :cache on | :cache off | :cache clear")
+
+# ─────────────── NMAP XML INGESTION ───────────────
+def nmap_xml_target(command, expanded_cmd):
+    """Return (command to run, XML file to ingest or None) for an nmap command.
+    
+    nmap-* aliases get an -oX file under NMAP_XML_DIR; other nmap commands
+    are ingested when they already write XML with -oX or -oA.
+    """
+    if 'nmap' not in classify_command(expanded_cmd).programs:
+        return expanded_cmd, None
+    try:
+        args = shlex.split(expanded_cmd)
+    except ValueError:
+        return expanded_cmd, None
+    for i, arg in enumerate(args):
+        if arg in ('-oX', '-oA') and i + 1 < len(args):
+            path = args[i + 1]
+        elif arg.startswith(('-oX', '-oA')) and len(arg) > 3:
+            path = arg[3:]
+        else:
+            continue
+        if path == '-':
+            return expanded_cmd, None
+        if arg.startswith('-oA'):
+            path += '.xml'
+        return expanded_cmd, os.path.join(CURRENT_WORKING_DIR, os.path.expanduser(path))
+    
+    alias = command.split()[0]
+    if not (alias.startswith('nmap-') and alias in ALIASES):
+        return expanded_cmd, None
+    xml_dir = Path(NMAP_XML_DIR).resolve() / ENGAGEMENT
+    xml_dir.mkdir(parents=True, exist_ok=True)
+    xml_path = xml_dir / f"{alias}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.xml"
+    return f"{expanded_cmd} -oX {shlex.quote(str(xml_path))}", str(xml_path)
+
+class NmapXmlIngester(threading.Thread):
+    """Tail an nmap -oX file while the scan runs, loading each <host> as it completes.
+    
+    The pull parser is fed one chunk at a time and finished elements are
+    detached from the tree, so memory stays flat however large the sweep.
+    """
+    
+    def __init__(self, xml_path, command, existing=False):
+        super().__init__(daemon=True)
+        self.xml_path = xml_path
+        self.command = command
+        self.engagement, self.db_path = ENGAGEMENT, DB_PATH
+        self.started = 0 if existing else time.time()  # existing: an already written file (:import)
+        self.done = threading.Event()
+        self.scan_id = None
+        self.hosts = self.open_ports = 0
+        self.error = None
+    
+    def _open(self):
+        """Open the XML file once nmap has (re)created it for this run"""
+        try:
+            if os.stat(self.xml_path).st_mtime < self.started - 1:
+                return None  # Left over from an earlier run with the same -oX path
+            return open(self.xml_path, 'rb')
+        except FileNotFoundError:
+            return None
+    
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        handle = None
+        try:
+            self.scan_id = conn.execute("INSERT INTO nmap_scans (engagement, command, xml_path, started) VALUES (?, ?, ?, ?)",
+                                        (self.engagement, self.command, self.xml_path,
+                                         datetime.utcnow().isoformat())).lastrowid
+            conn.commit()
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            root, depth, pending = None, 0, 0
+            while True:
+                handle = handle or self._open()
+                chunk = handle.read(65536) if handle else b''
+                if not chunk:
+                    if pending:
+                        conn.commit()
+                        pending = 0
+                    if self.done.is_set():
+                        break  # The scan has exited, so the file is complete
+                    self.done.wait(0.2)
+                    continue
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    if event == 'start':
+                        root = elem if root is None else root
+                        depth += 1
+                        continue
+                    depth -= 1
+                    if depth != 1:
+                        continue
+                    # A direct child of <nmaprun> is complete
+                    if elem.tag == 'host':
+                        self._ingest_host(conn, elem)
+                        pending += 1
+                        if pending >= NMAP_INGEST_BATCH:
+                            conn.commit()
+                            pending = 0
+                    elif elem.tag == 'runstats':
+                        finished = elem.find('finished')
+                        if finished is not None and finished.get('time'):
+                            conn.execute("UPDATE nmap_scans SET finished=? WHERE id=?",
+                                         (datetime.utcfromtimestamp(int(finished.get('time'))).isoformat(), self.scan_id))
+                    root.remove(elem)
+        except ET.ParseError as e:
+            self.error = f"{os.path.basename(self.xml_path)}: {e}"
+        finally:
+            if handle:
+                handle.close()
+            conn.commit()
+            conn.close()
+    
+    def _ingest_host(self, conn, host):
+        addresses = {address.get('addrtype'): address.get('addr') for address in host.iterfind('address')}
+        address = addresses.get('ipv4') or addresses.get('ipv6')
+        if not address:
+            return
+        status = host.find('status')
+        hostname = host.find('hostnames/hostname')
+        osmatch = host.find('os/osmatch')
+        host_id = conn.execute("""INSERT INTO nmap_hosts (scan_id, engagement, address, mac, hostname, state, os_name, os_accuracy)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                               (self.scan_id, self.engagement, address, addresses.get('mac'),
+                                hostname.get('name') if hostname is not None else None,
+                                status.get('state') if status is not None else None,
+                                osmatch.get('name') if osmatch is not None else None,
+                                int(osmatch.get('accuracy', 0)) if osmatch is not None else None)).lastrowid
+        for port in host.iterfind('ports/port'):
+            state = port.find('state')
+            service = port.find('service')
+            service = service.attrib if service is not None else {}
+            port_id = conn.execute("""INSERT INTO nmap_ports (host_id, protocol, port, state, reason, service, product, version, extrainfo, tunnel)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                   (host_id, port.get('protocol'), int(port.get('portid')),
+                                    state.get('state') if state is not None else None,
+                                    state.get('reason') if state is not None else None,
+                                    service.get('name'), service.get('product'), service.get('version'),
+                                    service.get('extrainfo'), service.get('tunnel'))).lastrowid
+            conn.executemany("INSERT INTO nmap_scripts (host_id, port_id, script, output) VALUES (?, ?, ?, ?)",
+                             [(host_id, port_id, script.get('id'), script.get('output')) for script in port.iterfind('script')])
+            if state is not None and state.get('state') == 'open':
+                self.open_ports += 1
+        conn.executemany("INSERT INTO nmap_scripts (host_id, port_id, script, output) VALUES (?, ?, ?, ?)",
+                         [(host_id, None, script.get('id'), script.get('output')) for script in host.iterfind('hostscript/script')])
+        self.hosts += 1
+    
+    def finish(self, command_id):
+        """Wait for the rest of the file and link the scan to its command log entry"""
+        self.done.set()
+        self.join()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("UPDATE nmap_scans SET command_id=? WHERE id=?", (command_id, self.scan_id))
+        conn.commit()
+        conn.close()
+        if self.hosts:
+            store_nmap_scan(self.scan_id, command_id)
+        if self.error:
+            print_warning(f"nmap XML ingestion stopped early ({self.error})")
+        if self.hosts:
+            print_info(f"Ingested {self.hosts} hosts ({self.open_ports} open ports) from {self.xml_path}")
+
+# ─────────────── FINDINGS MODEL ───────────────
+def finding_host(value):
+    """Host part of an address, host:port or URL as the parsers report it"""
+    if not value:
+        return None
+    if '://' in value:
+        return urlsplit(value).hostname
+    return value.strip('[]/').split('/')[0] or None
+
+def upsert_host(conn, address, command_id, hostname=None, os_name=None, cache=None):
+    """Id of the engagement's row for `address`, creating or refreshing it"""
+    if cache is not None and address in cache and not (hostname or os_name):
+        return cache[address]
+    now = datetime.utcnow().isoformat()
+    conn.execute("""INSERT INTO hosts (engagement, address, hostname, os, command_id, first_seen, last_seen)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (engagement, address) DO UPDATE SET
+                        hostname = COALESCE(excluded.hostname, hostname),
+                        os = COALESCE(excluded.os, os),
+                        last_seen = excluded.last_seen""",
+                 (ENGAGEMENT, address, hostname, os_name, command_id, now, now))
+    host_id = conn.execute("SELECT id FROM hosts WHERE engagement=? AND address=?", (ENGAGEMENT, address)).fetchone()[0]
+    if cache is not None:
+        cache[address] = host_id
+    return host_id
+
+def findings_db():
+    """A connection that enforces the findings tables' foreign keys (and their cascades)"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+def store_records(command_id, records, conn=None):
+    """Write a command's parser records into the findings tables in one transaction (conn's, if given)"""
+    if not records:
+        return
+    own = conn is None
+    conn = conn or findings_db()
+    hosts = {}
+    for record in records:
+        if isinstance(record, HostRecord):
+            address = record.address or record.hostname
+            upsert_host(conn, address, command_id, record.hostname if record.address else None, cache=hosts)
+        elif isinstance(record, ServiceRecord):
+            host = finding_host(record.host)
+            if not host or record.port is None:
+                continue
+            conn.execute("""INSERT INTO services (host_id, protocol, port, state, service, version, command_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (host_id, protocol, port) DO UPDATE SET
+                                state = excluded.state,
+                                service = COALESCE(excluded.service, service),
+                                version = COALESCE(excluded.version, version)""",
+                         (upsert_host(conn, host, command_id, cache=hosts), record.protocol, record.port,
+                          record.state, record.service, record.version, command_id))
+        elif isinstance(record, UrlRecord):
+            host = finding_host(record.url)
+            conn.execute("""INSERT INTO urls (engagement, host_id, url, status, size, command_id)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (engagement, url) DO UPDATE SET
+                                status = COALESCE(excluded.status, status),
+                                size = COALESCE(excluded.size, size)""",
+                         (ENGAGEMENT, upsert_host(conn, host, command_id, cache=hosts) if host else None,
+                          record.url, record.status, record.size, command_id))
+        elif isinstance(record, CredentialRecord):
+            host = finding_host(record.host)
+            conn.execute("""INSERT OR IGNORE INTO credentials (engagement, host_id, port, service, username, password, command_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         (ENGAGEMENT, upsert_host(conn, host, command_id, cache=hosts) if host else None,
+                          record.port, record.service, record.username, record.password, command_id))
+        elif isinstance(record, HashRecord):
+            host = finding_host(record.host)
+            conn.execute("""INSERT INTO hashes (engagement, host_id, value, username, kind, plaintext, command_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (engagement, value) DO UPDATE SET
+                                username = COALESCE(username, excluded.username),
+                                kind = COALESCE(excluded.kind, kind),
+                                plaintext = COALESCE(plaintext, excluded.plaintext)""",
+                         (ENGAGEMENT, upsert_host(conn, host, command_id, cache=hosts) if host else None,
+                          record.value, record.username, record.kind, record.plaintext, command_id))
+    if own:
+        conn.commit()
+        conn.close()
+
+def store_nmap_scan(scan_id, command_id):
+    """Promote an ingested nmap scan into hosts and services (OS and product details included)"""
+    conn = findings_db()
+    now = datetime.utcnow().isoformat()
+    conn.execute("""INSERT INTO hosts (engagement, address, hostname, os, command_id, first_seen, last_seen)
+                    SELECT engagement, address, hostname, os_name, ?, ?, ? FROM nmap_hosts
+                    WHERE scan_id=? AND state='up'
+                    ON CONFLICT (engagement, address) DO UPDATE SET
+                        hostname = COALESCE(excluded.hostname, hostname),
+                        os = COALESCE(excluded.os, os),
+                        last_seen = excluded.last_seen""",
+                 (command_id, now, now, scan_id))
+    conn.execute("""INSERT INTO services (host_id, protocol, port, state, service, version, command_id)
+                    SELECT h.id, p.protocol, p.port, p.state, p.service,
+                           NULLIF(TRIM(IFNULL(p.product, '') || ' ' || IFNULL(p.version, '')), ''), ?
+                    FROM nmap_ports p
+                    JOIN nmap_hosts n ON n.id = p.host_id
+                    JOIN hosts h ON h.engagement = n.engagement AND h.address = n.address
+                    WHERE n.scan_id=?
+                    ON CONFLICT (host_id, protocol, port) DO UPDATE SET
+                        state = excluded.state,
+                        service = COALESCE(excluded.service, service),
+                        version = COALESCE(excluded.version, version)""",
+                 (command_id, scan_id))
+    conn.commit()
+    conn.close()
+
+def host_findings(address):
+    """Everything known about one host of the current engagement (None if unknown)"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    host = conn.execute("SELECT * FROM hosts WHERE engagement=? AND address=?", (ENGAGEMENT, address)).fetchone()
+    if host is None:
+        host = conn.execute("SELECT * FROM hosts WHERE engagement=? AND hostname=?", (ENGAGEMENT, address)).fetchone()
+    if host is None:
+        conn.close()
+        return None
+    findings = {
+        'host': dict(host),
+        'services': [dict(row) for row in conn.execute(
+            "SELECT protocol, port, state, service, version, command_id FROM services WHERE host_id=? ORDER BY port",
+            (host['id'],))],
+        'urls': [dict(row) for row in conn.execute(
+            "SELECT url, status, size, command_id FROM urls WHERE host_id=? ORDER BY url", (host['id'],))],
+        'credentials': [dict(row) for row in conn.execute(
+            "SELECT service, port, username, password, command_id FROM credentials WHERE host_id=? ORDER BY service, username",
+            (host['id'],))],
+        'hashes': [dict(row) for row in conn.execute(
+            "SELECT value, kind, plaintext, username, command_id FROM hashes WHERE host_id=? ORDER BY value", (host['id'],))]
+    }
+    conn.close()
+    return findings
+
+def list_hosts():
+    """Hosts of the engagement with their open-service counts"""
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("""SELECT h.address, h.hostname, h.os,
+                                  (SELECT COUNT(*) FROM services s WHERE s.host_id = h.id AND s.state LIKE 'open%')
+                           FROM hosts h WHERE h.engagement=? ORDER BY h.address""", (ENGAGEMENT,)).fetchall()
+    conn.close()
+    if not rows:
+        print_info("No hosts recorded yet")
+        return
+    print(f"\n🖥️ Hosts ({ENGAGEMENT}):")
+    for address, hostname, os_name, open_count in rows:
+        details = ', '.join(filter(None, [hostname, os_name]))
+        print(f"  {address:<18} {open_count:>3} open  {details}")
+
+def show_host(address):
+    """:host <ip> - services, URLs, credentials and hashes for one host"""
+    findings = host_findings(address)
+    if findings is None:
+        print_error(f"No findings for host {address}")
+        return
+    host = findings['host']
+    title = ' '.join(filter(None, [host['address'], f"({host['hostname']})" if host['hostname'] else None]))
+    sections = [
+        ("Services", ["Port", "State", "Service", "Version", "Source"],
+         [(f"{s['port']}/{s['protocol']}", s['state'], s['service'] or '', s['version'] or '', f"#{s['command_id']}")
+          for s in findings['services']]),
+        ("URLs", ["URL", "Status", "Size", "Source"],
+         [(u['url'], str(u['status'] or ''), str(u['size'] or ''), f"#{u['command_id']}") for u in findings['urls']]),
+        ("Credentials", ["Service", "Username", "Password", "Source"],
+         [(f"{c['service']}:{c['port']}" if c['port'] else c['service'] or '', c['username'] or '', c['password'] or '',
+           f"#{c['command_id']}") for c in findings['credentials']]),
+        ("Hashes", ["Hash", "Type", "Plaintext", "Username", "Source"],
+         [(h['value'], h['kind'] or '?', h['plaintext'] or '', h['username'] or '', f"#{h['command_id']}")
+          for h in findings['hashes']])
+    ]
+    
+    if require('rich'):
+        console.print(Panel(f"OS: {host['os'] or 'unknown'}\nFirst seen: {host['first_seen'][:19]} (command #{host['command_id']})",
+                            title=f"🖥️ {title}", style="cyan"))
+        for name, columns, rows in sections:
+            if rows:
+                table = Table(title=name)
+                for column in columns:
+                    table.add_column(column)
+                for row in rows:
+                    table.add_row(*row)
+                console.print(table)
+    else:
+        print(f"\n🖥️ {title}")
+        print(f"  OS: {host['os'] or 'unknown'}")
+        print(f"  First seen: {host['first_seen'][:19]} (command #{host['command_id']})")
+        for name, columns, rows in sections:
+            if rows:
+                print(f"\n  {name}:")
+                for row in rows:
+                    print("    " + "  ".join(row))
+
+# ─────────────── HASH IDENTIFICATION ───────────────
+PWDUMP_RE = re.compile(r'^\s*([^:\s]+):(\d+):([a-fA-F0-9]{32}):([a-fA-F0-9]{32}):::')
+EMPTY_LM_HASH = 'aad3b435b51404eeaad3b435b51404ee'
+HASH_TYPES = {32: ('MD5', 'NTLM'), 40: ('SHA1',), 64: ('SHA256',), 128: ('SHA512',)}
+HASH_CONTEXT_HINTS = {'NTLM': ('ntlm', 'nthash', 'nt hash', 'secretsdump', 'hashdump', 'sam'),
+                      'MD5': ('md5',)}
+
+def md4(data):
+    """MD4 digest (RFC 1320); hashlib only offers it while OpenSSL's legacy provider is loaded"""
+    mask = 0xFFFFFFFF
+    rotl = lambda x, n: (x << n | x >> (32 - n)) & mask
+    message = data + b'\x80' + b'\x00' * ((55 - len(data)) % 64) + struct.pack('<Q', len(data) * 8)
+    state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476)
+    for block in range(0, len(message), 64):
+        x = struct.unpack('<16I', message[block:block + 64])
+        a, b, c, d = state
+        for i in range(16):
+            a, b, c, d = d, rotl((a + ((b & c) | (~b & d)) + x[i]) & mask, (3, 7, 11, 19)[i % 4]), b, c
+        for i in range(16):
+            k = (i % 4) * 4 + i // 4
+            a, b, c, d = d, rotl((a + ((b & c) | (b & d) | (c & d)) + x[k] + 0x5a827999) & mask, (3, 5, 9, 13)[i % 4]), b, c
+        for i in range(16):
+            k = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)[i]
+            a, b, c, d = d, rotl((a + (b ^ c ^ d) + x[k] + 0x6ed9eba1) & mask, (3, 9, 11, 15)[i % 4]), b, c
+        state = tuple((v + n) & mask for v, n in zip(state, (a, b, c, d)))
+    return struct.pack('<4I', *state)
+
+try:
+    hashlib.new('md4', b'')
+    _md4 = lambda data: hashlib.new('md4', data).digest()
+except ValueError:
+    _md4 = md4
+
+def ntlm_digest(word):
+    """NT hash of a wordlist entry (bytes; UTF-8 where it decodes, Latin-1 otherwise)"""
+    try:
+        text = word.decode('utf-8')
+    except UnicodeDecodeError:
+        text = word.decode('latin-1')
+    return _md4(text.encode('utf-16-le'))
+
+# Digest functions the lookup index is built for (wordlist entry bytes -> raw digest)
+HASH_ALGORITHMS = {
+    'MD5': lambda word: hashlib.md5(word).digest(),
+    'NTLM': ntlm_digest,
+    'SHA1': lambda word: hashlib.sha1(word).digest(),
+    'SHA256': lambda word: hashlib.sha256(word).digest(),
+}
+
+def identify_hash(value, context=''):
+    """Likely hash types of a hex string, most likely first (empty if the length fits none)"""
+    kinds = list(HASH_TYPES.get(len(value), ()))
+    if value.lower() == EMPTY_LM_HASH:
+        return ['LM']
+    context = context.lower()
+    for kind, hints in HASH_CONTEXT_HINTS.items():
+        if kind in kinds and any(hint in context for hint in hints):
+            kinds.remove(kind)
+            kinds.insert(0, kind)
+    return kinds
+
+def hash_records(text):
+    """(HashRecord, offset) for each hash in a batch of output: typed, and cracked when an index knows it"""
+    for match in re.finditer(EXTRACTION_PATTERNS['hashes']['pattern'], text):
+        value = match.group()
+        start = text.rfind('\n', 0, match.start()) + 1
+        end = text.find('\n', match.end())
+        line = text[start:end if end != -1 else len(text)]
+        username = None
+        pwdump = PWDUMP_RE.match(line)
+        if pwdump:
+            # user:rid:LM:NT::: - the position says which is which
+            username = pwdump.group(1)
+            kinds = ['LM'] if match.start() - start == pwdump.start(3) else ['NTLM']
+        else:
+            kinds = identify_hash(value, line)
+        kind, plaintext = crack_hash(value, kinds)
+        yield HashRecord(None, value, username, kind, plaintext), match.start()
+
+class HashIndex:
+    """A built lookup file: sorted (8-byte digest prefix, wordlist offset) records, binary searched through mmap"""
+    
+    def __init__(self, path, wordlist, algorithm):
+        self.wordlist = wordlist
+        self.algorithm = algorithm
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        self.words = open(wordlist, 'rb')
+    
+    def __len__(self):
+        return len(self.map) // HASH_RECORD_SIZE
+    
+    def __getitem__(self, index):
+        start = index * HASH_RECORD_SIZE
+        return self.map[start:start + 8]
+    
+    def lookup(self, digest):
+        """Wordlist entry with this digest, or None"""
+        index = bisect.bisect_left(self, digest[:8])
+        while index < len(self) and self[index] == digest[:8]:
+            offset, = struct.unpack_from('>Q', self.map, index * HASH_RECORD_SIZE + 8)
+            self.words.seek(offset)
+            word = self.words.readline().rstrip(b'\r\n')
+            if HASH_ALGORITHMS[self.algorithm](word) == digest:  # Prefixes can collide
+                return word.decode('utf-8', 'replace')
+            index += 1
+        return None
+
+HASH_INDEXES = None  # algorithm -> [HashIndex], opened on first lookup
+
+def hash_index_manifest():
+    try:
+        with open(Path(HASH_INDEX_DIR, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_hash_indexes():
+    """Open the built indexes whose wordlists are unchanged since the build"""
+    indexes = defaultdict(list)
+    for name, entry in hash_index_manifest().items():
+        try:
+            stat = os.stat(entry['wordlist'])
+            if (stat.st_size, int(stat.st_mtime)) != (entry['wordlist_size'], entry['wordlist_mtime']):
+                print_warning(f"Hash index {name} is stale ({entry['wordlist']} changed) - rebuild with :hashes index")
+                continue
+            indexes[entry['algorithm']].append(HashIndex(Path(HASH_INDEX_DIR, name), entry['wordlist'], entry['algorithm']))
+        except OSError:
+            continue
+    return indexes
+
+def crack_hash(value, kinds):
+    """(kind, plaintext) - the first candidate type an index cracks, else (most likely type, None)"""
+    global HASH_INDEXES
+    if HASH_INDEXES is None:
+        HASH_INDEXES = load_hash_indexes()
+    if HASH_INDEXES:
+        digest = bytes.fromhex(value)
+        for kind in kinds:
+            for index in HASH_INDEXES.get(kind, ()):
+                plaintext = index.lookup(digest)
+                if plaintext is not None:
+                    return kind, plaintext
+    return (kinds[0] if kinds else None), None
+
+def _read_index_records(path):
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_RECORD_SIZE * 4096)
+            if not block:
+                return
+            for start in range(0, len(block), HASH_RECORD_SIZE):
+                yield block[start:start + HASH_RECORD_SIZE]
+
+def _hash_index_run(block, base):
+    """Sorted index records per algorithm for a block of whole wordlist lines (runs in a worker process)"""
+    records = {algorithm: [] for algorithm in HASH_ALGORITHMS}
+    offset = base
+    entries = 0
+    for line in block.split(b'\n'):
+        word = line.rstrip(b'\r')
+        if word:
+            packed = struct.pack('>Q', offset)
+            for algorithm, digest in HASH_ALGORITHMS.items():
+                records[algorithm].append(digest(word)[:8] + packed)
+            entries += 1
+        offset += len(line) + 1
+    return entries, {algorithm: b''.join(sorted(items)) for algorithm, items in records.items()}
+
+def build_hash_index(wordlist=None):
+    """:hashes index [wordlist] - hash every entry under HASH_ALGORITHMS into sorted lookup files.
+    
+    Worker processes hash and sort HASH_INDEX_BLOCK_SIZE blocks into runs on
+    disk, which are then merged, so any wordlist size builds in bounded memory.
+    """
+    global HASH_INDEXES
+    path = Path(os.path.expanduser(wordlist or HASH_DEFAULT_WORDLIST)).resolve()
+    if not path.is_file():
+        print_error(f"Wordlist not found: {path}")
+        return
+    out_dir = Path(HASH_INDEX_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = re.sub(r'\W+', '_', path.stem)
+    size = path.stat().st_size
+    workers = os.cpu_count() or 1
+    
+    start_time = time.time()
+    last_report = start_time
+    runs = {algorithm: [] for algorithm in HASH_ALGORITHMS}
+    entries = 0
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp, \
+            ProcessPoolExecutor(max_workers=workers) as pool, open(path, 'rb') as f:
+        def collect(futures):
+            nonlocal entries, last_report
+            for future in futures:
+                count, blocks = future.result()
+                entries += count
+                for algorithm, data in blocks.items():
+                    run = Path(tmp, f"{algorithm}-{len(runs[algorithm])}.run")
+                    run.write_bytes(data)
+                    runs[algorithm].append(run)
+            if time.time() - last_report >= 5:
+                last_report = time.time()
+                print_info(f"Hashed {entries:,} words ({f.tell() * 100 // max(size, 1)}% read)")
+        
+        pending = []
+        while True:
+            base = f.tell()
+            block = f.read(HASH_INDEX_BLOCK_SIZE)
+            if not block:
+                break
+            block += f.readline()  # Finish the last line
+            pending.append(pool.submit(_hash_index_run, block, base))
+            if len(pending) >= workers * 2:
+                collect(pending[:workers])
+                pending = pending[workers:]
+        collect(pending)
+        
+        manifest = hash_index_manifest()
+        for algorithm, files in runs.items():
+            name = f"{stem}.{algorithm.lower()}.idx"
+            with open(out_dir / name, 'wb') as out:
+                for record in heapq.merge(*(_read_index_records(run) for run in files)):
+                    out.write(record)
+            manifest[name] = {'wordlist': str(path), 'algorithm': algorithm, 'entries': entries,
+                              'wordlist_size': size, 'wordlist_mtime': int(path.stat().st_mtime)}
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    HASH_INDEXES = None
+    print_success(f"Indexed {entries:,} words from {path.name} for {', '.join(HASH_ALGORITHMS)} "
+                  f"in {time.time() - start_time:.1f}s")
+
+def crack_stored_hashes():
+    """:hashes crack - look up every uncracked hash of the engagement (e.g. after building an index)"""
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("SELECT id, value, kind FROM hashes WHERE engagement=? AND plaintext IS NULL",
+                        (ENGAGEMENT,)).fetchall()
+    cracked = 0
+    for hash_id, value, kind in rows:
+        kinds = identify_hash(value)
+        if kind in kinds:
+            kinds.insert(0, kinds.pop(kinds.index(kind)))
+        kind, plaintext = crack_hash(value, kinds or [kind])
+        if plaintext is not None:
+            conn.execute("UPDATE hashes SET kind=?, plaintext=? WHERE id=?", (kind, plaintext, hash_id))
+            HIGHLIGHTS.add('Cracked', f"{value}:{plaintext} ({kind})")
+            cracked += 1
+    conn.commit()
+    conn.close()
+    save_highlights()
+    print_success(f"Cracked {cracked} of {len(rows)} hashes")
+
+def show_hashes():
+    """:hashes - the engagement's hashes with their type and any cracked plaintext"""
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    if search_type == 'command':
-        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND command LIKE ? ORDER BY id DESC",
-                  (ENGAGEMENT, f"%{query}%"))
-    elif search_type == 'output':
-        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND sanitized_output LIKE ? ORDER BY id DESC",
-                  (ENGAGEMENT, f"%{query}%"))
-    elif search_type == 'tags':
-        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND tags LIKE ? ORDER BY id DESC",
-                  (ENGAGEMENT, f"%{query}%"))
+    rows = conn.execute("""SELECT value, kind, plaintext, username, command_id FROM hashes
+                           WHERE engagement=? ORDER BY plaintext IS NULL, kind, value""", (ENGAGEMENT,)).fetchall()
+    conn.close()
+    if not rows:
+        print_info("No hashes recorded yet")
+        return
+    if require('rich'):
+        table = Table(title=f"🔑 Hashes ({ENGAGEMENT})")
+        for column in ("Hash", "Type", "Plaintext", "Username", "Source"):
+            table.add_column(column)
+        for value, kind, plaintext, username, command_id in rows:
+            table.add_row(value, kind or '?', plaintext or '', username or '', f"#{command_id}")
+        console.print(table)
     else:
-        c.execute("SELECT timestamp, command, sanitized_output, tags FROM command_logs WHERE engagement=? AND (command LIKE ? OR sanitized_output LIKE ? OR tags LIKE ?) ORDER BY id DESC",
-                  (ENGAGEMENT, f"%{query}%", f"%{query}%", f"%{query}%"))
+        print(f"\n🔑 Hashes ({ENGAGEMENT}):")
+        for value, kind, plaintext, username, command_id in rows:
+            print(f"  {value}  {kind or '?':<7} {plaintext or '':<20} {username or ''}  #{command_id}")
+    if not HASH_INDEXES and not hash_index_manifest():
+        print_info("Build an offline lookup index with :hashes index [wordlist]")
+
+# ─────────────── SCAN DIFFING ───────────────
+def output_records(command, output):
+    """Parser records of a stored output (empty when no parser handles the command)"""
+    parsers = parsers_for(command)
+    records = []
+    if parsers and output:
+        for line in ANSI_SGR_RE.sub('', output).split('\n'):
+            for parser in parsers:
+                records.extend(parser.parse(line))
+    return records
+
+def record_identity(record):
+    """(what a record is about, what can change about it) when comparing two runs"""
+    if isinstance(record, ServiceRecord):
+        return ('service', record.host, record.protocol, record.port), (record.state, record.service, record.version)
+    if isinstance(record, UrlRecord):
+        return ('url', record.url), record.status  # Sizes of dynamic pages vary run to run
+    if isinstance(record, HostRecord):
+        return ('host', record.address or record.hostname), record.hostname
+    return record, None
+
+def diff_records(old, new):
+    """(added, removed, [(before, after)] changed) records between two runs, matched by identity"""
+    before = {record_identity(record)[0]: record for record in old}
+    after = {record_identity(record)[0]: record for record in new}
+    added = [record for key, record in after.items() if key not in before]
+    removed = [record for key, record in before.items() if key not in after]
+    changed = [(before[key], record) for key, record in after.items()
+               if key in before and record_identity(before[key])[1] != record_identity(record)[1]]
+    return added, removed, changed
+
+def diff_lines(old, new):
+    """(added, removed) lines between two outputs, matched by per-line hashes.
     
-    rows = c.fetchall()
-    print(f"\n🔍 Search Results for '{query}' in {search_type}:")
-    for t, cmd, out, tags in rows:
-        tag_display = f" 🏷️[{tags}]" if tags else ""
-        print(f"\n[🕒 {t}]{tag_display}")
-        print(f"➤ {cmd}")
-        print(f"{out.strip()[:300]}{'...' if len(out) > 300 else ''}")
+    Linear in the output size (no alignment like difflib), and lines matching
+    DIFF_IGNORE_RE - timestamps, timings - never count as changes.
+    """
+    def lines(text):
+        return [line for line in (raw.rstrip() for raw in ANSI_SGR_RE.sub('', text or '').split('\n'))
+                if line and not DIFF_IGNORE_RE.search(line)]
+    old_lines, new_lines = lines(old), lines(new)
+    old_hashes = {hash(line) for line in old_lines}
+    new_hashes = {hash(line) for line in new_lines}
+    return ([line for line in new_lines if hash(line) not in old_hashes],
+            [line for line in old_lines if hash(line) not in new_hashes])
+
+def describe_record(record):
+    if isinstance(record, ServiceRecord):
+        return ' '.join(filter(None, [record.host, f"{record.port}/{record.protocol}", record.state,
+                                      record.service, record.version]))
+    if isinstance(record, UrlRecord):
+        return f"{record.url} ({record.status})" if record.status else record.url
+    if isinstance(record, HostRecord):
+        return record.address + (f" ({record.hostname})" if record.hostname and record.address else "") \
+            if record.address else record.hostname
+    return ' '.join(str(field) for field in record if field is not None)
+
+def print_diff_lines(marker, items):
+    for item in items[:DIFF_SHOW_LIMIT]:
+        print(f"  {marker} {item}")
+    if len(items) > DIFF_SHOW_LIMIT:
+        print(f"    ... and {len(items) - DIFF_SHOW_LIMIT} more")
+
+def flag_new_findings(added, changed):
+    """Newly opened ports and newly found paths become New_Ports / New_URLs highlights"""
+    opened = [record for record in added if isinstance(record, ServiceRecord)]
+    opened += [after for before, after in changed if isinstance(after, ServiceRecord)
+               and not (before.state or '').startswith('open')]
+    for record in opened:
+        if (record.state or '').startswith('open'):
+            HIGHLIGHTS.add('New_Ports', f"{record.host}:{record.port}/{record.protocol}"
+                           + (f" ({record.service})" if record.service else ""))
+    for record in added:
+        if isinstance(record, UrlRecord):
+            HIGHLIGHTS.add('New_URLs', record.url)
+    save_highlights()
+
+def previous_run(run_key, before_id):
+    """Id, command, output and timestamp of the last successful earlier run of a command line"""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute("""SELECT id, command, output, timestamp FROM command_logs
+                          WHERE engagement=? AND run_key=? AND id<? AND status='success' AND cached=0
+                          ORDER BY id DESC LIMIT 1""", (ENGAGEMENT, run_key, before_id)).fetchone()
     conn.close()
+    return row
 
-def tag_last_command(tags):
-    """Tag the most recent command"""
+def report_scan_changes(command_id, run_key, command, output):
+    """After a parsed tool re-runs the same command line, print what changed since the last run"""
+    if not parsers_for(command):
+        return
+    previous = previous_run(run_key, command_id)
+    if not previous:
+        return
+    previous_id, previous_command, previous_output, timestamp = previous
+    added, removed, changed = diff_records(output_records(previous_command, previous_output),
+                                           output_records(command, output))
+    if not (added or removed or changed):
+        print_info(f"No changes since #{previous_id} ({timestamp[:19]})")
+        return
+    print_styled(f"🔀 Changes since #{previous_id} ({timestamp[:19]}): "
+                 f"{len(added)} new, {len(removed)} gone, {len(changed)} changed", 'warning')
+    if not QUIET:
+        print_diff_lines('+', [describe_record(record) for record in added])
+        print_diff_lines('-', [describe_record(record) for record in removed])
+        print_diff_lines('~', [f"{describe_record(before)} → {describe_record(after)}" for before, after in changed])
+    flag_new_findings(added, changed)
+
+def show_diff(old_id, new_id=None):
+    """:diff <id1> [<id2>] - what changed between two logged commands (or a command and its previous run)"""
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id FROM command_logs WHERE engagement=? ORDER BY id DESC LIMIT 1", (ENGAGEMENT,))
-    row = c.fetchone()
-    if row:
-        tag_str = ','.join(tags)
-        c.execute("UPDATE command_logs SET tags=? WHERE id=?", (tag_str, row[0]))
-        conn.commit()
-        print(f"🏷️ Tagged last command with: {tag_str}")
+    rows = {row[0]: row for row in conn.execute(
+        "SELECT id, command, output, timestamp, run_key FROM command_logs WHERE engagement=? AND id IN (?, ?)",
+        (ENGAGEMENT, old_id, new_id if new_id is not None else old_id))}
+    conn.close()
+    if new_id is None:
+        if old_id not in rows:
+            print_error(f"No command #{old_id} in {ENGAGEMENT}")
+            return
+        new_id = old_id
+        previous = previous_run(rows[new_id][4], new_id) if rows[new_id][4] else None
+        if not previous:
+            print_info(f"No earlier run of command #{new_id} to compare with")
+            return
+        old_id = previous[0]
+        rows[old_id] = previous + (rows[new_id][4],)
+    missing = [f"#{command_id}" for command_id in (old_id, new_id) if command_id not in rows]
+    if missing:
+        print_error(f"No command {', '.join(missing)} in {ENGAGEMENT}")
+        return
+    _, old_command, old_output, old_time, _ = rows[old_id]
+    _, new_command, new_output, new_time, _ = rows[new_id]
+    print_styled(f"\n🔀 #{old_id} ({old_time[:19]}) → #{new_id} ({new_time[:19]})", 'info')
+    print(f"$ {old_command}" + (f"\n$ {new_command}" if new_command != old_command else ""))
+    
+    if parsers_for(old_command) and parsers_for(new_command):
+        added, removed, changed = diff_records(output_records(old_command, old_output),
+                                               output_records(new_command, new_output))
+        print_diff_lines('+', [describe_record(record) for record in added])
+        print_diff_lines('-', [describe_record(record) for record in removed])
+        print_diff_lines('~', [f"{describe_record(before)} → {describe_record(after)}" for before, after in changed])
+        summary = f"{len(added)} new, {len(removed)} gone, {len(changed)} changed"
     else:
-        print("❌ No commands to tag")
+        added, removed = diff_lines(old_output, new_output)
+        changed = []
+        print_diff_lines('+', added)
+        print_diff_lines('-', removed)
+        summary = f"{len(added)} lines added, {len(removed)} removed"
+    print_info(summary if added or removed or changed else "No changes")
+
+# ─────────────── BULK IMPORT ───────────────
+# Tool that wrote a file, recognised from its first IMPORT_SNIFF_SIZE characters
+IMPORT_SIGNATURES = [
+    ('nmap', re.compile(r'^# Nmap \d|^Nmap scan report for |<nmaprun', re.M)),
+    ('masscan', re.compile(r'^Discovered open port |^#masscan', re.M)),
+    ('gobuster', re.compile(r'Gobuster|\(Status: \d{3}\)')),
+    ('dirb', re.compile(r'^DIRB v|^---- Scanning URL', re.M)),
+    ('hydra', re.compile(r'Hydra v\d|^\[\d+\]\[[\w-]+\] host: ', re.M)),
+    ('enum4linux', re.compile(r'enum4linux', re.I)),
+    ('nikto', re.compile(r'- Nikto v|^\+ Target IP:', re.M)),
+    ('sqlmap', re.compile(r'sqlmap/\d|\bsqlmap\b')),
+    ('responder', re.compile(r'NTLMv[12](?:-SSP)? (?:Client|Username|Hash)|^[^:\s]+::[^:\s]*:[0-9a-fA-F]{16}:', re.M)),
+]
+# Target details recovered from a file header, for parsers that read them off the command line
+IMPORT_TARGETS = {
+    'gobuster': (re.compile(r'^\[\+\] Url:\s+(\S+)', re.M), 'gobuster dir -u {}'),
+    'enum4linux': (re.compile(r'^Target \.+ (\S+)', re.M), 'enum4linux -a {}'),
+    'nikto': (re.compile(r'^\+ Target IP:\s+(\S+)', re.M), 'nikto -h {}'),
+}
+
+def expand_import_paths(patterns):
+    """Files named by paths, globs (** recurses) and directories, in order and without repeats"""
+    files = {}
+    for pattern in patterns:
+        pattern = os.path.join(CURRENT_WORKING_DIR, os.path.expanduser(pattern))
+        for match in sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    files.update((os.path.join(root, name), None) for name in sorted(names) if not name.startswith('.'))
+            elif os.path.isfile(match):
+                files[os.path.abspath(match)] = None
+    return list(files)
+
+def import_command(path):
+    """The command a tool output file stands in for, or None for binary files"""
+    with open(path, 'rb') as f:
+        head = f.read(IMPORT_SNIFF_SIZE)
+    if b'\0' in head:
+        return None
+    head = head.decode('utf-8', 'replace')
+    for tool, signature in IMPORT_SIGNATURES:
+        if signature.search(head):
+            command = tool
+            if tool in IMPORT_TARGETS:
+                target_re, template = IMPORT_TARGETS[tool]
+                match = target_re.search(head)
+                if match:
+                    command = template.format(shlex.quote(match.group(1)))
+            break
+    else:
+        command = f"cat {shlex.quote(path)}"
+    return f"{command}  # imported from {path}"
+
+def _import_worker(path, command):
+    """Normalize, extract and sanitize one output file (runs in a worker process)"""
+    capture = OutputCapture(command)
+    with open(path, encoding='utf-8', errors='replace', newline='') as f:
+        while True:
+            chunk = f.read(IMPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            completed = capture.feed(chunk)
+            if completed:
+                scan_output(completed, capture)
+    tail = capture.finish()
+    if tail:
+        scan_output(tail, capture)
+    HIGHLIGHTS.pending.clear()  # This process's copy; the parent stores capture.sources
+    output = capture.text
+    return output, sanitize_output(output, command), capture.records, capture.sources
+
+def import_jobs(paths):
+    """(path, command, nmap XML to load with it) per file to import.
+    
+    An nmap -oA set is imported once: the .nmap text becomes the command log
+    entry and its .xml fills the nmap tables; the .gnmap is skipped.
+    """
+    present = set(paths)
+    jobs, skipped = [], []
+    for path in paths:
+        stem, extension = os.path.splitext(path)
+        if extension in ('.xml', '.gnmap') and stem + '.nmap' in present:
+            continue
+        command = import_command(path)
+        if command is None:
+            skipped.append(path)
+            continue
+        xml_path = stem + '.xml' if extension == '.nmap' and stem + '.xml' in present else None
+        if extension == '.xml' and command.startswith('nmap '):
+            xml_path = path
+        jobs.append((path, command, xml_path))
+    return jobs, skipped
+
+def import_timestamp(path):
+    """A file's mtime as a command_logs timestamp"""
+    return datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat()
+
+def _store_import_batch(batch):
+    """Write a batch of worker results in one transaction; returns their command ids"""
+    for _, _, _, (_, _, _, sources) in batch:
+        for category, value in sources:
+            HIGHLIGHTS.add(category, value)
+    save_highlights()
+    conn = findings_db()
+    command_ids = []
+    for path, command, _, (output, sanitized, records, sources) in batch:
+        timestamp = import_timestamp(path)
+        command_id = conn.execute("""INSERT INTO command_logs
+                                     (engagement, command, output, sanitized_output, execution_time, timestamp, tags,
+                                      status, working_directory)
+                                     VALUES (?, ?, ?, ?, 0, ?, 'imported', 'success', ?)""",
+                                  (ENGAGEMENT, command, output, sanitized, timestamp, os.path.dirname(path))).lastrowid
+        store_records(command_id, records, conn)
+        store_provenance(command_id, sources, conn)
+        command_ids.append(command_id)
+    conn.commit()
     conn.close()
+    for (_, command, xml_path, _), command_id in zip(batch, command_ids):
+        COMPLETION_INDEX.note_command(ENGAGEMENT, command)
+        if xml_path:
+            ingester = NmapXmlIngester(xml_path, command, existing=True)
+            ingester.start()
+            ingester.finish(command_id)
+    return command_ids
 
-def export_logs(format_type='markdown'):
+def import_files(patterns):
+    """:import <path|glob> ... - load tool output files as if their commands had run here.
+    
+    Files are normalized, extracted and sanitized in a process pool
+    (IMPORT_WORKERS, at most twice that many in flight) and written
+    IMPORT_BATCH_SIZE files per transaction. Returns the number of failures.
+    """
+    paths = expand_import_paths(patterns)
+    if not paths:
+        print_error(f"No files match {' '.join(patterns)}")
+        return 1
+    jobs, skipped = import_jobs(paths)
+    for path in skipped:
+        print_warning(f"Skipping binary file {path}")
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    seen = set(conn.execute("SELECT command, timestamp FROM command_logs WHERE engagement = ? AND tags = 'imported'",
+                            (ENGAGEMENT,)))
+    conn.close()
+    fresh = [job for job in jobs if (job[1], import_timestamp(job[0])) not in seen]
+    if len(fresh) < len(jobs):
+        print_info(f"Skipping {len(jobs) - len(fresh)} files already imported unchanged")
+    jobs = fresh
+    if not jobs:
+        return 0
+    total_bytes = sum(os.path.getsize(path) for path, _, _ in jobs) or 1
+    workers = IMPORT_WORKERS or os.cpu_count() or 1
+    print_info(f"Importing {len(jobs)} files ({total_bytes / 1048576:.1f} MB) with {workers} workers")
     
-    if format_type == 'markdown':
-        filename = f"{ENGAGEMENT}_report.md"
-        with open(filename, "w") as f:
-            f.write(f"# Red Team Report: `{ENGAGEMENT}`\n\n")
-            f.write(f"Generated: {datetime.utcnow().isoformat()}\n\n")
-            f.write("## 📊 Executive Summary\n\n")
-            
-            # Command statistics
-            c.execute("SELECT COUNT(*), AVG(execution_time) FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
-            count, avg_time = c.fetchone()
-            f.write(f"- Total Commands: {count}\n")
-            f.write(f"- Average Execution Time: {avg_time:.2f}s\n\n")
-            
-            # Tag summary
-            c.execute("SELECT tags FROM command_logs WHERE engagement=? AND tags IS NOT NULL AND tags != ''", (ENGAGEMENT,))
-            all_tags = []
-            for (tags,) in c.fetchall():
-                all_tags.extend(tags.split(','))
-            tag_counts = {}
-            for tag in all_tags:
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
-            
-            if tag_counts:
-                f.write("### 🏷️ Tag Summary\n")
-                for tag, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True):
-                    f.write(f"- {tag}: {count}\n")
-                f.write("\n")
-            
-            # Extracted highlights
-            if HIGHLIGHTS:
-                f.write("## 🎯 Extracted Highlights\n\n")
-                for category, items in sorted(HIGHLIGHTS.items()):
-                    if items:
-                        f.write(f"### {category}\n")
-                        for item in sorted(items):
-                            f.write(f"- `{item}`\n")
-                        f.write("\n")
-            
-            f.write("## 🔧 Command Logs\n\n")
-            c.execute("SELECT timestamp, command, sanitized_output, execution_time, tags, status, working_directory FROM command_logs WHERE engagement=? ORDER BY id", (ENGAGEMENT,))
-            for row in c.fetchall():
-                timestamp, cmd, output, exec_time, tags, status, cwd = row
-                status_icon = "✅" if status == 'success' else "❌"
-                tag_display = f" 🏷️[{tags}]" if tags else ""
-                cwd_display = f" 📁[{cwd}]" if cwd else ""
-                f.write(f"### {status_icon} {timestamp} ({exec_time:.2f}s){cwd_display}{tag_display}\n")
-                f.write(f"```bash\n$ {cmd}\n{output}\n```\n\n")
-                
-    elif format_type == 'json':
-        filename = f"{ENGAGEMENT}_report.json"
-        c.execute("SELECT * FROM command_logs WHERE engagement=? ORDER BY id", (ENGAGEMENT,))
-        columns = [description[0] for description in c.description]
-        data = []
-        for row in c.fetchall():
-            data.append(dict(zip(columns, row)))
-        
-        # Add highlights
-        highlights_data = {}
-        for category, items in HIGHLIGHTS.items():
-            highlights_data[category] = list(items)
-        
-        with open(filename, "w") as f:
-            json.dump({
-                'engagement': ENGAGEMENT,
-                'generated': datetime.utcnow().isoformat(),
-                'highlights': highlights_data,
-                'commands': data
-            }, f, indent=2)
+    start_time = last_report = time.time()
+    done_bytes = imported = failed = 0
+    batch = []
+    remaining = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_quiet_export_worker) as pool:
+        running = deque()  # In submission order, so command ids follow the order files were given in
+        while True:
+            for job in remaining:
+                running.append((pool.submit(_import_worker, job[0], job[1]), job))
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+            future, (path, command, xml_path) = running.popleft()
+            try:
+                batch.append((path, command, xml_path, future.result()))
+            except Exception as e:
+                failed += 1
+                print_error(f"{path}: {e}")
+            done_bytes += os.path.getsize(path)
+            if len(batch) >= IMPORT_BATCH_SIZE or not running:
+                imported += len(_store_import_batch(batch))
+                batch = []
+            if time.time() - last_report >= 2:
+                last_report = time.time()
+                elapsed = last_report - start_time
+                print_info(f"Imported {imported}/{len(jobs)} files ({done_bytes * 100 // total_bytes}%, "
+                           f"{done_bytes / 1048576 / elapsed:.1f} MB/s)")
+    if batch:
+        imported += len(_store_import_batch(batch))
     
-    conn.close()
-    print(f"\n✅ Report exported to `{filename}`")
+    elapsed = max(time.time() - start_time, 0.001)
+    print_success(f"Imported {imported} files ({done_bytes / 1048576:.1f} MB) in {elapsed:.1f}s "
+                  f"({done_bytes / 1048576 / elapsed:.1f} MB/s)")
+    return failed
 
 # ─────────────── COMMAND RUNNER ───────────────
-def run_command(command):
-    global last_output, CURRENT_WORKING_DIR
+def run_command(command, use_cache=True):
+    global last_output, last_command, last_status, last_records, last_sources, CURRENT_WORKING_DIR
+    last_records, last_sources = [], {}
     
     # Record input if recording
     if RECORDING:
         record_event('input', command + '\n')
     
-    # Handle cd command specially
-    if command.startswith('cd '):
+    # Handle cd command specially (the persistent shell tracks its own cwd)
+    if command.startswith('cd ') and not PERSISTENT_SHELL:
         try:
             new_dir = command[3:].strip()
             if new_dir == '~':
@@ -1608,20 +5474,22 @@ def run_command(command):
                 print_success(output_msg)
                 if RECORDING:
                     record_event('output', f"✅ {output_msg}\n")
-                log_command(command, f"Changed to {CURRENT_WORKING_DIR}", 0.0, 'success')
+                last_command, last_status = command, 'success'
+                return log_command(command, f"Changed to {CURRENT_WORKING_DIR}", 0.0, 'success')
             else:
                 error_msg = f"Directory not found: {new_dir}"
                 print_error(error_msg)
                 if RECORDING:
                     record_event('output', f"❌ {error_msg}\n")
-                log_command(command, error_msg, 0.0, 'error')
+                last_command, last_status = command, 'error'
+                return log_command(command, error_msg, 0.0, 'error')
         except Exception as e:
             error_msg = f"Failed to change directory: {str(e)}"
             print_error(error_msg)
             if RECORDING:
                 record_event('output', f"❌ {error_msg}\n")
-            log_command(command, str(e), 0.0, 'error')
-        return
+            last_command, last_status = command, 'error'
+            return log_command(command, str(e), 0.0, 'error')
     
     # Expand aliases
     expanded_cmd = expand_alias(command)
@@ -1631,13 +5499,25 @@ def run_command(command):
             record_event('output', expanded_cmd + '\n')
         return
     
+    # Replay deterministic lookups from the result cache
+    cache_cmd = expanded_cmd
+    ttl = cache_ttl(command, expanded_cmd) if RESULT_CACHE else 0
+    if ttl and use_cache:
+        entry = cache_lookup(expanded_cmd, ttl)
+        if entry:
+            return replay_cached(expanded_cmd, entry)
+    
+    # nmap scans also write XML, which is loaded into the nmap_* tables as it grows
+    expanded_cmd, nmap_xml = nmap_xml_target(command, expanded_cmd)
+    ingester = None
+    
     # Validate command
     is_valid, error_msg = validate_command(expanded_cmd)
     if not is_valid:
-        print_warning(error_msg[4:])  # Remove emoji prefix
+        print_warning(error_msg.split(' ', 1)[1])  # Remove emoji prefix
         if RECORDING:
             record_event('output', error_msg + '\n')
-        if not confirm("Continue anyway?"):
+        if not ask_confirm("Continue anyway?"):
             return
     
     # Get appropriate timeout
@@ -1660,23 +5540,31 @@ def run_command(command):
     
     # Use PTY for better output handling
     try:
+        if nmap_xml:
+            ingester = NmapXmlIngester(nmap_xml, expanded_cmd)
+            ingester.start()
         success, execution_time = run_command_pty(expanded_cmd)
         
-        # Extract highlights from output
-        extract_highlights(last_output)
-        
-        # Save highlights
+        # Save highlights (extracted line by line as the output streamed)
         save_highlights()
         
         # Log command
         status = 'success' if success else 'error'
-        command_id = log_command(expanded_cmd, last_output, execution_time, status)
+        last_command, last_status = expanded_cmd, status
+        # run_key is the command line before the per-run -oX file, so re-runs of it can be compared
+        command_id = log_command(expanded_cmd, last_output, execution_time, status, raw_output=last_raw_output,
+                                 run_key=cache_cmd)
+        store_records(command_id, last_records)
+        store_provenance(command_id, last_sources)
+        if ttl and success:
+            cache_store(cache_cmd, last_output, status, execution_time, command_id)
         
         if success:
             success_msg = f"Completed in {execution_time:.2f}s"
             print_success(success_msg)
             if RECORDING:
                 record_event('output', f"✅ {success_msg}\n")
+            report_scan_changes(command_id, cache_cmd, expanded_cmd, last_output)
         else:
             error_msg = f"Failed in {execution_time:.2f}s"
             print_error(error_msg)
@@ -1689,11 +5577,14 @@ def run_command(command):
     except Exception as e:
         execution_time = time.time() - start_time
         last_output = str(e)
+        last_command, last_status = expanded_cmd, 'error'
         print_error(last_output)
         if RECORDING:
             record_event('output', f"❌ {last_output}\n")
         command_id = log_command(expanded_cmd, last_output, execution_time, 'error')
     
+    if ingester:
+        ingester.finish(command_id)
     return command_id
 
 # ─────────────── ENGAGEMENT MANAGEMENT ───────────────
@@ -1716,14 +5607,17 @@ def show_status():
     row = c.fetchone()
     
     # Count highlights
-    highlight_count = sum(len(items) for items in HIGHLIGHTS.values())
+    highlight_count = HIGHLIGHTS.total()
     
-    if RICH_AVAILABLE:
+    if require('rich'):
         table = create_status_table()
         table.add_row("Current Engagement", ENGAGEMENT)
         table.add_row("Current Directory", CURRENT_WORKING_DIR)
         table.add_row("Theme", CURRENT_THEME)
         table.add_row("Auto-Screenshot", "Enabled" if AUTO_SCREENSHOT else "Disabled")
+        if SCREENSHOT_WORKER.stats['deduplicated']:
+            table.add_row("Screenshots Deduplicated", f"{SCREENSHOT_WORKER.stats['deduplicated']} "
+                          f"(of {sum(SCREENSHOT_WORKER.stats.values())})")
         table.add_row("Recording", "🔴 ACTIVE" if RECORDING else "⚫ Inactive")
         table.add_row("Extracted Highlights", str(highlight_count))
         
@@ -1747,6 +5641,9 @@ def show_status():
         print(f"📁 Current Directory: {CURRENT_WORKING_DIR}")
         print(f"🎨 Theme: {CURRENT_THEME}")
         print(f"📷 Auto-Screenshot: {'Enabled' if AUTO_SCREENSHOT else 'Disabled'}")
+        if SCREENSHOT_WORKER.stats['deduplicated']:
+            print(f"📷 Screenshots Deduplicated: {SCREENSHOT_WORKER.stats['deduplicated']} "
+                  f"(of {sum(SCREENSHOT_WORKER.stats.values())})")
         print(f"📼 Recording: {'🔴 ACTIVE' if RECORDING else '⚫ Inactive'}")
         print(f"🎯 Extracted Highlights: {highlight_count}")
         
@@ -1764,11 +5661,11 @@ def show_status():
 
 def set_theme(theme_name):
     """Set the color theme"""
-    global CURRENT_THEME, console
+    global CURRENT_THEME
     if theme_name in THEMES:
         CURRENT_THEME = theme_name
-        if RICH_AVAILABLE:
-            console = Console(theme=Theme(THEMES[CURRENT_THEME]))
+        if require('rich'):
+            set_console_theme()
         print_success(f"Theme set to: {theme_name}")
     else:
         print_error(f"Unknown theme: {theme_name}")
@@ -1783,7 +5680,7 @@ def toggle_auto_screenshot():
 
 def show_themes():
     """Display available themes with preview"""
-    if RICH_AVAILABLE:
+    if require('rich'):
         print_info("Available Themes:")
         for theme_name, colors in THEMES.items():
             indicator = "●" if theme_name == CURRENT_THEME else "○"
@@ -1797,201 +5694,292 @@ def show_themes():
 
 def manual_screenshot():
     """Take a manual screenshot"""
-    description = input("Screenshot description (optional): ").strip()
-    filepath = take_screenshot(description=description or "Manual screenshot")
-    if filepath:
+    description = "" if BATCH_MODE else input("Screenshot description (optional): ").strip()
+    filepath = take_screenshot(description=description or "Manual screenshot", wait=True)
+    if filepath and os.path.exists(filepath):
         print_success(f"Screenshot saved: {filepath}")
 
+def text_screenshot(spec=""):
+    """Render evidence images from output: the last command, or a set of logged ids"""
+    if not spec:
+        if not require('pil', quiet=True):
+            print_error("Evidence rendering needs Pillow. Install with: pip install pillow")
+            return
+        if not last_command:
+            print_warning("No command output to render yet")
+            return
+        filepath = ensure_screenshot_dir() / f"evidence_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]}.png"
+        header = f"Engagement: {ENGAGEMENT} | {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        render_evidence_image(last_command, sanitize_output(last_output, last_command),
+                              last_status, header).save(filepath)
+        print_success(f"Evidence saved: {filepath}")
+        return
+    
+    try:
+        command_ids = parse_id_list(spec)
+    except ValueError as e:
+        print_error(f"Invalid command id: {e}")
+        return
+    start = time.time()
+    paths = render_evidence_batch(command_ids)
+    if paths:
+        print_success(f"Rendered {len(paths)} evidence image(s) in {time.time() - start:.2f}s → {Path(paths[0]).parent}")
+
+def set_shell_mode(mode):
+    """Switch between a fresh sh per command and the persistent shell"""
+    global PERSISTENT_SHELL
+    if mode == 'persistent':
+        PERSISTENT_SHELL = True
+        print_success(f"Commands now run in a persistent {os.path.basename(PERSISTENT_SHELL_PATH)} session")
+    elif mode == 'fresh':
+        PERSISTENT_SHELL = False
+        SHELL_SESSION.close()
+        print_success("Commands now run in a fresh /bin/sh each")
+    elif mode == 'restart':
+        SHELL_SESSION.close()
+        print_success("Persistent shell will restart with the next command")
+    else:
+        state = "persistent" if PERSISTENT_SHELL else "fresh"
+        running = f" (pid {SHELL_SESSION.pid})" if SHELL_SESSION.alive() else ""
+        print_info(f"Shell mode: {state}{running}")
+        print_info("Usage: :shell persistent | :shell fresh | :shell restart")
+
 def show_aliases():
     print("\n🔧 Available Aliases:")
     for alias, command in ALIASES.items():
         print(f"  {alias:<20} → {command}")
 
-# ─────────────── MAIN LOOP ───────────────
-def main():
-    global ENGAGEMENT, AUTO_SCREENSHOT, CURRENT_THEME, CURRENT_WORKING_DIR
+def handle_input(user_input):
+    """Dispatch one line of input: an internal :command or a shell command.
     
-    # Create necessary directories
-    ensure_screenshot_dir()
-    ensure_recordings_dir()
+    Returns False when the session should end (:exit).
+    """
+    global ENGAGEMENT
     
-    # Startup banner
-    if RICH_AVAILABLE:
-        startup_text = """
-[bold red]🔴 Enhanced RedTeam Terminal v2.3[/bold red]
-[cyan]Features:[/cyan] TTY Support • Auto-Extraction • Real-time Output • Interactive Commands
-[dim]Type :help for commands | :record start to begin recording[/dim]
-        """
-        console.print(Panel(startup_text, style="bold"))
-    else:
-        print("🔴 Enhanced RedTeam Terminal v2.3 | OSCP-Compatible")
-        print("Features: TTY Support • Auto-Extraction • Real-time Output")
-        print("Type :help for available commands\n")
+    # Handle internal commands
+    if user_input.startswith(":engage"):
+        tokens = user_input.split()
+        if len(tokens) >= 2:
+            if tokens[1] == "list":
+                list_engagements()
+            elif tokens[1] == "switch" and len(tokens) == 3:
+                ENGAGEMENT = tokens[2].strip()
+                load_highlights()  # Load highlights for new engagement
+                print_success(f"Switched to engagement: {ENGAGEMENT}")
+            else:
+                ENGAGEMENT = tokens[1].strip()
+                load_highlights()  # Load highlights for new engagement
+                print_success(f"Engagement set to: {ENGAGEMENT}")
+        else:
+            print_error("Usage: :engage <n> | :engage switch <n> | :engage list")
+            
+    elif user_input.startswith(":highlights from "):
+        show_highlight_source(user_input[len(":highlights from "):].strip())
+    elif user_input == ":highlights" or user_input.startswith(":highlights "):
+        highlights_command(user_input[len(":highlights"):])
     
-    init_db()
-    load_highlights()
+    elif user_input == ":history" or user_input.startswith(":history "):
+        query = user_input[len(":history"):].strip()
+        if query.startswith("prefix "):
+            show_history(query[len("prefix "):], prefix=True)
+        else:
+            show_history(query)
     
-    while True:
-        try:
-            # Show current directory in prompt with recording indicator
-            prompt_dir = os.path.basename(CURRENT_WORKING_DIR) if CURRENT_WORKING_DIR != os.path.expanduser('~') else '~'
-            recording_indicator = "🔴 " if RECORDING else ""
-            user_input = session.prompt(f'{recording_indicator}{ENGAGEMENT}:{prompt_dir}> ')
-            if user_input.strip() == "":
-                continue
-                
-            # Handle internal commands
-            if user_input.startswith(":engage"):
-                tokens = user_input.split()
-                if len(tokens) >= 2:
-                    if tokens[1] == "list":
-                        list_engagements()
-                    elif tokens[1] == "switch" and len(tokens) == 3:
-                        ENGAGEMENT = tokens[2].strip()
-                        load_highlights()  # Load highlights for new engagement
-                        print_success(f"Switched to engagement: {ENGAGEMENT}")
-                    else:
-                        ENGAGEMENT = tokens[1].strip()
-                        load_highlights()  # Load highlights for new engagement
-                        print_success(f"Engagement set to: {ENGAGEMENT}")
-                else:
-                    print_error("Usage: :engage <n> | :engage switch <n> | :engage list")
-                    
-            elif user_input == ":highlights":
-                show_highlights()
+    elif user_input.startswith(":extract"):
+        parts = user_input.split(None, 1)
+        if len(parts) == 2:
+            extract_highlights(parts[1])
+            print_success("Extraction complete")
+        else:
+            print_error("Usage: :extract <text>")
             
-            elif user_input.startswith(":extract"):
-                parts = user_input.split(None, 1)
-                if len(parts) == 2:
-                    extract_highlights(parts[1])
-                    print_success("Extraction complete")
-                else:
-                    print_error("Usage: :extract <text>")
-                    
-            elif user_input.startswith(":record"):
-                parts = user_input.split()
-                if len(parts) == 1:
-                    print_info(f"Recording status: {'🔴 ACTIVE' if RECORDING else '⚫ Inactive'}")
-                    print_info("Usage: :record start | :record stop | :record list | :record play <id>")
-                elif parts[1] == "start":
-                    start_recording()
-                elif parts[1] == "stop":
-                    stop_recording()
-                elif parts[1] == "list":
-                    list_recordings()
-                elif parts[1] == "play" and len(parts) == 3:
-                    if parts[2].isdigit():
-                        playback_recording(int(parts[2]))
-                    else:
-                        print_error("Recording ID must be a number")
-                elif parts[1] == "export" and len(parts) >= 3:
-                    if parts[2].isdigit():
-                        if len(parts) == 4 and parts[3] == "gif":
-                            export_recording_to_gif(int(parts[2]))
-                        else:
-                            print_info("Export format: gif (more formats coming soon)")
-                    else:
-                        print_error("Recording ID must be a number")
-                else:
-                    print_error("Unknown record command. Use: start, stop, list, play <id>, export <id> <format>")
-                    
-            elif user_input == ":log":
-                show_logs()
-            elif user_input.startswith(":log "):
-                parts = user_input.split()
-                if len(parts) == 2 and parts[1].isdigit():
-                    show_logs(int(parts[1]))
-                elif parts[1] == "full":
-                    show_logs(1000)
-                elif parts[1] == "raw":
-                    show_logs(5, show_sanitized=False)
-                else:
-                    print_error("Usage: :log [number] | :log full | :log raw")
-                    
-            elif user_input.startswith(":search "):
-                parts = user_input.split(None, 2)
-                if len(parts) == 2:
-                    search_logs(parts[1])
-                elif len(parts) == 3:
-                    search_logs(parts[2], parts[1])
-                else:
-                    print_error("Usage: :search <query> | :search <type> <query>")
-                    print_info("Types: command, output, tags, all")
-                    
-            elif user_input.startswith(":tag "):
-                tags = user_input[5:].split(',')
-                tags = [tag.strip() for tag in tags]
-                tag_last_command(tags)
-                
-            elif user_input.startswith(":export"):
-                parts = user_input.split()
-                if len(parts) == 1:
-                    export_logs('markdown')
-                elif parts[1] == 'pdf':
-                    create_pdf_report()
-                elif parts[1] in ['markdown', 'json']:
-                    export_logs(parts[1])
-                else:
-                    print_error("Supported formats: markdown, json, pdf")
-                    
-            elif user_input == ":dashboard":
-                create_html_dashboard()
-                    
-            elif user_input.startswith(":theme"):
-                parts = user_input.split()
-                if len(parts) == 1:
-                    show_themes()
-                elif len(parts) == 2:
-                    set_theme(parts[1])
-                else:
-                    print_error("Usage: :theme | :theme <theme_name>")
-                    
-            elif user_input == ":screenshot":
-                manual_screenshot()
-            elif user_input == ":screenshot auto":
-                toggle_auto_screenshot()
-            elif user_input.startswith(":screenshot "):
-                if user_input.endswith("toggle"):
-                    toggle_auto_screenshot()
-                else:
-                    print_error("Usage: :screenshot | :screenshot auto | :screenshot toggle")
-                    
-            elif user_input == ":alias":
-                show_aliases()
-            elif user_input == ":status":
-                show_status()
-            elif user_input == ":clear":
-                if confirm(f"⚠️ Delete ALL logs for engagement '{ENGAGEMENT}'?"):
-                    conn = sqlite3.connect(DB_PATH)
-                    c = conn.cursor()
-                    c.execute("DELETE FROM command_logs WHERE engagement=?", (ENGAGEMENT,))
-                    c.execute("DELETE FROM screenshots WHERE engagement=?", (ENGAGEMENT,))
-                    c.execute("DELETE FROM recordings WHERE engagement=?", (ENGAGEMENT,))
-                    c.execute("DELETE FROM highlights WHERE engagement=?", (ENGAGEMENT,))
-                    conn.commit()
-                    conn.close()
-                    HIGHLIGHTS.clear()
-                    print_success(f"Logs for `{ENGAGEMENT}` cleared.")
-                    
-            elif user_input == ":exit":
-                if RECORDING:
-                    print_warning("Recording in progress!")
-                    if confirm("Stop recording and exit?"):
-                        stop_recording()
-                    else:
-                        continue
-                
-                # Save highlights before exit
-                save_highlights()
-                        
-                if RICH_AVAILABLE:
-                    console.print("👋 [bold green]Goodbye! Stay safe out there.[/bold green]")
+    elif user_input.startswith(":record"):
+        parts = user_input.split()
+        if len(parts) == 1:
+            print_info(f"Recording status: {'🔴 ACTIVE' if RECORDING else '⚫ Inactive'}")
+            print_info("Usage: :record start | :record stop | :record list | :record play <id>")
+        elif parts[1] == "start":
+            start_recording()
+        elif parts[1] == "stop":
+            stop_recording()
+        elif parts[1] == "list":
+            list_recordings()
+        elif parts[1] == "play" and len(parts) == 3:
+            if parts[2].isdigit():
+                playback_recording(int(parts[2]))
+            else:
+                print_error("Recording ID must be a number")
+        elif parts[1] == "export" and len(parts) >= 3:
+            if parts[2].isdigit():
+                if len(parts) == 4 and parts[3] == "gif":
+                    export_recording_to_gif(int(parts[2]))
                 else:
-                    print("👋 Goodbye! Stay safe out there.")
-                break
+                    print_info("Export format: gif (more formats coming soon)")
+            else:
+                print_error("Recording ID must be a number")
+        else:
+            print_error("Unknown record command. Use: start, stop, list, play <id>, export <id> <format>")
+            
+    elif user_input == ":log":
+        show_logs()
+    elif user_input.startswith(":log "):
+        parts = user_input.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            show_logs(int(parts[1]))
+        elif parts[1] == "full":
+            show_logs(1000)
+        elif parts[1] == "raw":
+            show_logs(5, show_sanitized=False)
+        else:
+            print_error("Usage: :log [number] | :log full | :log raw")
+            
+    elif user_input.startswith(":search "):
+        parts = user_input.split(None, 2)
+        if len(parts) == 2:
+            search_logs(parts[1])
+        elif len(parts) == 3:
+            search_logs(parts[2], parts[1])
+        else:
+            print_error("Usage: :search <query> | :search <type> <query>")
+            print_info("Types: command, output, tags, all")
+            
+    elif user_input.startswith(":tag "):
+        tags = user_input[5:].split(',')
+        tags = [tag.strip() for tag in tags]
+        tag_last_command(tags)
+        
+    elif user_input.startswith(":export"):
+        parts = user_input.split()
+        since = None
+        if "--since" in parts:
+            idx = parts.index("--since")
+            if idx + 1 >= len(parts):
+                print_error("Usage: :export [format] --since <id|timestamp>")
+                return True
+            since = parts[idx + 1]
+            del parts[idx:idx + 2]
+        if len(parts) == 1:
+            export_logs('markdown', since=since)
+        elif parts[1] == 'all':
+            export_all(background=True)
+        elif parts[1] == 'pdf':
+            overrides = {}
+            for option in parts[2:]:
+                key, _, value = option.partition('=')
+                if key not in PDF_REPORT_CONFIG or not value:
+                    print_error(f"Unknown PDF option: {option}")
+                    print_info(f"Options: {', '.join(f'{k}=<value>' for k in PDF_REPORT_CONFIG)}")
+                    break
+                overrides[key] = int(value) if value.isdigit() else value
+            else:
+                create_pdf_report(**overrides)
+        elif parts[1] in ['markdown', 'json', 'ndjson']:
+            export_logs(parts[1], since=since)
+        else:
+            print_error("Supported formats: markdown, json, ndjson, pdf, all")
+            
+    elif user_input == ":dashboard":
+        create_html_dashboard()
+            
+    elif user_input.startswith(":theme"):
+        parts = user_input.split()
+        if len(parts) == 1:
+            show_themes()
+        elif len(parts) == 2:
+            set_theme(parts[1])
+        else:
+            print_error("Usage: :theme | :theme <theme_name>")
+            
+    elif user_input == ":screenshot":
+        manual_screenshot()
+    elif user_input == ":screenshot auto":
+        toggle_auto_screenshot()
+    elif user_input == ":screenshot text" or user_input.startswith(":screenshot text "):
+        text_screenshot(user_input[len(":screenshot text"):].strip())
+    elif user_input.startswith(":screenshot "):
+        if user_input.endswith("toggle"):
+            toggle_auto_screenshot()
+        else:
+            print_error("Usage: :screenshot | :screenshot auto | :screenshot toggle | :screenshot text [ids]")
+            
+    elif user_input == ":shell" or user_input.startswith(":shell "):
+        set_shell_mode(user_input[len(":shell"):].strip())
+    elif user_input == ":cache" or user_input.startswith(":cache "):
+        manage_cache(user_input[len(":cache"):].strip())
+    elif user_input.startswith(":nocache "):
+        run_command(user_input[len(":nocache "):].strip(), use_cache=False)
+    
+    elif user_input == ":diff" or user_input.startswith(":diff "):
+        ids = user_input.split()[1:]
+        if 1 <= len(ids) <= 2 and all(command_id.lstrip('#').isdigit() for command_id in ids):
+            show_diff(*(int(command_id.lstrip('#')) for command_id in ids))
+        else:
+            print_error("Usage: :diff <id1> <id2> | :diff <id> (against its previous run)")
+    
+    elif user_input == ":import" or user_input.startswith(":import "):
+        try:
+            patterns = shlex.split(user_input[len(":import"):])
+        except ValueError as e:  # e.g. an unclosed quote
+            print_error(f"Usage: :import <path|glob> ... ({e})")
+            return True
+        if patterns:
+            import_files(patterns)
+        else:
+            print_error("Usage: :import <path|glob> ...")
+    
+    elif user_input == ":hashes":
+        show_hashes()
+    elif user_input == ":hashes crack":
+        crack_stored_hashes()
+    elif user_input == ":hashes index" or user_input.startswith(":hashes index "):
+        build_hash_index(user_input[len(":hashes index"):].strip() or None)
+    
+    elif user_input == ":host":
+        list_hosts()
+    elif user_input.startswith(":host "):
+        show_host(user_input[len(":host "):].strip())
+    
+    elif user_input == ":alias":
+        show_aliases()
+    elif user_input == ":status":
+        show_status()
+    elif user_input == ":clear":
+        if ask_confirm(f"⚠️ Delete ALL logs for engagement '{ENGAGEMENT}'?"):
+            conn = findings_db()
+            c = conn.cursor()
+            # Rows without an engagement column (services, nmap ports and scripts,
+            # highlight sources) go with their parents through ON DELETE CASCADE
+            for table in ('screenshots', 'recordings', 'report_invalidations', 'hosts', 'urls', 'credentials',
+                          'hashes', 'nmap_scans', 'nmap_hosts', 'highlights', 'command_logs'):
+                c.execute(f"DELETE FROM {table} WHERE engagement=?", (ENGAGEMENT,))
+            conn.commit()
+            conn.close()
+            HIGHLIGHTS.clear()
+            clear_report_cache()
+            COMPLETION_INDEX.invalidate()
+            print_success(f"Logs for `{ENGAGEMENT}` cleared.")
+            
+    elif user_input == ":exit":
+        if RECORDING:
+            print_warning("Recording in progress!")
+            if ask_confirm("Stop recording and exit?"):
+                stop_recording()
+            else:
+                return True
+        
+        # Save highlights, pending screenshots and a running export before exit
+        save_highlights()
+        SCREENSHOT_WORKER.flush()
+        wait_for_export()
                 
-            elif user_input == ":help":
-                help_text = """
+        if require('rich'):
+            console.print("👋 [bold green]Goodbye! Stay safe out there.[/bold green]")
+        else:
+            print("👋 Goodbye! Stay safe out there.")
+        return False
+        
+    elif user_input == ":help":
+        help_text = """
 🔧 Enhanced RedTeam Terminal Commands:
 
 📁 ENGAGEMENT MANAGEMENT:
@@ -2007,8 +5995,19 @@ def main():
   :record export <id> gif → Export recording to GIF (coming soon)
 
 🎯 AUTO-EXTRACTION:
-  :highlights            → Show extracted IPs, URLs, credentials, etc.
+  :highlights            → Show extracted IPs, URLs, credentials, etc. (first page)
+  :highlights <cat> [filter] [page N] → One category, filtered by substring, paged
+  :highlights from <val> → Jump to the command and output a value came from
+  :highlights IPs <cidr> → Extracted IPs inside a range (e.g. 10.10.0.0/16)
   :extract <text>        → Manually extract highlights from text
+  :host                  → List discovered hosts with open-service counts
+  :host <ip>             → Services, URLs, credentials and hashes for one host
+  :hashes                → Hashes with their type and cracked plaintext
+  :import <path|glob>    → Load nmap/gobuster/hydra/responder/... output files from disk
+  :diff <id1> <id2>      → New, gone and changed ports/paths (or lines) between two commands
+  :diff <id>             → The same against the previous run of that command
+  :hashes index [list]   → Build the offline lookup index (default: rockyou.txt)
+  :hashes crack          → Look up stored hashes in the index again
 
 📊 LOGGING & SEARCH:
   :log                   → Show last 5 commands (sanitized)
@@ -2017,12 +6016,18 @@ def main():
   :log raw               → Show unsanitized output
   :search <query>        → Search all fields
   :search <type> <query> → Search specific field (command/output/tags/all)
+  :history [text]        → Recent distinct commands containing text
+  :history prefix <text> → Recent distinct commands starting with text
 
 🏷️ TAGGING & EXPORT:
   :tag <tag1,tag2>       → Tag last command
   :export                → Export markdown report
   :export json           → Export JSON report
+  :export ndjson         → Export one JSON command per line
+  :export <fmt> --since <id|timestamp> → Incremental export
   :export pdf            → Export professional PDF report
+  :export pdf key=value  → Override PDF options (group_by, sampling, workers, ...)
+  :export all            → Render markdown, JSON, PDF and HTML in the background
   :dashboard             → Generate HTML dashboard with charts
 
 🎨 THEMES & STYLING:
@@ -2033,9 +6038,15 @@ def main():
   :screenshot            → Take manual screenshot
   :screenshot auto       → Toggle auto-screenshot mode
   :screenshot toggle     → Toggle auto-screenshot mode
+  :screenshot text       → Render last command output as an evidence image
+  :screenshot text <ids> → Render logged commands (e.g. 3 7-12) in parallel
 
 🔧 UTILITIES:
   :alias                 → Show available command aliases
+  :shell persistent      → Run commands in one long-lived bash (keeps exports, venvs)
+  :shell fresh           → Run each command in a fresh /bin/sh (default)
+  :cache on|off|clear    → Replay cached output of deterministic lookups
+  :nocache <command>     → Run for real, bypassing (and refreshing) the cache
   :status                → Show engagement stats & settings
   :clear                 → Clear engagement logs & recordings
   :help                  → Show this help
@@ -2051,19 +6062,276 @@ def main():
 📦 DEPENDENCIES:
   pip install rich reportlab pyautogui pillow prompt_toolkit asciinema imageio[ffmpeg]
 """
-                if RICH_AVAILABLE:
-                    console.print(Panel(help_text, title="Help", style="cyan"))
-                else:
-                    print(help_text)
-            else:
-                # Execute as shell command
-                run_command(user_input)
+        if require('rich'):
+            console.print(Panel(help_text, title="Help", style="cyan"))
+        else:
+            print(help_text)
+    else:
+        # Execute as shell command
+        run_command(user_input)
+    return True
+
+# ─────────────── LIBRARY API & BATCH MODE ───────────────
+def run_batch(lines):
+    """Run a script of shell and :internal commands without prompt_toolkit.
+    
+    Blank lines and '#' comments are skipped; a ':exit' line stops the run.
+    Returns the number of commands that failed or were not run.
+    """
+    failed = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        print_styled(f"{ENGAGEMENT}> {line}", 'secondary')
+        if line.startswith(':'):
+            if not handle_input(line):
+                break
+        else:
+            command_id = run_command(line)
+            if command_id is None or last_status == 'error':
+                failed += 1
+    
+    save_highlights()
+    SCREENSHOT_WORKER.flush()
+    return failed
+
+class RedTermSession:
+    """Drive an engagement from other tooling through the same logging and
+    extraction path as the interactive terminal.
+    
+    Importing the module has no side effects; the session sets up the
+    database and the engagement's highlights. The runtime state is
+    module-global, so each call swaps the session's engagement, working
+    directory and highlights in and back out - sessions can be interleaved
+    but not used from several threads at once.
+    
+        with RedTermSession("acme", quiet=True) as s:
+            result = s.run("nmap -sV 10.0.0.5")
+            s.export('json')
+    """
+    
+    def __init__(self, engagement="default", db_path=None, cwd=None, quiet=False, assume_yes=False):
+        self.engagement = engagement
+        self.db_path = os.path.abspath(db_path or DB_PATH)
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.quiet = quiet
+        self.assume_yes = assume_yes
+        self.highlights = Highlights(engagement, self.db_path)
+        with self.active():
+            init_db()
+            load_highlights()
+    
+    @contextlib.contextmanager
+    def active(self):
+        """Make this session's state the module's runtime state for a block"""
+        global ENGAGEMENT, DB_PATH, CURRENT_WORKING_DIR, HIGHLIGHTS, QUIET, BATCH_MODE, BATCH_ASSUME_YES
+        saved = (ENGAGEMENT, DB_PATH, CURRENT_WORKING_DIR, HIGHLIGHTS, QUIET, BATCH_MODE, BATCH_ASSUME_YES)
+        saved_cwd = os.getcwd()
+        ENGAGEMENT, DB_PATH, CURRENT_WORKING_DIR, HIGHLIGHTS = self.engagement, self.db_path, self.cwd, self.highlights
+        QUIET, BATCH_MODE, BATCH_ASSUME_YES = self.quiet, True, self.assume_yes
+        os.chdir(self.cwd)  # Reports and screenshots land where the REPL would put them
+        try:
+            yield self
+        finally:
+            # cd and :engage may have moved the session on
+            self.engagement, self.cwd, self.highlights = ENGAGEMENT, CURRENT_WORKING_DIR, HIGHLIGHTS
+            ENGAGEMENT, DB_PATH, CURRENT_WORKING_DIR, HIGHLIGHTS, QUIET, BATCH_MODE, BATCH_ASSUME_YES = saved
+            os.chdir(saved_cwd)
+    
+    def run(self, command, use_cache=True):
+        """Run and log a shell command; returns its log row as a dict (None if not run)"""
+        with self.active():
+            command_id = run_command(command, use_cache)
+            if command_id is None:
+                return None
+            save_highlights()
+            conn = sqlite3.connect(DB_PATH)
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT id, command, output, status, execution_time, timestamp, cached FROM command_logs WHERE id=?",
+                               (command_id,)).fetchone()
+            conn.close()
+            result = dict(row)
+            result['records'] = list(last_records)
+            return result
+    
+    def execute(self, line):
+        """Run one line as typed at the prompt (:commands included); False after :exit"""
+        with self.active():
+            return handle_input(line)
+    
+    def batch(self, lines):
+        """Run a script of lines; returns the number of failed commands"""
+        with self.active():
+            return run_batch(lines)
+    
+    def extract(self, text):
+        """Add highlights found in arbitrary text to the engagement"""
+        with self.active():
+            extract_highlights(text)
+            save_highlights()
+        return self.highlights
+    
+    def host(self, address):
+        """Findings for one host as a dict of services, urls, credentials and hashes (None if unknown)"""
+        with self.active():
+            return host_findings(address)
+    
+    def export(self, format_type='markdown', since=None):
+        """Render a report for the engagement; returns the file written"""
+        with self.active():
+            if format_type == 'pdf':
+                return create_pdf_report()
+            if format_type == 'html':
+                return create_html_dashboard()
+            return export_logs(format_type, since=since)
+    
+    def close(self):
+        """Persist highlights and wait for pending screenshots"""
+        with self.active():
+            save_highlights()
+            SCREENSHOT_WORKER.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+# ─────────────── MAIN LOOP ───────────────
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Enhanced RedTeam Terminal")
+    parser.add_argument('-e', '--engagement', default=ENGAGEMENT,
+                        help="engagement to start in (default: %(default)s)")
+    parser.add_argument('--export', choices=EXPORT_ALL_FORMATS + ('all',),
+                        help="render report(s) for the engagement and exit")
+    parser.add_argument('--batch', metavar='SCRIPT',
+                        help="run commands from SCRIPT ('-' for stdin) without the interactive prompt")
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help="in batch mode, answer yes to confirmations (e.g. dangerous commands)")
+    parser.add_argument('--persistent-shell', action='store_true',
+                        help="run commands in one long-lived bash so shell state persists")
+    parser.add_argument('--import', nargs='+', dest='import_paths', metavar='PATH',
+                        help="import existing tool output files, directories or globs and exit")
+    parser.add_argument('--cache', action='store_true',
+                        help="replay cached output of deterministic lookups (see CACHE_TTLS)")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="report import and init time per component before the first prompt")
+    return parser.parse_args(argv)
+
+def timed_step(component, func, *args):
+    """Run one startup step, recording its duration for --startup-profile"""
+    start = time.perf_counter()
+    result = func(*args)
+    STARTUP_TIMINGS.append((component, time.perf_counter() - start))
+    return result
+
+def show_startup_profile():
+    """Print where the time to first prompt went"""
+    total = time.perf_counter() - STARTUP_BEGIN
+    rows = [
+        ("stdlib imports", IMPORTS_END - STARTUP_BEGIN),
+        ("module body", MODULE_END - IMPORTS_END),
+    ] + STARTUP_TIMINGS + [(f"  ↳ import {OPTIONAL_DEPENDENCIES[name][0]}", seconds)
+                           for name, seconds in CAPABILITY_TIMINGS.items()]
+    
+    print("\n⏱️ Startup profile:")
+    for component, seconds in rows:
+        print(f"  {component:<26} {seconds * 1000:8.1f} ms")
+    print(f"  {'time to first prompt':<26} {total * 1000:8.1f} ms (budget {STARTUP_BUDGET_MS} ms)")
+    optional = ', '.join(f"{name} {'✓' if probe_capability(name) else '✗'}" for name in OPTIONAL_DEPENDENCIES)
+    print(f"  optional: {optional}\n")
+    if total * 1000 > STARTUP_BUDGET_MS:
+        print_warning(f"Startup took {total * 1000:.0f} ms - over the {STARTUP_BUDGET_MS} ms budget")
+
+def show_banner():
+    """Print the startup banner"""
+    if require('rich'):
+        startup_text = """
+[bold red]🔴 Enhanced RedTeam Terminal v2.3[/bold red]
+[cyan]Features:[/cyan] TTY Support • Auto-Extraction • Real-time Output • Interactive Commands
+[dim]Type :help for commands | :record start to begin recording[/dim]
+        """
+        console.print(Panel(startup_text, style="bold"))
+    else:
+        print("🔴 Enhanced RedTeam Terminal v2.3 | OSCP-Compatible")
+        print("Features: TTY Support • Auto-Extraction • Real-time Output")
+        print("Type :help for available commands\n")
+
+def main(argv=None):
+    global ENGAGEMENT, DB_PATH, BATCH_MODE, BATCH_ASSUME_YES
+    global PERSISTENT_SHELL, RESULT_CACHE, NMAP_XML_DIR, HASH_INDEX_DIR
+    
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    args = parse_args(argv)
+    ENGAGEMENT = args.engagement
+    PERSISTENT_SHELL = args.persistent_shell
+    RESULT_CACHE = RESULT_CACHE or args.cache
+    # cd changes the process working directory
+    DB_PATH, NMAP_XML_DIR, HASH_INDEX_DIR = map(os.path.abspath, (DB_PATH, NMAP_XML_DIR, HASH_INDEX_DIR))
+    
+    if args.export:
+        init_db()
+        load_highlights()
+        export_all(EXPORT_ALL_FORMATS if args.export == 'all' else (args.export,))
+        return 0
+    
+    if args.import_paths:
+        init_db()
+        load_highlights()
+        return 1 if import_files(args.import_paths) else 0
+    
+    if args.batch:
+        BATCH_MODE, BATCH_ASSUME_YES = True, args.yes
+        init_db()
+        load_highlights()
+        if args.batch == '-':
+            failed = run_batch(sys.stdin)
+        else:
+            with open(args.batch) as f:
+                failed = run_batch(f)
+        if failed:
+            print_warning(f"{failed} command(s) failed")
+        return 1 if failed else 0
+    
+    # Create necessary directories
+    timed_step("directories", lambda: (ensure_screenshot_dir(), ensure_recordings_dir()))
+    timed_step("banner", show_banner)
+    timed_step("init_db", init_db)
+    timed_step("load_highlights", load_highlights)
+    session = timed_step("prompt session", create_prompt_session)
+    if args.startup_profile:
+        show_startup_profile()
+    
+    session_engagement = ENGAGEMENT
+    while True:
+        try:
+            # History is per engagement - rebuild the session after a switch
+            if ENGAGEMENT != session_engagement:
+                session, session_engagement = create_prompt_session(), ENGAGEMENT
+            
+            # Show current directory in prompt with recording indicator
+            prompt_dir = os.path.basename(CURRENT_WORKING_DIR) if CURRENT_WORKING_DIR != os.path.expanduser('~') else '~'
+            recording_indicator = "🔴 " if RECORDING else ""
+            # patch_stdout keeps background export reports from corrupting the prompt
+            with patch_stdout():
+                user_input = session.prompt(f'{recording_indicator}{ENGAGEMENT}:{prompt_dir}> ')
+            if user_input.strip() == "":
+                continue
+                
+            if not handle_input(user_input):
+                break
                 
         except KeyboardInterrupt:
             print_info("Use :exit to quit gracefully")
             continue
         except EOFError:
             break
+    wait_for_export()
+    return 0
+
+MODULE_END = time.perf_counter()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""Terminal emulation of streamed command output."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import oscpterm  # noqa: E402
+
+
+@pytest.fixture
+def keep_sgr(monkeypatch):
+    monkeypatch.setattr(oscpterm, 'OUTPUT_KEEP_SGR', True)
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    (['red\x1b[0m', '\nnext\n'], 'red\x1b[0m\nnext\n'),
+    (['\x1b[31m', '\nfoo\n'], '\x1b[31m\nfoo\n'),
+    (['\x1b[3', '1mred\x1b[0m\n'], '\x1b[31mred\x1b[0m\n'),
+    (['\x1b[1mbold', '\x1b[0m', '\n'], '\x1b[1mbold\x1b[0m\n'),
+])
+def test_sgr_split_across_chunks(keep_sgr, chunks, expected):
+    capture = oscpterm.OutputCapture()
+    for chunk in chunks:
+        capture.feed(chunk)
+    capture.finish()
+    assert capture.text == expected
+
+
+def test_sgr_dropped_by_default():
+    capture = oscpterm.OutputCapture()
+    for chunk in ('\x1b[31mred\x1b[0m', '\nnext\n'):
+        capture.feed(chunk)
+    assert capture.text == 'red\nnext\n'
+
+
+def test_provenance_offsets_point_into_coloured_output(keep_sgr, monkeypatch):
+    monkeypatch.setattr(oscpterm, 'HIGHLIGHTS', oscpterm.Highlights())
+    capture = oscpterm.OutputCapture('echo')
+    for chunk in ('plain 10.1.1.1\n', '\x1b[31mred\x1b[0m \x1b[1mbold\x1b[0m 10.9.9.9\n'):
+        completed = capture.feed(chunk)
+        oscpterm.scan_output(completed, capture)
+    text = capture.text
+    for address in ('10.1.1.1', '10.9.9.9'):
+        offset = capture.sources[('IPs', address)]
+        assert text[offset:offset + len(address)] == address
@@ -0,0 +1,35 @@
+"""Re-runs of parsed tools are diffed without breaking the report exports."""
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import oscpterm  # noqa: E402
+
+FAKE_NMAP = """#!/bin/sh
+echo "Nmap scan report for 10.10.10.5"
+echo "PORT   STATE SERVICE"
+cat "$(dirname "$0")/ports"
+"""
+
+
+def test_export_after_diffed_scan(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    nmap = bin_dir / "nmap"
+    nmap.write_text(FAKE_NMAP)
+    nmap.chmod(nmap.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    with oscpterm.RedTermSession("difftest", db_path=tmp_path / "test.db", cwd=tmp_path, quiet=True) as session:
+        (bin_dir / "ports").write_text("22/tcp open  ssh\n")
+        first = session.run("nmap 10.10.10.5", use_cache=False)
+        (bin_dir / "ports").write_text("22/tcp open  ssh\n80/tcp open  http\n")
+        second = session.run("nmap 10.10.10.5", use_cache=False)
+        assert session.execute(f":diff {first['id']} {second['id']}") is not False
+
+        for format_type in ('markdown', 'json', 'ndjson', 'html'):
+            filename = session.export(format_type)
+            assert filename and (tmp_path / filename).exists()
+
+        assert [value for value, _ in session.highlights.values('New_Ports')] == ['10.10.10.5:80/tcp (http)']